@@ -16,6 +16,8 @@
 # This file is part of Jatgam Computer Simulator.
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 import argparse
+import contextlib
+import json
 import logging
 import os
 from pathlib import Path
@@ -25,7 +27,18 @@ import math
 from tkinter import filedialog
 from tkinter import Tk
 
-from computersimulator.hardware.SimulatedCPU import SimulatedCPU
+from computersimulator.hardware.SimulatedCPU import SimulatedCPU, ENGINES, DEFAULT_DISK
+from computersimulator.hardware.InstructionTrace import InstructionTrace
+from computersimulator.system.InterruptScript import InterruptScript, formatReport
+from computersimulator.system.Checkpoint import loadCheckpoint
+from computersimulator.system.ProgramCache import ProgramCache
+from computersimulator.system.MemoryAllocator import MemoryAllocator
+from computersimulator.system.PCBQueue import PCBQueue, WaitQueue
+from computersimulator.system.SharedMemory import SharedMemory
+from computersimulator.system.Scheduler import SCHEDULERS
+from computersimulator.filesystem.SectorAllocator import SectorAllocator, writeBitmapRun
+from computersimulator.filesystem.FileSystem import FileSystem
+from computersimulator.filesystem.Executable import unpackHeader, HEADER_SIZE
 import computersimulator.utils.listutils as listutils
 import computersimulator.constants as constants
 
@@ -33,19 +46,70 @@ CONST = constants.Constants
 
 class ComputerSimulator:
 
-    osFreeList = CONST.EOL  # OS Free Mem List
-    userFreeList = CONST.EOL  # User Free Mem List
+    osFreeList = CONST.EOL  # OS Free Mem List bin table
+    userFreeList = CONST.EOL  # User Free Mem List bin table
     pid = 0  # Process ID
-    RQptr = CONST.EOL  # Ready Queue Pointer
-    WQptr = CONST.EOL  # waiting queue pointer
     RunningPCBptr = CONST.EOL  # Whats currently Running
+    nullPid = CONST.EOL  # PID of the null process
 
     memoryLists = {"osFreeList": {"start": 7000, "size": 3000},
                   "userFreeList": {"start": 3000, "size": 4000}}
+    memStatsLists = ("userFreeList", "osFreeList")  # mem_stats GPR1 -> list
 
-    def __init__(self):
+    def __init__(self, engine="dispatch", interruptScript=None, verbose=True,
+                 diskPath=DEFAULT_DISK, messageQueueDepth=CONST.MSG_QUEUE_DEPTH,
+                 scheduler="priority"):
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.scpu = SimulatedCPU()
+        self.scpu = SimulatedCPU(engine, diskPath)
+        self.interruptScript = interruptScript  # Replaces interactive interrupts
+        self.verbose = verbose  # Dump queues and memory at context switches
+        self.exitStatuses = {}  # PID -> exit status of terminated processes
+        self.sectorAllocator = None  # Partition 1 sectors, set up with the disk
+        self.fileSystem = None  # Partition 1 FAT, mounted with the disk
+        self.programCache = ProgramCache()  # Parsed text programs
+        if (messageQueueDepth < 1):
+            raise ValueError("Message queue depth must be at least 1, got %d"
+                             % messageQueueDepth)
+        self.messageQueueDepth = messageQueueDepth  # Messages a new process can queue
+        self.memoryAllocators = {key: MemoryAllocator(self.scpu.sram, value["start"],
+                                                      value["size"])
+                                 for key, value in self.memoryLists.items()}
+        self.readyQueue = PCBQueue(self.scpu.sram)
+        if scheduler not in SCHEDULERS:
+            raise ValueError("Invalid scheduler. Expected one of: %s" % (tuple(SCHEDULERS),))
+        self.scheduler = SCHEDULERS[scheduler](self.readyQueue, self.scpu)
+        self.waitQueue = WaitQueue(self.scpu.sram)
+        self.pcbIndex = {}  # PID -> PCB of every live process
+        # Holders of mem_alloc blocks
+        self.sharedMemory = SharedMemory(self.memoryAllocators["userFreeList"])
+
+    @property
+    def RQptr(self):
+        """Ready Queue Pointer, the first PCB of the ready queue."""
+        return self.readyQueue.head
+
+    @RQptr.setter
+    def RQptr(self, pcbptr):
+        self.readyQueue.rebuild(pcbptr)
+        self.scheduler.rebuild()
+
+    @property
+    def WQptr(self):
+        """Waiting Queue Pointer, the first PCB of the waiting queue."""
+        return self.waitQueue.head
+
+    @WQptr.setter
+    def WQptr(self, pcbptr):
+        self.waitQueue.rebuild(pcbptr)
+
+    def rebuildPCBIndex(self):
+        """Indexes every queued and running PCB by PID, as after a restore."""
+        self.pcbIndex = {}
+        for queue in (self.readyQueue, self.waitQueue):
+            for pcbptr in queue.members:
+                self.pcbIndex[self.scpu.sram.ram[pcbptr+3]] = pcbptr
+        if (self.RunningPCBptr != CONST.EOL):
+            self.pcbIndex[self.scpu.sram.ram[self.RunningPCBptr+3]] = self.RunningPCBptr
 
     def initializeSystem(self):
         """Sets all hardware variables to zero. Initializes the user and OS
@@ -57,22 +121,30 @@ class ComputerSimulator:
         self.scpu.clock = 0
         for curgpr in range(len(self.scpu.gpr)):
             self.scpu.gpr[curgpr] = 0
-        for mempos in range(len(self.scpu.sram.ram)):
-            self.scpu.sram.ram[mempos] = 0
+        self.scpu.sram.clear()
+        self.scpu.invalidateDecodeCache()
+        self.RQptr = CONST.EOL
+        self.WQptr = CONST.EOL
+        self.pcbIndex = {}
+        self.scheduler.resetStats()
+        self.sharedMemory = SharedMemory(self.memoryAllocators["userFreeList"])
         self._checkDisk()
+        self.sectorAllocator = SectorAllocator(self.scpu.bufferCache)
+        self.fileSystem = FileSystem(self.scpu.bufferCache, self.sectorAllocator)
 
         # Initialize Memory Lists
         for key, value in self.memoryLists.items():
             vars(self)[key] = value["start"]
-            self.scpu.sram.ram[value["start"]] = CONST.EOL
-            self.scpu.sram.ram[value["start"] + 1] = value["size"]
+            self.memoryAllocators[key].format()
 
     def _checkDisk(self):
-        if (self.scpu.sdisk.disk[0] == [0]*self.scpu.sdisk.sectorSize):
+        mbr = self.scpu.bufferCache.readSector(0)
+        if (mbr == [0]*self.scpu.sdisk.sectorSize):
             #Disk Not Formatted!
             print("Disk not formatted, proceeding with format.")
             self._formatDisk()
-        elif (listutils.numJoin(self.scpu.sdisk.disk[0][0:2]) != CONST.PARTITION_TYPE):
+            self.scpu.bufferCache.flush()
+        elif (listutils.numJoin(mbr[0:2]) != CONST.PARTITION_TYPE):
             print("Unsupported File System! Quitting!")
             sys.exit()
         else:
@@ -89,19 +161,19 @@ class ComputerSimulator:
         part1fatStart = int(part1size/2)
         part1bitmapsize = math.ceil(part1size/self.scpu.sdisk.sectorSize)
         #Creating the MBR
-        self.scpu.sdisk.disk[0][0:2] = listutils.numSplit(CONST.PARTITION_TYPE)
-        self.scpu.sdisk.disk[0][2:8] = listutils.numSplit(format(1, "06d"))
-        self.scpu.sdisk.disk[0][8:14] = listutils.numSplit(
-            format(part1size, "06d"))
+        self.scpu.bufferCache.writeSector(0, listutils.numSplit(CONST.PARTITION_TYPE), 0)
+        self.scpu.bufferCache.writeSector(0, listutils.numSplit(format(1, "06d")), 2)
+        self.scpu.bufferCache.writeSector(0, listutils.numSplit(
+            format(part1size, "06d")), 8)
         #Creating First Sector of Partition
-        self.scpu.sdisk.disk[1][0:6] = listutils.numSplit(
-            format(part1fatStart, "06d"))
-        self.scpu.sdisk.disk[1][6:12] = listutils.numSplit(
-            format(CONST.FAT_SIZE, "06d"))
-        self.scpu.sdisk.disk[1][12:18] = listutils.numSplit(format(2, "06d"))
-        self.scpu.sdisk.disk[1][18:24] = listutils.numSplit(
-            format(part1bitmapsize, "06d"))
-        self.scpu.sdisk.disk[1][110:128] = list(idle)
+        self.scpu.bufferCache.writeSector(1, listutils.numSplit(
+            format(part1fatStart, "06d")), 0)
+        self.scpu.bufferCache.writeSector(1, listutils.numSplit(
+            format(CONST.FAT_SIZE, "06d")), 6)
+        self.scpu.bufferCache.writeSector(1, listutils.numSplit(format(2, "06d")), 12)
+        self.scpu.bufferCache.writeSector(1, listutils.numSplit(
+            format(part1bitmapsize, "06d")), 18)
+        self.scpu.bufferCache.writeSector(1, idle, 110)
         #Initializing Sector Bitmap
         slack = self.scpu.sdisk.sectorSize - \
             (part1size % self.scpu.sdisk.sectorSize)
@@ -113,41 +185,7 @@ class ComputerSimulator:
 
     def partBitmapUpdate(self, bitstart, bitsize, start, size, op):
         """Updates the bitmap and either marks free, used, or system."""
-        bstartsec = math.ceil(start/self.scpu.sdisk.sectorSize)-1
-        bendsec = math.ceil((start+size)/self.scpu.sdisk.sectorSize)-1
-        if (start <= self.scpu.sdisk.sectorSize):
-            if (bstartsec == bendsec):
-                if (start-1 == 0):
-                    self.scpu.sdisk.disk[bitstart
-                                         + bstartsec][start-1:size] = [op]*size
-                else:
-                    self.scpu.sdisk.disk[bitstart
-                                         + bstartsec][start-1:size+1] = [op]*size
-            else:
-                offset = start
-                newstart = self.scpu.sdisk.sectorSize+1
-                while (offset <= self.scpu.sdisk.sectorSize):
-                    self.scpu.sdisk.disk[bitstart+bstartsec][offset-1] = op
-                    offset += 1
-                    size -= 1
-                self.partBitmapUpdate(bitstart, bitsize, newstart, size, op)
-        else:
-            offset = start % self.scpu.sdisk.sectorSize
-            if (bstartsec == bendsec):
-                if (offset-1 == 0):
-                    self.scpu.sdisk.disk[bitstart
-                                         + bstartsec][offset-1:size] = [op]*size
-                else:
-                    self.scpu.sdisk.disk[bitstart
-                                         + bstartsec][offset-1:size+1] = [op]*size
-            else:
-                newstart = (start+size)-((start+size) %
-                                         self.scpu.sdisk.sectorSize)+1
-                while (offset <= self.scpu.sdisk.sectorSize):
-                    self.scpu.sdisk.disk[bitstart+bstartsec][offset-1] = op
-                    offset += 1
-                    size -= 1
-                self.partBitmapUpdate(bitstart, bitsize, newstart, size, op)
+        writeBitmapRun(self.scpu.bufferCache, bitstart, start-1, size, op)
 
     def systemCall(self, sysCallID):
         """
@@ -198,37 +236,48 @@ class ComputerSimulator:
             print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
             print("Input: Size: {}, Start: {}".format(self.scpu.gpr[2], self.scpu.gpr[1]))
             print("-------------------------------")
-        elif (sysCallID == CONST.MSG_QSEND):
-            status = self.msgQsend()
-            if (status == CONST.ER_TID):
-                print("-------------------------------")
-                print("System Call Recieved: msg_qsend")
-                print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
+        elif (sysCallID == CONST.MEM_GRANT) or (sysCallID == CONST.MEM_TRANSFER):
+            status = self.memShare(sysCallID == CONST.MEM_TRANSFER)
+            print("-------------------------------")
+            print("System Call Recieved: {}".format(
+                "mem_grant" if sysCallID == CONST.MEM_GRANT else "mem_transfer"))
+            print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
+            print("Input: PID: {}, Start: {}".format(self.scpu.gpr[1], self.scpu.gpr[2]))
+            print("Output: Status: {}".format(self.scpu.gpr[0]))
+            print("-------------------------------")
+        elif (sysCallID == CONST.MSG_QSEND) or (sysCallID == CONST.MSG_QSEND_BATCH):
+            if (sysCallID == CONST.MSG_QSEND):
+                status = self.msgQsend()
+            else:
+                status = self.msgQsendBatch()
+            print("-------------------------------")
+            print("System Call Recieved: {}".format(
+                "msg_qsend" if sysCallID == CONST.MSG_QSEND else "msg_qsend_batch"))
+            print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
+            if (self.scpu.gpr[0] == CONST.ER_TID):
                 print("Output: PID Invalid")
-                print("-------------------------------")
+            elif (self.scpu.gpr[0] == CONST.ER_QFL):
+                print("Output: Queue Full")
             else:
-                print("-------------------------------")
-                print("System Call Recieved: msg_qsend")
-                print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
                 print("Output: Message Sent")
-                print("-------------------------------")
-        elif (sysCallID == CONST.MSG_QRECIEVE):
+            print("-------------------------------")
+        elif (sysCallID == CONST.MSG_QRECIEVE) or (sysCallID == CONST.MSG_QRECIEVE_BATCH):
             ptr = self.RunningPCBptr
-            status = self.msgQRecieve()
+            if (sysCallID == CONST.MSG_QRECIEVE):
+                status = self.msgQRecieve()
+            else:
+                status = self.msgQRecieveBatch()
+            print("-------------------------------")
+            print("System Call Recieved: {}".format(
+                "msg_qrecieve" if sysCallID == CONST.MSG_QRECIEVE else "msg_qrecieve_batch"))
+            print("PID that issued: {}".format(self.scpu.sram.ram[ptr+3]))
             if (status == CONST.WAITING):
-                print("-------------------------------")
-                print("System Call Recieved: msg_qrecieve")
-                print("PID that issued: {}".format(self.scpu.sram.ram[ptr+3]))
                 print("Output: Waiting for message")
                 print("-------------------------------")
                 self.scpu.psr = CONST.USERMODE
                 return CONST.WAITING
-            else:
-                print("-------------------------------")
-                print("System Call Recieved: msg_qrecieve")
-                print("PID that issued: {}".format(self.scpu.sram.ram[ptr+3]))
-                print("Output: Got Message")
-                print("-------------------------------")
+            print("Output: Got Message")
+            print("-------------------------------")
         elif (sysCallID == CONST.IO_GETC):
             self.scpu.sram.ram[self.RunningPCBptr+4] = CONST.WAITINGGET
             self.scpu.sram.ram[self.RunningPCBptr+1] = CONST.WAITING
@@ -249,6 +298,29 @@ class ComputerSimulator:
             print("-------------------------------")
             self.scpu.psr = CONST.USERMODE
             return CONST.WAITING
+        elif (sysCallID == CONST.DISK_READ) or (sysCallID == CONST.DISK_WRITE):
+            ptr = self.RunningPCBptr
+            status = self.diskRequest(sysCallID)
+            print("-------------------------------")
+            print("System Call Recieved: {}".format(
+                "disk_read" if sysCallID == CONST.DISK_READ else "disk_write"))
+            print("PID that issued: {}".format(self.scpu.sram.ram[ptr+3]))
+            print("Input: Sector: {}, Address: {}".format(self.scpu.gpr[1], self.scpu.gpr[2]))
+            if (status == CONST.WAITING):
+                print("Output: Waiting for Disk Completion")
+                print("-------------------------------")
+                self.scpu.psr = CONST.USERMODE
+                return CONST.WAITING
+            print("Output: Status: {}".format(self.scpu.gpr[0]))
+            print("-------------------------------")
+        elif (sysCallID == CONST.MEM_STATS):
+            status = self.memStats(self.scpu.gpr[1])
+            print("-------------------------------")
+            print("System Call Recieved: mem_stats")
+            print("PID that issued: {}".format(self.scpu.sram.ram[self.RunningPCBptr+3]))
+            print("Output: Status: {}, Free: {}, Largest: {}, Blocks: {}".format(
+                self.scpu.gpr[0], self.scpu.gpr[1], self.scpu.gpr[2], self.scpu.gpr[3]))
+            print("-------------------------------")
         elif (sysCallID == CONST.TIME_GET):
             self.scpu.gpr[1] = self.scpu.clock
             print("-------------------------------")
@@ -269,6 +341,44 @@ class ComputerSimulator:
         self.scpu.psr = CONST.USERMODE
         return status
 
+    def diskRequest(self, op):
+        """
+        System Call, queues a transfer of the sector in GPR1 to or from the
+        sector sized buffer at the address in GPR2. The process waits in the
+        WQ until diskCompletionInterrupt wakes it with the status in GPR0.
+
+        Parameters:
+            op          DISK_READ or DISK_WRITE
+
+        Returns:
+            WAITING     transfer queued
+            OK          invalid sector or buffer, GPR0 is ER_INVALIDADDR
+        """
+        sector = self.scpu.gpr[1]
+        address = self.scpu.gpr[2]
+        if (sector < 0) or (sector >= self.scpu.sdisk.numSectors) or (address < 0) or \
+                (address + self.scpu.sdisk.sectorSize > self.scpu.sram.ramSize):
+            self.scpu.gpr[0] = CONST.ER_INVALIDADDR
+            return CONST.OK
+        self.scpu.diskController.submit(self.scpu.sram.ram[self.RunningPCBptr+3],
+                                        op, sector, address, self.scpu.clock)
+        self.scpu.sram.ram[self.RunningPCBptr+4] = CONST.WAITINGDISK
+        self.scpu.sram.ram[self.RunningPCBptr+1] = CONST.WAITING
+        return CONST.WAITING
+
+    def diskCompletionInterrupt(self):
+        """
+        Moves every process whose disk transfer has completed from the WQ to
+        the RQ with the transfer status in its GPR0.
+        """
+        for pid, status in self.scpu.diskController.poll(self.scpu.clock):
+            pcbptr = self.searchRemoveWQ(pid)
+            if (pcbptr == CONST.EOL):
+                continue
+            self.scpu.sram.ram[pcbptr+5] = status
+            self.scpu.sram.ram[pcbptr+1] = CONST.READY
+            self.insertRQ(pcbptr)
+
     def mem_alloc(self, size):
         """
         System Call,Takes supplied size of memory allocation and tries to
@@ -283,6 +393,8 @@ class ComputerSimulator:
         """
         status = self.allocateMemory(size, "userFreeList")
         if (status >= 0):
+            self.sharedMemory.register(status, size,
+                                       self.scpu.sram.ram[self.RunningPCBptr+3])
             self.scpu.gpr[1] = status  # GPR1 Gets pointer to memory
             self.scpu.gpr[0] = CONST.OK  # GPR0 Gets OK Status
         else:
@@ -292,7 +404,8 @@ class ComputerSimulator:
     def mem_free(self, start, size):
         """
         System Call, Take the supplied start address and size of memory to free
-        and tries to free it. Returns the status.
+        and tries to free it. Returns the status. A block shared with
+        mem_grant is only freed once every process holding it has freed it.
 
         Parameters:
             start           start address of memory
@@ -301,13 +414,101 @@ class ComputerSimulator:
         Returns:
             status          status of the system call
         """
-        status = self.freeMemory(start, size, "userFreeList")
+        status = self.sharedMemory.release(start, size,
+                                           self.scpu.sram.ram[self.RunningPCBptr+3])
+        if (status is None):  # Still held by another process
+            return CONST.OK
+        if (status == CONST.OK):
+            status = self.freeMemory(start, size, "userFreeList")
         return status
 
+    def memShare(self, transfer):
+        """
+        System Call, sends the start address in GPR2 of a block the caller got
+        from mem_alloc, or was granted, as a message to the PID in GPR1 and
+        gives that process a hold on the block. Nothing is copied; the block
+        stays allocated until every holder frees it or terminates.
+
+        Parameters:
+            transfer        the caller gives up its own hold (mem_transfer)
+
+        Returns:
+            OK              GPR0 is OK, ER_TID for an invalid PID, ER_NMB if
+                            the caller doesn't hold the block or ER_QFL if
+                            the receiver's queue is full
+        """
+        pid = self.scpu.sram.ram[self.RunningPCBptr+3]
+        start = self.scpu.gpr[2]
+        if (self.scpu.gpr[1] == pid):
+            pcbptr = self.RunningPCBptr
+        else:
+            pcbptr = self.searchPID(self.scpu.gpr[1])
+        if (pcbptr == CONST.EOL):
+            self.scpu.gpr[0] = CONST.ER_TID
+            return CONST.OK
+        if (pid not in self.sharedMemory.holders(start)):
+            self.scpu.gpr[0] = CONST.ER_NMB
+            return CONST.OK
+        if (self.deliverMessages(pcbptr, [start]) == 0):
+            status = self.enqueueMessage(pcbptr, start)
+            if (status != CONST.OK):
+                self.scpu.gpr[0] = status
+                return CONST.OK
+        self.scpu.gpr[0] = self.sharedMemory.share(start, pid, self.scpu.gpr[1],
+                                                   transfer)
+        return CONST.OK
+
+    def memStats(self, selector):
+        """
+        System Call, reports on a memory list. GPR0 gets the status, GPR1 free
+        words, GPR2 the largest size mem_alloc can satisfy, GPR3 free blocks,
+        GPR4 fragmentation in thousandths, GPR5 failed allocations and GPR6
+        the most words ever allocated.
+
+        Parameters:
+            selector        0 for the user list, 1 for the OS list
+
+        Returns:
+            OK              always, GPR0 is ER_NMB for an invalid selector
+        """
+        if (selector < 0) or (selector >= len(self.memStatsLists)):
+            self.scpu.gpr[0] = CONST.ER_NMB
+            return CONST.OK
+        stats = self.memoryAllocators[self.memStatsLists[selector]].stats()
+        self.scpu.gpr[0] = CONST.OK
+        self.scpu.gpr[1] = stats["freeWords"]
+        self.scpu.gpr[2] = stats["largestFree"]
+        self.scpu.gpr[3] = stats["freeBlocks"]
+        self.scpu.gpr[4] = round(stats["fragmentation"]*1000)
+        self.scpu.gpr[5] = stats["failures"]
+        self.scpu.gpr[6] = stats["highWater"]
+        return CONST.OK
+
+    def schedulerStats(self):
+        """Returns the scheduler's metrics."""
+        return self.scheduler.metrics()
+
+    def saveSchedulerStats(self, path):
+        """Writes schedulerStats to path as JSON."""
+        with open(path, "w") as statsFile:
+            json.dump(self.schedulerStats(), statsFile, indent=2)
+            statsFile.write("\n")
+
+    def memoryStats(self):
+        """Returns the stats of every memory list, keyed by list name."""
+        return {key: allocator.stats()
+                for key, allocator in self.memoryAllocators.items()}
+
+    def saveMemoryStats(self, path):
+        """Writes memoryStats to path as JSON."""
+        with open(path, "w") as statsFile:
+            json.dump(self.memoryStats(), statsFile, indent=2)
+            statsFile.write("\n")
+
     def allocateMemory(self, size, freeList):
         """
-        Takes the supplied size of memory and attempts to allocate it. Searches
-        through the userFreeList looking for a block.
+        Takes the supplied size of memory and attempts to allocate it from the
+        segregated fit bins of the given list.
 
         Parameters:
             size            size of memory to be allocated
@@ -319,49 +520,16 @@ class ComputerSimulator:
         """
         if freeList not in self.memoryLists.keys():
             raise ValueError("Invalid memory list. Expected one of: %s" % self.memoryLists.keys())
-        ptr = vars(self)[freeList]
-        previousPtr = CONST.EOL
-        while (ptr != CONST.EOL):
-            if (self.scpu.sram.ram[ptr+1] >= size):
-                break  # Found Free Block
-            else:
-                previousPtr = ptr
-                ptr = self.scpu.sram.ram[ptr]
-        # Check Various Cases
-        if (ptr == CONST.EOL):
-            return CONST.ER_MEM  # No Memory Available
-        if (self.scpu.sram.ram[ptr+1] == size):
-            # Found equal size block, check for first block
-            if (ptr == vars(self)[freeList]):
-                # First block equal size
-                vars(self)[freeList] = self.scpu.sram.ram[ptr]
-                self.scpu.sram.ram[ptr] = CONST.EOL
-                return ptr
-            else:
-                # Middle Block Equal Size
-                self.scpu.sram.ram[previousPtr] = self.scpu.sram.ram[ptr]
-                self.scpu.sram.ram[ptr] = CONST.EOL
-                return ptr
-        else:  # Found bigger block, check for first block
-            if (ptr == vars(self)[freeList]):  # First Block
-                # First block bigger, modify size userFreeList
-                vars(self)[freeList] = ptr + size
-                self.scpu.sram.ram[ptr+size] = self.scpu.sram.ram[ptr]
-                self.scpu.sram.ram[ptr+size+1] = self.scpu.sram.ram[ptr+1] - size
-                self.scpu.sram.ram[ptr] = CONST.EOL
-                return ptr
-            else:  # Not first block
-                # Middle block larger size
-                self.scpu.sram.ram[ptr+size] = self.scpu.sram.ram[ptr]
-                self.scpu.sram.ram[ptr+size+1] = self.scpu.sram.ram[ptr+1] - size
-                self.scpu.sram.ram[previousPtr] = self.scpu.sram.ram[ptr+size]
-                self.scpu.sram.ram[ptr] = CONST.EOL
-                return ptr
+        ptr = self.memoryAllocators[freeList].allocate(size)
+        if (ptr >= 0):
+            # Block is handed to a new owner, forget any code decoded from it
+            self.scpu.invalidateDecodeCache(ptr - 1, ptr + size + 2)
+        return ptr
 
     def freeMemory(self, start, size, freeList):
         """
         Takes the supplied start address and size of memory block and frees it
-        from the userFreeList. Adds to correct location in the freeList.
+        back to the given list, merging it with free neighbours.
 
         Parameters:
             start           Start of address of memory
@@ -369,62 +537,22 @@ class ComputerSimulator:
             freeList        The list (OS/User) to work with
         
         Returns:
-            status
+            OK              memory freed
+            ER_NMB          not an allocated block of that size
         """
         if freeList not in self.memoryLists.keys():
             raise ValueError("Invalid memory list. Expected one of: %s" % self.memoryLists.keys())
-        status = 0
-        ptr = vars(self)[freeList]
-        previousPtr = CONST.EOL
-        if (ptr == CONST.EOL):  # All Memory Used
-            vars(self)[freeList] = start
-            self.scpu.sram.ram[start] = CONST.EOL
-            self.scpu.sram.ram[start+1] = size
-        else:
-            if (ptr-(start+size) == 0):  # Blocks next to each other at beinning
-                self.scpu.sram.ram[start] = self.scpu.sram.ram[ptr]
-                self.scpu.sram.ram[start+1] = size + self.scpu.sram.ram[ptr+1]
-                vars(self)[freeList] = start
-                self.scpu.sram.ram[ptr] = 0
-                self.scpu.sram.ram[ptr+1] = 0
-                return CONST.OK
-            else:
-                while (ptr != CONST.EOL):
-                    previousPtr = ptr
-                    ptr = self.scpu.sram.ram[ptr]
-                    if (ptr-(start+size) == 0):
-                        # Blocks Next to each other in middle
-                        if (start-(previousPtr+self.scpu.sram.ram[previousPtr+1]) == 0):
-                            # Between two blocks
-                            self.scpu.sram.ram[previousPtr+1] = size + self.scpu.sram.ram[ptr+1] + self.scpu.sram.ram[previousPtr+1]
-                            self.scpu.sram.ram[previousPtr] = self.scpu.sram.ram[ptr]
-                            self.scpu.sram.ram[ptr] = 0
-                            self.scpu.sram.ram[ptr+1] = 0
-                            return CONST.OK
-                        else:
-                            # Next to block
-                            self.scpu.sram.ram[start] = self.scpu.sram.ram[ptr]
-                            self.scpu.sram.ram[start+1] = size + self.scpu.sram.ram[ptr+1]
-                            self.scpu.sram.ram[previousPtr] = start
-                            self.scpu.sram.ram[ptr] = 0
-                            self.scpu.sram.ram[ptr+1] = 0
-                            return CONST.OK
-                # Block at end of list
-                if (start-(previousPtr+self.scpu.sram.ram[previousPtr+1]) == 0):
-                    self.scpu.sram.ram[previousPtr+1] = size + self.scpu.sram.ram[previousPtr+1]
-                    return CONST.OK
-                else:
-                    self.scpu.sram.ram[start] = CONST.EOL
-                    self.scpu.sram.ram[start+1] = size
-                    self.scpu.sram.ram[previousPtr] = start
-                    return CONST.OK
+        status = self.memoryAllocators[freeList].free(start, size)
+        if (status == CONST.OK):
+            self.scpu.invalidateDecodeCache(start, start + size)
         return status
 
     def absoluteLoader(self, filename):
         """
         Passed in filename is opened, parsed line by line, and stored in RAM.
         Values are checked to make sure they are valid. Returns the value of
-        the program counter.
+        the program counter. A NAME.EXT that is an executable on the
+        simulated disk is loaded from there instead.
 
         Parameters:
             filename        name of executable file
@@ -435,6 +563,16 @@ class ComputerSimulator:
             ER_INVALIDADDR  invalid memory address
             ER_NOENDOFPROG  missing end of program indicator
         """
+        executable = self._diskExecutable(filename)
+        if (executable is not None):
+            return self.executableLoader(executable)
+        program = self.programCache.get(filename)
+        if (program is not None):  # Parsed before, copy runs into RAM
+            entry, runs = program
+            for start, words in runs:
+                self.scpu.sram.load(start, words)
+                self.scpu.invalidateDecodeCache(start, start + len(words))
+            return entry
         try:
             programFile = open(filename, "r")
         except:
@@ -445,6 +583,7 @@ class ComputerSimulator:
             content = int(temp[1], 16)
             if (addr >= 0) and (addr <= 9999):
                 self.scpu.sram.ram[addr] = content
+                self.scpu.invalidateDecodeCache(addr)
             elif (addr == CONST.ENDPROG):
                 programFile.close()
                 return content
@@ -454,6 +593,40 @@ class ComputerSimulator:
         programFile.close()
         return CONST.ER_NOENDOFPROG
 
+    def _diskExecutable(self, filename):
+        """FAT entry of an executable named NAME.EXT, otherwise None."""
+        if (self.fileSystem is None):
+            return None
+        filename = str(filename)
+        if ("/" in filename) or (os.sep in filename) or ("." not in filename):
+            return None
+        name, ext = filename.rsplit(".", 1)
+        entry = self.fileSystem.open(name, ext)
+        if (entry == CONST.ER_FILEOPEN) or (entry.fileType != CONST.FILE_EXEC):
+            return None
+        return entry
+
+    def executableLoader(self, entry):
+        """
+        Copies an executable from the simulated disk into RAM with a single
+        slice assignment.
+
+        Parameters:
+            entry           FAT entry of the executable
+
+        Returns:
+            0 to 9999       successful load, PC value
+            ER_INVALIDADDR  program doesn't fit in memory or bad entry PC
+        """
+        data = self.fileSystem.read(entry)
+        pc, load, length = unpackHeader(data)
+        if (load < 0) or (load + length > self.scpu.sram.ramSize) or \
+                (len(data) != HEADER_SIZE + length) or (pc < 0) or (pc > 9999):
+            return CONST.ER_INVALIDADDR
+        self.scpu.sram.load(load, data[HEADER_SIZE:])
+        self.scpu.invalidateDecodeCache(load, load + length)
+        return pc
+
     def createProcess(self, filename, priority):
         """
         Takes a file and tries to laod the program. Allocates necessary user
@@ -466,7 +639,12 @@ class ComputerSimulator:
         Returns:
             OK              successfully created process
             ER_MEM          no memory available
+
+        Raises:
+            ValueError      priority is not 0 to 255
         """
+        if (priority < 0) or (priority >= CONST.PRIORITY_LEVELS):
+            raise ValueError("Priority must be 0 to %d" % (CONST.PRIORITY_LEVELS - 1))
         # Allocate Memory for PCB
         pcbptr = self.allocateMemory(CONST.PCBSIZE, "osFreeList")
         if (pcbptr < 0):
@@ -478,7 +656,10 @@ class ComputerSimulator:
         # Set PC in PCB
         self.scpu.sram.ram[pcbptr+14] = status
         # Allocate Message Queue
-        msgqid = self.allocateMemory(10, "osFreeList")
+        msgqid = self.allocateMemory(self.messageQueueDepth, "osFreeList")
+        if (msgqid < 0):
+            self.freeMemory(pcbptr, CONST.PCBSIZE, "osFreeList")
+            return CONST.ER_MEM
         # Allocate stack from user free list
         ptr = self.allocateMemory(CONST.USER_STACK_SIZE, "userFreeList")
         if (ptr < 0):
@@ -497,15 +678,21 @@ class ComputerSimulator:
             self.scpu.sram.ram[pcbptr+2] = priority
             # Set PID
             self.scpu.sram.ram[pcbptr+3] = self.pid
+            self.pcbIndex[self.pid] = pcbptr
             self.pid += 1
             # Reason for waiting
             self.scpu.sram.ram[pcbptr+4] = 0
             # Set msgqueue start address
             self.scpu.sram.ram[pcbptr+17] = msgqid
             # Set message queue size
-            self.scpu.sram.ram[pcbptr+18] = 10
+            self.scpu.sram.ram[pcbptr+18] = self.messageQueueDepth
             # set number of messages in queue
             self.scpu.sram.ram[pcbptr+19] = 0
+            # Oldest message and next free entry of the queue
+            self.scpu.sram.ram[pcbptr+23] = 0
+            self.scpu.sram.ram[pcbptr+24] = 0
+            # Previous PCB in its queue
+            self.scpu.sram.ram[pcbptr+20] = CONST.EOL
 
             # Insert into RQ
             self.insertRQ(pcbptr)
@@ -531,7 +718,10 @@ class ComputerSimulator:
         # Set PC in PCB
         self.scpu.sram.ram[pcbptr+14] = self.scpu.gpr[3]
         # Allocate message queue
-        msgqid = self.allocateMemory(10, "osFreeList")
+        msgqid = self.allocateMemory(self.messageQueueDepth, "osFreeList")
+        if (msgqid < 0):
+            self.freeMemory(pcbptr, CONST.PCBSIZE, "osFreeList")
+            return CONST.ER_MEM
         # Allocate stack from user free list
         ptr = self.allocateMemory(CONST.USER_STACK_SIZE, "userFreeList")
         if (ptr < 0):
@@ -550,15 +740,21 @@ class ComputerSimulator:
             self.scpu.sram.ram[pcbptr+2] = CONST.DFLT_USR_PRTY
             # Set PID
             self.scpu.sram.ram[pcbptr+3] = self.pid
+            self.pcbIndex[self.pid] = pcbptr
             self.pid += 1
             # Reason for waiting
             self.scpu.sram.ram[pcbptr+4] = 0
             # Set msgqueue start address
             self.scpu.sram.ram[pcbptr+17] = msgqid
             # Set message queue size
-            self.scpu.sram.ram[pcbptr+18] = 10
+            self.scpu.sram.ram[pcbptr+18] = self.messageQueueDepth
             # set number of messages in queue
             self.scpu.sram.ram[pcbptr+19] = 0
+            # Oldest message and next free entry of the queue
+            self.scpu.sram.ram[pcbptr+23] = 0
+            self.scpu.sram.ram[pcbptr+24] = 0
+            # Previous PCB in its queue
+            self.scpu.sram.ram[pcbptr+20] = CONST.EOL
 
             # Insert into RQ
             self.insertRQ(pcbptr)
@@ -605,27 +801,34 @@ class ComputerSimulator:
             self.scpu.gpr[0] = CONST.ER_TID
             return CONST.OK
 
-    def terminateProcess(self, pcbptr):
+    def terminateProcess(self, pcbptr, exitStatus=CONST.HALT):
         """
         Free the memory of the supplied process using the pointer
 
         Parameters:
             pcbptr      Pointer to the process to terminate
+            exitStatus  OK when the process halted, its error code when it
+                        failed, HALT when the OS ended it
         """
+        self.exitStatuses[self.scpu.sram.ram[pcbptr+3]] = exitStatus
+        self.pcbIndex.pop(self.scpu.sram.ram[pcbptr+3], None)
+        self.scpu.diskController.cancel(self.scpu.sram.ram[pcbptr+3])
+        self.scheduler.exited(pcbptr)
+        for start, size in self.sharedMemory.releaseAll(self.scpu.sram.ram[pcbptr+3]):
+            self.freeMemory(start, size, "userFreeList")
         self.freeMemory(self.scpu.sram.ram[pcbptr+15], self.scpu.sram.ram[pcbptr+16], "userFreeList")
+        self.freeMemory(self.scpu.sram.ram[pcbptr+17], self.scpu.sram.ram[pcbptr+18], "osFreeList")
         self.freeMemory(pcbptr, CONST.PCBSIZE, "osFreeList")
 
     def selectProcess(self):
         """
-        Selects a process from the Ready Queue. Removes that process from the
-        RQ and returns the ptr to the selected process.
+        Selects a process from the Ready Queue with the scheduler. Removes
+        that process from the RQ and returns the ptr to the selected process.
 
         Returns:
             pcbptr      ptr to chosen process
         """
-        pcbptr = self.RQptr
-        self.removeFromRQ()
-        return pcbptr
+        return self.scheduler.pickNext()
 
     def saveCPUContext(self, pcbptr):
         """
@@ -709,72 +912,102 @@ class ComputerSimulator:
             else:
                 return CONST.ER_FILEOPEN
         elif ( interruptId == CONST.SHUTDOWN_INT):  # Shutdown
-            while (self.RQptr != CONST.EOL):  # Terminate Ready Processes
-                ptr = self.scpu.sram.ram[self.RQptr]
-                self.terminateProcess(self.RQptr)
-                self.RQptr = ptr
-            while (self.WQptr != CONST.EOL):  # Terminate Waiting Processes
-                ptr = self.scpu.sram.ram[self.WQptr]
-                self.terminateProcess(self.WQptr)
-                self.WQptr = ptr
+            self.shutdownSystem()
             print("4: System Shutting Down!")
-            self.logger.info("System Shutting Down")
             sys.exit(0)
         else:  # Invalid Interrupt
             return CONST.ER_INT
 
+    def shutdownSystem(self):
+        """Terminates every ready and waiting process."""
+        pcbptr = self.selectProcess()
+        while (pcbptr != CONST.EOL):  # Terminate Ready Processes
+            self.terminateProcess(pcbptr, CONST.HALT)
+            pcbptr = self.selectProcess()
+        pcbptr = self.waitQueue.pop()
+        while (pcbptr != CONST.EOL):  # Terminate Waiting Processes
+            self.terminateProcess(pcbptr, CONST.HALT)
+            pcbptr = self.waitQueue.pop()
+        self.scpu.bufferCache.flush()
+        self.logger.info("Disk cache: %s", self.scpu.bufferCache.stats())
+        self.logger.info("Memory lists: %s", self.memoryStats())
+        self.logger.info("System Shutting Down")
+
     def inputCompletionInterrupt(self):
         """
-        Simulates interrupt to read from the keyboard. Takes PID out of WQ,
-        reads a character and puts in GPR2. Puts process in RQ.
+        Simulates interrupt to read from the keyboard. Takes the next process
+        waiting for input out of the WQ, reads a character and puts in GPR1.
+        Puts process in RQ.
 
         Returns:
             0       Successful Read
+            ER_TID  No process is waiting for input
         """
-        inputPid = input("Enter PID of Process needing Input: ")
-        try:
-            inputPid = int(inputPid)
-        except:
-            return CONST.ER_TID
-        pcbptr = self.searchRemoveWQ(inputPid)
+        pcbptr = self.waitQueue.nextWaiter(CONST.WAITINGGET)
         if (pcbptr == CONST.EOL):
+            print("No process is waiting for input")
             return CONST.ER_TID
-        print(inputPid)
+        print("PID {} is waiting for input".format(self.scpu.sram.ram[pcbptr+3]))
         inputChar = input("Type a character: ")
+        self.waitQueue.remove(pcbptr)
+        self.completeInput(pcbptr, inputChar)
+        return CONST.OK
+
+    def completeInput(self, pcbptr, inputChar):
+        """
+        Finishes an io_getc for a process already taken out of the WQ. Puts
+        the character in its GPR1 and moves it to the RQ.
+
+        Parameters:
+            pcbptr      pointer to the waiting process
+            inputChar   string whose first character was read
+        """
         self.scpu.sram.ram[pcbptr+6] = ord(inputChar[0])
         self.scpu.sram.ram[pcbptr+5] = CONST.OK
         self.scpu.sram.ram[pcbptr+1] = CONST.READY
         self.insertRQ(pcbptr)
-        return CONST.OK
 
     def outputCompletionInterrupt(self):
         """
-        Simulates interrupt to read from keyboard. Takes PID out of WQ, reads
-        a character and puts in GPR2. Puts process in RQ.
+        Simulates interrupt to display a character. Takes the next process
+        waiting for output out of the WQ and prints the character in its
+        GPR1. Puts process in RQ.
 
         Returns:
             0       successful output
+            ER_TID  No process is waiting for output
         """
-        outputPid = input("Enter PID of Process needing Output: ")
-        try:
-            outputPid = int(outputPid)
-        except:
-            return CONST.ER_TID
-        pcbptr = self.searchRemoveWQ(outputPid)
+        pcbptr = self.waitQueue.nextWaiter(CONST.WAITINGPUT)
         if (pcbptr == CONST.EOL):
+            print("No process is waiting for output")
             return CONST.ER_TID
-        print(outputPid)
-        outputChar = chr(self.scpu.sram.ram[pcbptr+6])
+        print("PID {} is waiting for output".format(self.scpu.sram.ram[pcbptr+3]))
+        self.waitQueue.remove(pcbptr)
+        outputChar = self.completeOutput(pcbptr)
         print("Output: {}".format(outputChar))
+        return CONST.OK
+
+    def completeOutput(self, pcbptr):
+        """
+        Finishes an io_putc for a process already taken out of the WQ and
+        moves it to the RQ.
+
+        Parameters:
+            pcbptr      pointer to the waiting process
+
+        Returns:
+            char        the character the process wrote
+        """
+        outputChar = chr(self.scpu.sram.ram[pcbptr+6])
         self.scpu.sram.ram[pcbptr+5] = CONST.OK
         self.scpu.sram.ram[pcbptr+1] = CONST.READY
         self.insertRQ(pcbptr)
-        return CONST.OK
+        return outputChar
 
     def searchRemoveWQ(self, findpid):
         """
-        Takes a given PID, searches for it in the WQ, if found removes it and
-        returns the PCB ptr. Otherwise returns not found
+        Takes a given PID, looks it up in the PID index, if it is in the WQ
+        removes it and returns the PCB ptr. Otherwise returns not found
 
         Parameters:
             findpid     pid of process to find
@@ -783,30 +1016,16 @@ class ComputerSimulator:
             EOL         Pid not found
             ptr         ptr to pid in pcb
         """
-        ptr = self.WQptr
-        previousPtr = CONST.EOL
-        if (ptr == CONST.EOL):  # Queue empty, not found
-            return CONST.EOL
-        else:
-            while (ptr != CONST.EOL):
-                if (self.scpu.sram.ram[ptr+3] == findpid):  # Pid Found
-                    if (previousPtr == CONST.EOL):
-                        self.WQptr = self.scpu.sram.ram[ptr]
-                        self.scpu.sram.ram[ptr] = CONST.EOL
-                        return ptr
-                    else:
-                        self.scpu.sram.ram[previousPtr] = self.scpu.sram.ram[ptr]
-                        self.scpu.sram.ram[ptr] = CONST.EOL
-                        return ptr
-                else:
-                    previousPtr = ptr
-                    ptr = self.scpu.sram.ram[ptr]
+        ptr = self.pcbIndex.get(findpid, CONST.EOL)
+        if (ptr not in self.waitQueue):
             return CONST.EOL
+        self.waitQueue.remove(ptr)
+        return ptr
 
     def searchRemoveRQ(self, findpid):
         """
-        Takes a given PID, searches for it in the RQ, if found removes it and
-        returns the PCB ptr. Otherwise returns not found
+        Takes a given PID, looks it up in the PID index, if it is in the RQ
+        removes it and returns the PCB ptr. Otherwise returns not found
 
         Parameters:
             findpid     pid of process to find
@@ -815,174 +1034,211 @@ class ComputerSimulator:
             EOL         Pid not found
             ptr         ptr to pid in pcb
         """
-        ptr = self.RQptr
-        previousPtr = CONST.EOL
-        if (ptr == CONST.EOL):  # Queue empty, not found
-            return CONST.EOL
-        else:
-            while (ptr != CONST.EOL):
-                if (self.scpu.sram.ram[ptr+3] == findpid):  # Pid Found
-                    if (previousPtr == CONST.EOL):
-                        self.RQptr = self.scpu.sram.ram[ptr]
-                        self.scpu.sram.ram[ptr] = CONST.EOL
-                        return ptr
-                    else:
-                        self.scpu.sram.ram[previousPtr] = self.scpu.sram.ram[ptr]
-                        self.scpu.sram.ram[ptr] = CONST.EOL
-                        return ptr
-                else:
-                    previousPtr = ptr
-                    ptr = self.scpu.sram.ram[ptr]
+        ptr = self.pcbIndex.get(findpid, CONST.EOL)
+        if (ptr not in self.readyQueue):
             return CONST.EOL
+        self.scheduler.remove(ptr)
+        return ptr
 
     def insertRQ(self, pcbptr):
         """
-        Takes a pcbptr and puts in the correct place in RQ using Priority
-        Round Robin.
+        Takes a pcbptr and hands it to the scheduler, which puts it at the
+        end of its priority level in the RQ.
 
         Parameters:
             pcbptr          pointer to pcb to put in RQ
         """
-        ptr = self.RQptr
-        previousPtr = CONST.EOL
         if (pcbptr >= 7000) and (pcbptr <= 9974):  # Valid pcbptr
-            if (self.RQptr == CONST.EOL):  # Rq Empty
-                self.RQptr = pcbptr
-                return
-            else:  # RQ has entries, search through and insert correctly
-                while (ptr != CONST.EOL):
-                    if (self.scpu.sram.ram[pcbptr+2] <= self.scpu.sram.ram[ptr+2]):
-                        previousPtr = ptr
-                        ptr = self.scpu.sram.ram[ptr]
-                    else:  # Found place to insert
-                        # Insert between previous ptr and ptr
-                        # 1, the beginning
-                        if (ptr == self.RQptr):
-                            self.scpu.sram.ram[pcbptr] = self.RQptr
-                            self.RQptr = pcbptr
-                            return
-                        else:
-                            # Insert in middle
-                            self.scpu.sram.ram[pcbptr] = ptr
-                            self.scpu.sram.ram[previousPtr] = pcbptr
-                            return
-                # Insert at end of RQ
-                self.scpu.sram.ram[previousPtr] = pcbptr
-                return
-        else:  # Invalid pcbptr
-            return
+            self.scheduler.enqueue(pcbptr)
 
     def insertWQ(self, pcbptr):
         """
-        Takes a pcbptr and puts in the correct place in WQ using Priority
-        Round Robin.
+        Takes a pcbptr and puts it at the end of its priority level in the
+        WQ, keeping Priority Round Robin order.
 
         Parameters:
-            pcbptr          pointer to pcb to put in RQ
+            pcbptr          pointer to pcb to put in WQ
         """
-        ptr = self.WQptr
-        previousPtr = CONST.EOL
         if (pcbptr >= 7000) and (pcbptr <= 9974):  # Valid pcbptr
-            if (self.WQptr == CONST.EOL):  # Rq Empty
-                self.WQptr = pcbptr
-                return
-            else:  # RQ has entries, search through and insert correctly
-                while (ptr != CONST.EOL):
-                    if (self.scpu.sram.ram[pcbptr+2] <= self.scpu.sram.ram[ptr+2]):
-                        previousPtr = ptr
-                        ptr = self.scpu.sram.ram[ptr]
-                    else:  # Found place to insert
-                        # Insert between previous ptr and ptr
-                        # 1, the beginning
-                        if (ptr == self.WQptr):
-                            self.scpu.sram.ram[pcbptr] = self.WQptr
-                            self.WQptr = pcbptr
-                            return
-                        else:
-                            # Insert in middle
-                            self.scpu.sram.ram[pcbptr] = ptr
-                            self.scpu.sram.ram[previousPtr] = pcbptr
-                            return
-                # Insert at end of RQ
-                self.scpu.sram.ram[previousPtr] = pcbptr
-                return
-        else:  # Invalid pcbptr
-            return
+            self.waitQueue.insert(pcbptr)
 
     def removeFromRQ(self):
         """
         Takes the first entry from the RQ and removes from the list.
         """
-        pcbptr = self.RQptr
-        self.RQptr = self.scpu.sram.ram[pcbptr]
-        self.scpu.sram.ram[pcbptr] = CONST.EOL
+        self.readyQueue.pop()
 
     def removeFromWQ(self):
         """
         Takes the first entry from the WQ and removes from the list.
         """
-        pcbptr = self.WQptr
-        self.WQptr = self.scpu.sram.ram[pcbptr]
-        self.scpu.sram.ram[pcbptr] = CONST.EOL
+        self.waitQueue.pop()
 
     def searchPID(self, pid):
         """
-        Search through the WQ and RQ for a PID
+        Looks a PID up in the PID index
 
         Parameters:
             pid         pid of process to find
 
         Returns:
-            pcbptr      ptr to pid
+            pcbptr      ptr to pid, if it is in the WQ or RQ
             EOL         pid not found
         """
-        ptr = self.WQptr
-        while (ptr != CONST.EOL):
-            if (self.scpu.sram.ram[ptr+3] == pid):
-                return ptr
-            else:
-                ptr = self.scpu.sram.ram[ptr]
-        ptr = self.RQptr
-        while (ptr != CONST.EOL):
-            if (self.scpu.sram.ram[ptr+3] == pid):
-                return ptr
-            else:
-                ptr = self.scpu.sram.ram[ptr]
+        ptr = self.pcbIndex.get(pid, CONST.EOL)
+        if (ptr in self.waitQueue) or (ptr in self.readyQueue):
+            return ptr
         return CONST.EOL
 
     def msgQsend(self):
         """
         System call, Sends a message with a start address of GPR2 to PID in
-        GPR1
+        GPR1. A receiver blocked in msg_qrecieve gets the message directly
+        and is moved to the RQ, otherwise the message is queued.
+
+        Returns:
+            OK              GPR0 is OK, ER_TID for an invalid PID or ER_QFL
+                            if the receiver's queue is full
         """
         # GPR1 has process PID
         # GPR2 has start address of message
         # Set GPR0 to status when done
         self.logger.debug("msgQsend pid: %s, start addr: %s", self.scpu.gpr[1], self.scpu.gpr[2])
-        pctptr = self.searchPID(self.scpu.gpr[1])  # Search WQ and RQ for pid
-        if (pctptr == CONST.EOL):  # Invalid PID
+        pcbptr = self.searchPID(self.scpu.gpr[1])  # Search WQ and RQ for pid
+        if (pcbptr == CONST.EOL):  # Invalid PID
             self.scpu.gpr[0] = CONST.ER_TID  # Error, invalid PID
-            return CONST.ER_TID
-        msgaddr = self.scpu.sram.ram[pctptr+17]
-        msgcount = self.scpu.sram.ram[pctptr+19]
-        self.scpu.sram.ram[msgaddr+msgcount] = self.scpu.gpr[2]
-        self.scpu.sram.ram[pctptr+19] += 1
-        self.scpu.sram.ram[pctptr+7] = self.scpu.gpr[2]
-        self.scpu.gpr[0] = CONST.OK
+            return CONST.OK
+        if (self.deliverMessages(pcbptr, [self.scpu.gpr[2]]) == 0):
+            self.scpu.gpr[0] = self.enqueueMessage(pcbptr, self.scpu.gpr[2])
+        else:
+            self.scpu.gpr[0] = CONST.OK
+        return CONST.OK
+
+    def msgQsendBatch(self):
+        """
+        System call, Sends the GPR3 message start addresses stored from the
+        address in GPR2 to the PID in GPR1 in one trap, as msgQsend would
+        one at a time.
+
+        Returns:
+            OK              GPR0 is OK, ER_TID for an invalid PID or ER_QFL
+                            if the queue filled; GPR3 is the number sent
+        """
+        pcbptr = self.searchPID(self.scpu.gpr[1])
+        count = self.scpu.gpr[3]
+        start = self.scpu.gpr[2]
+        if (pcbptr == CONST.EOL) or (count < 0) or (start < 0) or \
+                (start + count > self.scpu.sram.ramSize):
+            self.scpu.gpr[0] = CONST.ER_TID if pcbptr == CONST.EOL else CONST.ER_INVALIDADDR
+            self.scpu.gpr[3] = 0
+            return CONST.OK
+        messages = self.scpu.sram.ram[start:start+count].tolist()
+        sent = self.deliverMessages(pcbptr, messages)
+        status = CONST.OK
+        while (sent < count) and (status == CONST.OK):
+            status = self.enqueueMessage(pcbptr, messages[sent])
+            if (status == CONST.OK):
+                sent += 1
+        self.scpu.gpr[0] = status
+        self.scpu.gpr[3] = sent
+        return CONST.OK
+
+    def deliverMessages(self, pcbptr, messages):
+        """
+        Hands messages to a process blocked in msg_qrecieve or
+        msg_qrecieve_batch and moves it to the RQ.
+
+        Returns:
+            count           messages taken, 0 if the process isn't waiting
+                            for a message
+        """
+        ram = self.scpu.sram.ram
+        if (not messages) or (pcbptr not in self.waitQueue):
+            return 0
+        if (ram[pcbptr+4] == CONST.WAITINGMSG):
+            ram[pcbptr+7] = messages[0]  # GPR2 gets the message
+            taken = 1
+        elif (ram[pcbptr+4] == CONST.WAITINGMSGS):
+            # Its GPR2 and GPR3 still hold the buffer and its size
+            taken = min(len(messages), ram[pcbptr+8])
+            self.scpu.sram.load(ram[pcbptr+7], messages[:taken])
+            self.scpu.invalidateDecodeCache(ram[pcbptr+7], ram[pcbptr+7] + taken)
+            ram[pcbptr+8] = taken
+        else:
+            return 0
+        self.waitQueue.remove(pcbptr)
+        ram[pcbptr+5] = CONST.OK
+        ram[pcbptr+1] = CONST.READY
+        self.insertRQ(pcbptr)
+        return taken
+
+    def enqueueMessage(self, pcbptr, message):
+        """
+        Adds a message at the tail of a process's ring buffer queue.
+
+        Returns:
+            OK              queued
+            ER_QFL          the queue is full
+        """
+        ram = self.scpu.sram.ram
+        size = ram[pcbptr+18]
+        if (ram[pcbptr+19] >= size):
+            return CONST.ER_QFL
+        tail = ram[pcbptr+24]
+        ram[ram[pcbptr+17]+tail] = message
+        ram[pcbptr+24] = (tail + 1) % size
+        ram[pcbptr+19] += 1
         return CONST.OK
 
+    def dequeueMessages(self, pcbptr, count):
+        """Removes up to count messages from the head of a process's queue."""
+        ram = self.scpu.sram.ram
+        size = ram[pcbptr+18]
+        queue = ram[pcbptr+17]
+        head = ram[pcbptr+23]
+        count = min(count, ram[pcbptr+19])
+        messages = []
+        for _ in range(count):
+            messages.append(ram[queue+head])
+            head = (head + 1) % size
+        ram[pcbptr+23] = head
+        ram[pcbptr+19] -= count
+        return messages
+
     def msgQRecieve(self):
         """
-        System Call, tries to retrieve message, if none, waits until one
-        arrives
+        System Call, takes the oldest message into GPR2, if none, waits
+        until one arrives
         """
         if (self.scpu.sram.ram[self.RunningPCBptr+19] == 0):  # No message in queue
             self.scpu.sram.ram[self.RunningPCBptr+4] = CONST.WAITINGMSG  # Waiting for msg
             self.scpu.sram.ram[self.RunningPCBptr+1] = CONST.WAITING  # Set state to waiting
             return CONST.WAITING
         # There is a message in the queue
-        msgqaddr = self.scpu.sram.ram[self.RunningPCBptr+17]
-        self.scpu.gpr[2] = self.scpu.sram.ram[msgqaddr]  # Copy msg start addr to gpr2
+        self.scpu.gpr[2] = self.dequeueMessages(self.RunningPCBptr, 1)[0]  # Copy msg start addr to gpr2
+        self.scpu.gpr[0] = CONST.OK
+        return CONST.OK
+
+    def msgQRecieveBatch(self):
+        """
+        System Call, takes up to GPR3 of the oldest messages into the buffer
+        at GPR2 and sets GPR3 to how many it took. If none are queued, waits
+        until one arrives.
+        """
+        start = self.scpu.gpr[2]
+        count = self.scpu.gpr[3]
+        if (count <= 0) or (start < 0) or (start + count > self.scpu.sram.ramSize):
+            self.scpu.gpr[0] = CONST.ER_INVALIDADDR
+            self.scpu.gpr[3] = 0
+            return CONST.OK
+        if (self.scpu.sram.ram[self.RunningPCBptr+19] == 0):
+            self.scpu.sram.ram[self.RunningPCBptr+4] = CONST.WAITINGMSGS
+            self.scpu.sram.ram[self.RunningPCBptr+1] = CONST.WAITING
+            return CONST.WAITING
+        messages = self.dequeueMessages(self.RunningPCBptr, count)
+        self.scpu.sram.load(start, messages)
+        self.scpu.invalidateDecodeCache(start, start + len(messages))
+        self.scpu.gpr[3] = len(messages)
         self.scpu.gpr[0] = CONST.OK
         return CONST.OK
 
@@ -1108,28 +1364,46 @@ class ComputerSimulator:
             print("|End of Running Process PCB.|")
             print("-------------------------------")
 
-    def OSLoop(self):
+    def OSLoop(self, boot=True):
         """
         Runs the Main OS loop.
+
+        Parameters:
+            boot        start the null process. False to resume a restored
+                        checkpoint that already has one
         """
         status = 0
 
-        nullProgram = Path("programs/machinecode/null.txt")
-        status = self.createProcess(nullProgram, 0)
-        print(status)
+        if (boot):
+            nullProgram = Path("programs/machinecode/null.txt")
+            self.nullPid = self.pid
+            status = self.createProcess(nullProgram, 0)
+            print(status)
         while (status >=0):
+            # Disk transfers finished since the last context switch
+            self.diskCompletionInterrupt()
             # Process Interrupts at every context switch
-            self.processInterrupts()
+            if (self.interruptScript is not None):
+                if (self.interruptScript.processInterrupts(self) == CONST.SHUTDOWN_INT):
+                    self.shutdownSystem()
+                    return CONST.OK
+            else:
+                self.processInterrupts()
             # Select Process from RQ to give to CPU
             pcbptr = self.selectProcess()
             self.dispatcher(pcbptr)
             self.RunningPCBptr = pcbptr
-            self.printRQ(self.RQptr)
-            self.printWQ(self.WQptr)
-            self.printRunningP(self.RunningPCBptr)
+            self.scheduler.dispatched(pcbptr)
+            if (self.verbose):
+                self.printRQ(self.RQptr)
+                self.printWQ(self.WQptr)
+                self.printRunningP(self.RunningPCBptr)
             self.scpu.psr = CONST.USERMODE
-            status = self.scpu.executeProgram(self.systemCall)
-            self.dumpMemory("User Dynamic Area Memory Dump", 3000, 3050)
+            status = self.scpu.executeProgram(self.systemCall,
+                                              self.scheduler.timeslice(pcbptr))
+            self.scheduler.ran(pcbptr, status)
+            if (self.verbose):
+                self.dumpMemory("User Dynamic Area Memory Dump", 3000, 3050)
             self.scpu.psr = CONST.OSMODE
             if (status == CONST.TIMESLICE):  # Timeslice expired
                 self.saveCPUContext(self.RunningPCBptr)
@@ -1142,19 +1416,42 @@ class ComputerSimulator:
                 self.RunningPCBptr = -1
                 continue
             elif (status == 0):  # Program Halt
-                self.terminateProcess(self.RunningPCBptr)
+                self.terminateProcess(self.RunningPCBptr, CONST.OK)
                 self.RunningPCBptr = -1
                 continue
             else:  # Errors in program
-                self.terminateProcess(self.RunningPCBptr)
+                self.terminateProcess(self.RunningPCBptr, status)
                 self.RunningPCBptr = -1
+                status = CONST.OK  # Only the failed process stops
                 continue
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the Jatgam Computer Simulator")
     parser.add_argument("--loglevel", choices=["debug", "info", "warn", "warning", "error", "exception", "critical"],
                         default="info", type=str, help="The Log Level")
+    parser.add_argument("--engine", choices=ENGINES, default="dispatch",
+                        type=str, help="The CPU instruction execution engine")
+    parser.add_argument("--trace", type=str, default=None,
+                        help="Record executed instructions into this binary trace file")
+    parser.add_argument("--trace-size", type=int, default=65536,
+                        help="Number of most recent instructions the trace keeps")
+    parser.add_argument("--script", type=str, default=None,
+                        help="Run without prompting, taking interrupts from this schedule file")
+    parser.add_argument("--restore", type=str, default=None,
+                        help="Resume from a checkpoint instead of booting")
+    parser.add_argument("--memory-stats", type=str, default=None,
+                        help="Write memory list statistics to this JSON file on exit")
+    parser.add_argument("--msgq-depth", type=int, default=CONST.MSG_QUEUE_DEPTH,
+                        help="Messages each new process can have queued")
+    parser.add_argument("--scheduler", choices=tuple(SCHEDULERS), default="priority",
+                        type=str, help="The process scheduling policy")
+    parser.add_argument("--scheduler-stats", type=str, default=None,
+                        help="Write scheduler metrics to this JSON file on exit")
+    parser.add_argument("--verbose", action="store_true",
+                        help="With --script, still print the OS dumps")
     args = parser.parse_args()
+    if (args.msgq_depth < 1):
+        parser.error("--msgq-depth must be at least 1")
 
     numeric_level = getattr(logging, args.loglevel.upper(), None)
     if not isinstance(numeric_level, int):
@@ -1165,8 +1462,36 @@ if __name__ == "__main__":
     logger.info("Starting Simulator")
 
     # Computer Loop
-    comp = ComputerSimulator()
+    script = None
+    if (args.script):
+        script = InterruptScript.load(args.script)
+    comp = ComputerSimulator(args.engine, script, args.verbose or script is None,
+                             messageQueueDepth=args.msgq_depth, scheduler=args.scheduler)
     comp.initializeSystem()
-    comp.OSLoop()
-    
+    if (args.restore):
+        loadCheckpoint(comp, args.restore)
+    trace = None
+    if (args.trace):
+        trace = InstructionTrace(args.trace_size)
+        comp.scpu.attachTrace(trace)
+    try:
+        if (script is None):
+            comp.OSLoop(args.restore is None)
+        else:
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(sys.stdout if args.verbose else devnull):
+                status = comp.OSLoop(args.restore is None)
+            for line in formatReport(script.report(comp), script.loadErrors):
+                print(line)
+            print("Clock: {}".format(comp.scpu.clock))
+            logger.info("Script finished")
+            sys.exit(0 if status == CONST.OK else 1)
+    finally:
+        if (trace is not None):
+            trace.save(args.trace)
+        if (args.memory_stats):
+            comp.saveMemoryStats(args.memory_stats)
+        if (args.scheduler_stats):
+            comp.saveSchedulerStats(args.scheduler_stats)
+
     logger.error("Simulator had an error and did not stop cleanly.")
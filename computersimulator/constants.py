@@ -54,6 +54,9 @@ class Constants(object):
     ER_INVALIDOP = -16  # Error: Invalid Opcode
     ER_INT = -17  # Error: Invalid Interrupts
     ER_PC = -18  # Error: Invalid PC
+    ER_DSK = -19  # Error: No disk space available
+    ER_FEXIST = -21  # Error: File already exists
+    ER_FATFULL = -22  # Error: No free FAT entries
 
     ### System Calls ###
     TASK_CREATE = 0  # Create Task
@@ -67,13 +70,23 @@ class Constants(object):
     IO_PUTC = 15  # Display one character
     TIME_GET = 16  # Get the time
     TIME_SET = 17  # Set the time
+    DISK_READ = 18  # Read a disk sector into memory
+    DISK_WRITE = 19  # Write memory to a disk sector
+    MEM_STATS = 20  # Get memory list statistics
+    MSG_QSEND_BATCH = 21  # Send several messages to queue
+    MSG_QRECIEVE_BATCH = 22  # Recieve several messages from queue
+    MEM_GRANT = 23  # Share allocated memory with another process
+    MEM_TRANSFER = 24  # Hand allocated memory to another process
 
     ### OS Values ###
     OSMODE = 1
     USERMODE = 0
     EOL = -1  # End of List
     DFLT_USR_PRTY = 127  # Default Priority
+    PRIORITY_LEVELS = 256  # Priorities 0 to 255
     USER_STACK_SIZE = 10  # Default User Stack Size
+    DFLT_TIMESLICE = 200  # Default Timeslice in clock ticks
+    MSG_QUEUE_DEPTH = 10  # Default Message Queue Size
     PCBSIZE = 25  # Default PCB Size
     READY = 1  # Process Ready Status
     WAITING = 2  # Process Waiting Status
@@ -82,6 +95,8 @@ class Constants(object):
     WAITINGMSG = 2  # waiting for message
     WAITINGGET = 3  # waiting for input
     WAITINGPUT = 4  # waiting to output
+    WAITINGDISK = 5  # waiting for a disk transfer
+    WAITINGMSGS = 6  # waiting for messages in msg_qrecieve_batch
     HALT = -20  # halt status
 
     ### Interrupts ###
@@ -98,3 +113,21 @@ class Constants(object):
     BTMP_USED = 1  # Bitmap Sector Used
     BTMP_SYS = 2  # Bitmap Sector Used by System
     BTMP_INV = -1  # Bitmap Sector is out of Partition/Invalid
+    FAT_ENTRY_SIZE = 25  # Words in a FAT entry
+    FILE_DATA = 0  # FAT Entry Type: Data
+    FILE_EXEC = 1  # FAT Entry Type: Executable
+
+### Opcode Groups ###
+# Opcodes that read a first operand
+OPERAND1_OPCODES = frozenset((Constants.OP_ADD, Constants.OP_SUB,
+                              Constants.OP_MULT, Constants.OP_DIV,
+                              Constants.OP_MOVE, Constants.OP_BRANCHM,
+                              Constants.OP_SYSTEM, Constants.OP_BRANCHP,
+                              Constants.OP_BRANCHZ))
+# Opcodes that read and store a second operand
+OPERAND2_OPCODES = frozenset((Constants.OP_ADD, Constants.OP_SUB,
+                              Constants.OP_MULT, Constants.OP_DIV,
+                              Constants.OP_MOVE))
+# Opcodes followed by a branch target word
+BRANCH_OPCODES = frozenset((Constants.OP_BRANCH, Constants.OP_BRANCHM,
+                            Constants.OP_BRANCHP, Constants.OP_BRANCHZ))
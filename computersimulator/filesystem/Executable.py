@@ -0,0 +1,97 @@
+import argparse
+from pathlib import Path
+import sys
+from computersimulator.system.ProgramCache import parseProgram
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+# entry PC, load address, length in words
+HEADER_SIZE = 3
+EXEC_EXT = "exe"
+
+
+def parseMachineCode(path):
+    """
+    Reads a programs/machinecode text file as one run of words. Addresses
+    between the lowest and highest one that the file skips are loaded as 0.
+
+    Parameters:
+        path            text program
+
+    Returns:
+        tuple           (entry PC, load address, words)
+
+    Raises:
+        ValueError      bad line, invalid address or no end of program line
+    """
+    entry, runs = parseProgram(path)
+    if (not runs):
+        raise ValueError("%s has no program words" % path)
+    load = runs[0][0]
+    program = [0]*(runs[-1][0] + len(runs[-1][1]) - load)
+    for start, words in runs:
+        program[start - load:start - load + len(words)] = words
+    return entry, load, program
+
+
+def packExecutable(entry, load, words):
+    """Returns the words of an executable file."""
+    return [entry, load, len(words)] + list(words)
+
+
+def unpackHeader(data):
+    """Returns (entry PC, load address, length) from executable words."""
+    return tuple(data[:HEADER_SIZE])
+
+
+def executableName(path):
+    """FAT name for a text program: its file name cut to 6 characters."""
+    return Path(path).stem[:6]
+
+
+def importPrograms(fileSystem, paths):
+    """
+    Converts text programs into executables on the simulated disk,
+    replacing executables of the same name.
+
+    Returns:
+        list            (path, name, status) per program
+    """
+    results = []
+    for path in paths:
+        entry, load, words = parseMachineCode(path)
+        name = executableName(path)
+        data = packExecutable(entry, load, words)
+        existing = fileSystem.open(name, EXEC_EXT)
+        if (existing == CONST.ER_FILEOPEN):
+            status = fileSystem.create(name, EXEC_EXT, data, CONST.FILE_EXEC)
+            status = status if isinstance(status, int) else CONST.OK
+        else:
+            existing.fileType = CONST.FILE_EXEC
+            status = fileSystem.write(existing, data)
+        results.append((path, name, status))
+    return results
+
+
+def main(argv=None):
+    from ComputerSimulator import ComputerSimulator
+    from computersimulator.hardware.SimulatedCPU import DEFAULT_DISK
+    parser = argparse.ArgumentParser(description="Import text machine code programs as executables on the simulated disk")
+    parser.add_argument("programs", nargs="+", type=str, help="programs/machinecode text files")
+    parser.add_argument("--disk", type=str, default=DEFAULT_DISK, help="Disk image to import into")
+    args = parser.parse_args(argv)
+    comp = ComputerSimulator(verbose=False, diskPath=args.disk)
+    comp.initializeSystem()
+    failed = False
+    for path, name, status in importPrograms(comp.fileSystem, args.programs):
+        print("{} -> {}.{}: {}".format(path, name, EXEC_EXT,
+                                       "OK" if status == CONST.OK else status))
+        failed = failed or status != CONST.OK
+    comp.scpu.bufferCache.flush()
+    comp.scpu.sdisk.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+import heapq
+import math
+import computersimulator.utils.listutils as listutils
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+NAME_SIZE = 6  # Words of a file name
+EXT_SIZE = 3  # Words of an extension
+
+
+class FileEntry:
+    """One FAT entry: where a file lives and how long it is."""
+
+    def __init__(self, slot, fileType, name, ext, start, size, lastWords):
+        self.slot = slot  # Index of the entry in the FAT
+        self.fileType = fileType  # FILE_DATA or FILE_EXEC
+        self.name = name
+        self.ext = ext
+        self.start = start  # First sector
+        self.size = size  # Sectors
+        self.lastWords = lastWords  # Words used in the last sector
+
+    def length(self, sectorSize):
+        """Returns the length of the file in words."""
+        if (self.size == 0):
+            return 0
+        return (self.size - 1)*sectorSize + self.lastWords
+
+    def __repr__(self):
+        return "FileEntry(%s.%s, type %d, sectors %d-%d, %d words in last)" % (
+            self.name, self.ext, self.fileType, self.start,
+            self.start + self.size - 1, self.lastWords)
+
+
+def encodeEntry(entry):
+    """Returns the FAT_ENTRY_SIZE words of an entry."""
+    words = [entry.fileType]
+    words += [ord(char) for char in entry.name.ljust(NAME_SIZE, "\0")]
+    words += [ord(char) for char in entry.ext.ljust(EXT_SIZE, "\0")]
+    words += listutils.numSplit(format(entry.start, "06d"))
+    words += listutils.numSplit(format(entry.size, "06d"))
+    words += listutils.numSplit(format(entry.lastWords, "03d"))
+    return words
+
+
+def decodeEntry(slot, words):
+    """Returns the FileEntry in FAT words, or None for an empty slot."""
+    if (words[1] == 0):
+        return None
+    name = "".join(chr(word) for word in words[1:7] if word)
+    ext = "".join(chr(word) for word in words[7:10] if word)
+    return FileEntry(slot, words[0], name, ext, listutils.numJoin(words[10:16]),
+                     listutils.numJoin(words[16:22]),
+                     listutils.numJoin(words[22:25]))
+
+
+class FileSystem:
+    """
+    File Allocation Table of partition 1, laid out as in
+    docs/DiskAndFSInfo.txt. Each FAT sector holds whole 25 word entries and
+    a file is one contiguous run of sectors from the SectorAllocator.
+    Mounting reads the FAT once and indexes it by (name, extension), so
+    finding a file never scans the FAT sectors.
+    """
+
+    def __init__(self, cache, allocator):
+        """
+        Mounts the file system.
+
+        Parameters:
+            cache           BufferCache in front of a formatted disk
+            allocator       SectorAllocator of the same partition
+        """
+        self.cache = cache
+        self.allocator = allocator
+        self.sectorSize = cache.sectorSize
+        info = cache.readSector(allocator.partitionStart)
+        self.fatStart = listutils.numJoin(info[0:6])
+        self.fatSize = listutils.numJoin(info[6:12])
+        self.entriesPerSector = self.sectorSize // CONST.FAT_ENTRY_SIZE
+        self.slots = self.fatSize*self.entriesPerSector
+        self.index = {}  # (name, ext) -> FileEntry
+        self.freeSlots = []  # Heap of empty slots
+        fat = cache.readSectors(self.fatStart, self.fatSize)
+        for slot in range(self.slots):
+            offset = self._offset(slot)
+            entry = decodeEntry(slot, fat[offset:offset + CONST.FAT_ENTRY_SIZE])
+            if (entry is None):
+                self.freeSlots.append(slot)
+            else:
+                self.index[(entry.name, entry.ext)] = entry
+        heapq.heapify(self.freeSlots)
+
+    def _offset(self, slot):
+        sector, position = divmod(slot, self.entriesPerSector)
+        return sector*self.sectorSize + position*CONST.FAT_ENTRY_SIZE
+
+    def _writeEntry(self, slot, words):
+        sector, position = divmod(slot, self.entriesPerSector)
+        self.cache.writeSector(self.fatStart + sector, words,
+                               position*CONST.FAT_ENTRY_SIZE)
+
+    def _checkName(self, name, ext):
+        if (not name) or (len(name) > NAME_SIZE) or (len(ext) > EXT_SIZE) or \
+                ("\0" in name + ext):
+            raise ValueError("Invalid file name: %s.%s" % (name, ext))
+
+    def _store(self, words):
+        """Allocates and writes an extent. Returns (start, size, lastWords)."""
+        size = math.ceil(len(words)/self.sectorSize)
+        if (size == 0):
+            return 0, 0, 0
+        start = self.allocator.allocate(size)
+        if (start < 0):
+            return start, 0, 0
+        self.cache.writeSectors(start, words)
+        return start, size, len(words) - (size - 1)*self.sectorSize
+
+    def create(self, name, ext, words=(), fileType=CONST.FILE_DATA):
+        """
+        Creates a file holding words.
+
+        Returns:
+            FileEntry       the new file
+            ER_FEXIST       a file with that name exists
+            ER_FATFULL      no free FAT entry
+            ER_DSK          not enough contiguous free sectors
+        """
+        self._checkName(name, ext)
+        if ((name, ext) in self.index):
+            return CONST.ER_FEXIST
+        if (not self.freeSlots):
+            return CONST.ER_FATFULL
+        start, size, lastWords = self._store(words)
+        if (start < 0):
+            return start
+        entry = FileEntry(heapq.heappop(self.freeSlots), fileType, name, ext, start,
+                          size, lastWords)
+        self._writeEntry(entry.slot, encodeEntry(entry))
+        self.index[(name, ext)] = entry
+        return entry
+
+    def open(self, name, ext):
+        """
+        Looks a file up.
+
+        Returns:
+            FileEntry       the file
+            ER_FILEOPEN     no such file
+        """
+        return self.index.get((name, ext), CONST.ER_FILEOPEN)
+
+    def read(self, entry):
+        """Returns the words of an open file, reading its extent at once."""
+        if (entry.size == 0):
+            return []
+        words = self.cache.readSectors(entry.start, entry.size)
+        return words[:entry.length(self.sectorSize)]
+
+    def write(self, entry, words):
+        """
+        Replaces the contents of an open file. The new extent is written
+        before the old one is freed, so a failed write leaves the file as
+        it was.
+
+        Returns:
+            OK              written
+            ER_DSK          not enough contiguous free sectors
+        """
+        start, size, lastWords = self._store(words)
+        if (start < 0):
+            return start
+        if (entry.size):
+            self.allocator.free(entry.start, entry.size)
+        entry.start, entry.size, entry.lastWords = start, size, lastWords
+        self._writeEntry(entry.slot, encodeEntry(entry))
+        return CONST.OK
+
+    def delete(self, name, ext):
+        """
+        Removes a file and frees its sectors.
+
+        Returns:
+            OK              deleted
+            ER_FILEOPEN     no such file
+        """
+        entry = self.index.pop((name, ext), None)
+        if (entry is None):
+            return CONST.ER_FILEOPEN
+        if (entry.size):
+            self.allocator.free(entry.start, entry.size)
+        self._writeEntry(entry.slot, [0]*CONST.FAT_ENTRY_SIZE)
+        heapq.heappush(self.freeSlots, entry.slot)
+        return CONST.OK
+
+    def list(self):
+        """Returns every file's FileEntry in FAT order."""
+        return sorted(self.index.values(), key=lambda entry: entry.slot)
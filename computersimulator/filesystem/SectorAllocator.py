@@ -0,0 +1,167 @@
+from bisect import bisect_left, bisect_right, insort
+import computersimulator.utils.listutils as listutils
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+
+def readBitmapRun(cache, bitmapStart, entry, count):
+    """
+    Reads count bitmap entries starting at entry.
+
+    Parameters:
+        cache           BufferCache or SimulatedDisk
+        bitmapStart     first sector of the bitmap
+        entry           first entry, the partition relative sector number
+        count           number of entries
+    """
+    sectorSize = cache.sectorSize
+    words = []
+    while (count > 0):
+        sector, offset = divmod(entry, sectorSize)
+        run = min(count, sectorSize - offset)
+        words += cache.readSector(bitmapStart + sector, offset, offset + run)
+        entry += run
+        count -= run
+    return words
+
+
+def writeBitmapRun(cache, bitmapStart, entry, count, value):
+    """
+    Sets count bitmap entries starting at entry to value, one sector write
+    per bitmap sector touched.
+
+    Parameters:
+        cache           BufferCache or SimulatedDisk
+        bitmapStart     first sector of the bitmap
+        entry           first entry, the partition relative sector number
+        count           number of entries
+        value           BTMP_FREE, BTMP_USED, BTMP_SYS or BTMP_INV
+    """
+    sectorSize = cache.sectorSize
+    while (count > 0):
+        sector, offset = divmod(entry, sectorSize)
+        run = min(count, sectorSize - offset)
+        cache.writeSector(bitmapStart + sector, [value]*run, offset)
+        entry += run
+        count -= run
+
+
+class SectorAllocator:
+    """
+    Allocates contiguous runs of sectors in partition 1. The on-disk sector
+    bitmap (one word per sector, see docs/DiskAndFSInfo.txt) stays the
+    record of what is used. Free runs are also indexed in memory, sorted by
+    start for coalescing and by length for best fit, so allocate, free and
+    largestFreeRun find a run in O(log n). Adding or removing a run inserts
+    into or deletes from sorted Python lists, which is O(n) in the number of
+    free runs, but only a memory move with a small constant.
+    """
+
+    def __init__(self, cache):
+        """
+        Reads the partition layout and builds the free run index from the
+        bitmap.
+
+        Parameters:
+            cache           BufferCache in front of a formatted disk
+        """
+        self.cache = cache
+        mbr = cache.readSector(0)
+        self.partitionStart = listutils.numJoin(mbr[2:8])
+        self.partitionSize = listutils.numJoin(mbr[8:14])
+        info = cache.readSector(self.partitionStart)
+        self.bitmapStart = listutils.numJoin(info[12:18])
+        self.bitmapSize = listutils.numJoin(info[18:24])
+        self.starts = []  # Entry of each free run, sorted
+        self.lengths = {}  # Free run entry -> length
+        self.bySize = []  # (length, entry) of each free run, sorted
+        self.freeCount = 0
+        bitmap = readBitmapRun(cache, self.bitmapStart, 0, self.partitionSize)
+        entry = 0
+        while (entry < self.partitionSize):
+            if (bitmap[entry] == CONST.BTMP_FREE):
+                end = entry
+                while (end < self.partitionSize) and (bitmap[end] == CONST.BTMP_FREE):
+                    end += 1
+                self._addRun(entry, end - entry)
+                entry = end
+            else:
+                entry += 1
+
+    def _addRun(self, entry, length):
+        insort(self.starts, entry)
+        self.lengths[entry] = length
+        insort(self.bySize, (length, entry))
+        self.freeCount += length
+
+    def _removeRun(self, entry):
+        length = self.lengths.pop(entry)
+        del self.starts[bisect_left(self.starts, entry)]
+        del self.bySize[bisect_left(self.bySize, (length, entry))]
+        self.freeCount -= length
+        return length
+
+    def allocate(self, count):
+        """
+        Allocates count contiguous sectors from the smallest free run that
+        fits, the lowest one if several do.
+
+        Parameters:
+            count           number of sectors
+
+        Returns:
+            sector          absolute number of the first sector
+            ER_DSK          no free run is long enough
+        """
+        if (count <= 0):
+            raise ValueError("Sector count must be positive")
+        index = bisect_left(self.bySize, (count, -1))
+        if (index == len(self.bySize)):
+            return CONST.ER_DSK
+        length, entry = self.bySize[index]
+        self._removeRun(entry)
+        if (length > count):
+            self._addRun(entry + count, length - count)
+        writeBitmapRun(self.cache, self.bitmapStart, entry, count, CONST.BTMP_USED)
+        return self.partitionStart + entry
+
+    def free(self, sector, count):
+        """
+        Frees count sectors starting at sector and merges them with the
+        free runs next to them.
+
+        Parameters:
+            sector          absolute number of the first sector
+            count           number of sectors
+
+        Returns:
+            OK              sectors freed
+            ER_INVALIDADDR  the sectors are not all allocated
+        """
+        entry = sector - self.partitionStart
+        if (count <= 0) or (entry < 0) or (entry + count > self.partitionSize):
+            return CONST.ER_INVALIDADDR
+        if (readBitmapRun(self.cache, self.bitmapStart, entry, count)
+                != [CONST.BTMP_USED]*count):
+            return CONST.ER_INVALIDADDR
+        writeBitmapRun(self.cache, self.bitmapStart, entry, count, CONST.BTMP_FREE)
+        start, end = entry, entry + count
+        index = bisect_right(self.starts, entry) - 1
+        if (index >= 0):
+            previous = self.starts[index]
+            if (previous + self.lengths[previous] == entry):
+                start = previous
+                self._removeRun(previous)
+        if (end in self.lengths):
+            end += self._removeRun(end)
+        self._addRun(start, end - start)
+        return CONST.OK
+
+    def largestFreeRun(self):
+        """Returns the length of the longest run of free sectors."""
+        return self.bySize[-1][0] if self.bySize else 0
+
+    def freeSectors(self):
+        """Returns the number of free sectors."""
+        return self.freeCount
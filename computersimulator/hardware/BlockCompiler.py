@@ -0,0 +1,243 @@
+import logging
+from computersimulator.hardware.DispatchEngine import (
+    DispatchEngine, ALU_EXPRESSIONS, BRANCH_CONDITIONS, OPCODE_CYCLES,
+    VALID_MODES, PURE_MODES, operandSource, indent)
+from computersimulator.utils.bitutils import truncatedDivide
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+logger = logging.getLogger(__name__)
+
+# Longest run of instructions compiled into one block
+MAX_BLOCK_INSTRUCTIONS = 64
+# Modes that read or write a register
+REGISTER_MODES = frozenset((CONST.MODE_REGISTER, CONST.MODE_REGDEFERRED,
+                            CONST.MODE_AUTOINC, CONST.MODE_AUTODEC))
+
+
+class BlockCompiler(DispatchEngine):
+    """
+    Compiles straight-line runs of guest instructions into Python functions.
+    A block starts at the address it is entered from and ends at a branch
+    (which is compiled into it) or just before an instruction that can't be
+    compiled (SYSTEM, HALT, invalid opcodes and modes) or an idle loop, a
+    branch to itself that the dispatch engine skips to the end of the
+    timeslice. Registers are kept in locals and pc and clock are written
+    once when the block exits.
+
+    Blocks only run when the whole block fits in the remaining timeslice,
+    otherwise instructions are executed one at a time by the dispatch engine
+    so timeslices expire on exactly the same instruction as the legacy loop.
+    """
+
+    def __init__(self, cpu):
+        super().__init__(cpu)
+        self.blocks = {}  # Entry address -> (function, ticks before last) or False
+        self.blockOwners = {}  # Word address -> entry addresses of blocks using it
+        cpu.invalidationHooks.append(self.invalidate)
+
+    def invalidate(self, start=None, end=None):
+        """
+        Drops compiled blocks that read any word in [start, end). With no
+        arguments all blocks are dropped.
+        """
+        if (start is None):
+            self.blocks.clear()
+            self.blockOwners.clear()
+            return
+        if (end is None):
+            end = start + 1
+        if (end - start > len(self.blockOwners)):
+            addrs = [addr for addr in self.blockOwners if start <= addr < end]
+        else:
+            addrs = range(start, end)
+        for addr in addrs:
+            owners = self.blockOwners.pop(addr, None)
+            if (owners):
+                for owner in owners:
+                    self.blocks.pop(owner, None)
+
+    def compile(self, start):
+        """
+        Finds and compiles the block entered at start.
+
+        Parameters:
+            start           address of the first instruction
+
+        Returns:
+            tuple           block function and the ticks used before its last
+                            instruction
+            False           the instruction at start can't be compiled
+        """
+        instructions = []
+        addr = start
+        while (len(instructions) < MAX_BLOCK_INSTRUCTIONS) and \
+                (addr >= 0) and (addr <= 9999):
+            decoded = self.cpu.decodeInstruction(addr)
+            if (not self._compilable(decoded)) or (self._idleLoop(addr, decoded)):
+                if (not instructions):
+                    self._own(start, decoded[-1], start)
+                    self.blocks[start] = False
+                    return False
+                break
+            instructions.append((addr, decoded))
+            addr = decoded[-1]
+            if (decoded[1] in constants.BRANCH_OPCODES):
+                break
+        run, ticks, lastTicks = self._compileBlock(start, addr, instructions)
+        block = (run, ticks - lastTicks)
+        self._own(start, addr, start)
+        self.blocks[start] = block
+        return block
+
+    def _own(self, start, end, owner):
+        for addr in range(start, end):
+            self.blockOwners.setdefault(addr, set()).add(owner)
+        self.cpu.markDecoded(start, end)
+
+    def _compilable(self, decoded):
+        (ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+         op1_word, op2_word, target_word, end) = decoded
+        if (op_code in ALU_EXPRESSIONS):
+            return self._compilableOperand(op1_mode, op1_word) and \
+                self._compilableOperand(op2_mode, op2_word)
+        if (op_code in BRANCH_CONDITIONS):
+            return self._compilableOperand(op1_mode, op1_word) and \
+                target_word is not None
+        if (op_code == CONST.OP_BRANCH):
+            return target_word is not None
+        return False
+
+    def _idleLoop(self, addr, decoded):
+        """True if the instruction at addr is a branch to itself that can't
+        change anything while it spins."""
+        op_code, op1_mode, target_word = decoded[1], decoded[2], decoded[8]
+        if (target_word != addr):
+            return False
+        return (op_code == CONST.OP_BRANCH) or \
+            ((op_code in BRANCH_CONDITIONS) and (op1_mode in PURE_MODES))
+
+    def _compilableOperand(self, mode, word):
+        if (mode not in VALID_MODES):
+            return False
+        if (mode == CONST.MODE_DIRECT):
+            return word is not None and word >= 0 and word <= 9999
+        if (mode == CONST.MODE_IMMEDIATE):
+            return word is not None
+        return True
+
+    def _compileBlock(self, start, end, instructions):
+        """
+        Generates and compiles the function for a block.
+
+        Returns: function, ticks used by the block, ticks used by its last
+        instruction
+        """
+        regs = set()
+        for addr, decoded in instructions:
+            if (decoded[1] in constants.OPERAND1_OPCODES) and \
+                    (decoded[2] in REGISTER_MODES):
+                regs.add(decoded[3])
+            if (decoded[1] in constants.OPERAND2_OPCODES) and \
+                    (decoded[4] in REGISTER_MODES):
+                regs.add(decoded[5])
+        regs = sorted(regs)
+        writeBack = ["gpr[%d] = r%d" % (reg, reg) for reg in regs]
+
+        def exitSource(pc, ticks, status=None, ir=None):
+            return writeBack + ["cpu.pc = %d" % pc,
+                                "cpu.ir = %d" % ir,
+                                "cpu.clock = clock + %d" % ticks,
+                                "return %s" % ("" if status is None else status)]
+
+        lines = ["clock = cpu.clock"]
+        lines += ["r%d = gpr[%d]" % (reg, reg) for reg in regs]
+        ticks = 0
+        cycles = 0
+        for addr, decoded in instructions:
+            (ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+             op1_word, op2_word, target_word, next_addr) = decoded
+            cycles = OPCODE_CYCLES[op_code]
+            lines += ["# %d: %s" % (addr, hex(ir))]
+
+            def onError(consumed, addr=addr, ticks=ticks, ir=ir):
+                return exitSource(addr + consumed, ticks, CONST.ER_INVALIDMODE, ir)
+
+            if (op_code == CONST.OP_BRANCH):
+                lines += exitSource(target_word, ticks + cycles, ir=ir)
+                break
+            operand, consumed = operandSource(1, op1_mode, 1, onError,
+                                              "r%d" % op1_reg, op1_word, addr)
+            lines += operand
+            if (op_code in BRANCH_CONDITIONS):
+                lines += ["if (%s):" % BRANCH_CONDITIONS[op_code]]
+                lines += indent(exitSource(target_word, ticks + cycles, ir=ir))
+                lines += exitSource(next_addr, ticks + cycles, ir=ir)
+                break
+            operand, consumed = operandSource(2, op2_mode, consumed, onError,
+                                              "r%d" % op2_reg, op2_word, addr)
+            lines += operand
+            if (op_code == CONST.OP_DIV):
+                lines += ["if (op1_value == 0):"]
+                lines += indent(exitSource(addr + consumed, ticks,
+                                           CONST.ER_DIVBYZ, ir))
+            result = ALU_EXPRESSIONS[op_code]
+            ticks += cycles
+            if (op2_mode == CONST.MODE_REGISTER):
+                lines += ["r%d = %s" % (op2_reg, result)]
+            else:
+                # Stores into the block itself leave it so the next
+                # instruction is decoded again
+                lines += ["ram[op2_addr] = %s" % result,
+                          "if (codeWords[op2_addr]):",
+                          "    cpu.invalidateDecodeCache(op2_addr)",
+                          "    if (%d <= op2_addr < %d):" % (start, end)]
+                lines += indent(exitSource(next_addr, ticks, ir=ir), 2)
+        else:
+            lines += exitSource(end, ticks, ir=ir)
+            return self._define(lines), ticks, cycles
+        return self._define(lines), ticks + cycles, cycles
+
+    def _define(self, lines):
+        source = "\n".join(["def block(cpu, ram, gpr, codeWords):"]
+                           + indent(lines))
+        namespace = {"truncatedDivide": truncatedDivide}
+        exec(source, namespace)
+        return namespace["block"]
+
+    def executeProgram(self, systemCallCallback, timeslice=CONST.DFLT_TIMESLICE):
+        """
+        Runs compiled blocks from the current PC until the program halts,
+        waits, errors or the timeslice expires.
+        """
+        if (self.cpu.trace is not None) or (logger.isEnabledFor(logging.DEBUG)):
+            # Instruction level tracing needs one instruction at a time
+            return super().executeProgram(systemCallCallback, timeslice)
+        cpu = self.cpu
+        ram = cpu.sram.ram
+        gpr = cpu.gpr
+        codeWords = cpu.codeWords
+        decodeCache = cpu.decodeCache
+        blocks = self.blocks
+        clock_start = cpu.clock
+        cpu.timesliceEnd = clock_start + timeslice
+        while (True):
+            pc = cpu.pc
+            if (pc < 0) or (pc > 9999): # Check to see if PC valid
+                return CONST.ER_PC
+            elapsed = cpu.clock - clock_start
+            if (elapsed >= timeslice):
+                return CONST.TIMESLICE
+            block = blocks.get(pc)
+            if (block is None):
+                block = self.compile(pc)
+            if (block) and (elapsed + block[1] < timeslice):
+                status = block[0](cpu, ram, gpr, codeWords)
+            else:
+                # Exact mode, one instruction at a time
+                entry = decodeCache.get(pc)
+                if (entry is None):
+                    entry = self.decode(pc)
+                status = entry[0](cpu, entry, systemCallCallback)
+            if (status is not None):
+                return status
@@ -0,0 +1,131 @@
+from array import array
+from collections import OrderedDict
+
+
+class BufferCache:
+    """
+    Write-back LRU cache of whole sectors in front of a SimulatedDisk. Reads
+    and writes go to the cached copy, a dirty sector reaches the disk only
+    when it is evicted or the cache is flushed.
+    """
+
+    def __init__(self, disk, capacity=64):
+        if (capacity <= 0):
+            raise ValueError("Cache capacity must be positive")
+        self.disk = disk
+        self.sectorSize = disk.sectorSize
+        self.capacity = capacity
+        self.sectors = OrderedDict()  # Sector -> [words, dirty], oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0  # Dirty sectors written to the disk
+
+    def _buffer(self, sector):
+        entry = self.sectors.get(sector)
+        if (entry is not None):
+            self.hits += 1
+            self.sectors.move_to_end(sector)
+            return entry
+        self.misses += 1
+        entry = [array(self.disk.WORD_TYPECODE, self.disk.readSector(sector)), False]
+        self.sectors[sector] = entry
+        if (len(self.sectors) > self.capacity):
+            oldSector, oldEntry = self.sectors.popitem(last=False)
+            self.evictions += 1
+            self._writeBack(oldSector, oldEntry)
+        return entry
+
+    def _writeBack(self, sector, entry):
+        if (entry[1]):
+            self.disk.writeSector(sector, entry[0])
+            entry[1] = False
+            self.writebacks += 1
+
+    def readSector(self, sector, start=0, end=None):
+        """
+        Reads words from one sector through the cache.
+
+        Parameters:
+            sector          sector number
+            start           first word in the sector
+            end             word after the last, defaults to the sector end
+
+        Returns:
+            list            the words
+        """
+        if (end is None):
+            end = self.disk.sectorSize
+        self.disk.checkSector(sector, start, end - start)
+        return self._buffer(sector)[0][start:end].tolist()
+
+    def writeSector(self, sector, words, start=0):
+        """
+        Writes words into the cached copy of a sector and marks it dirty.
+
+        Parameters:
+            sector          sector number
+            words           sequence of ints, at most the rest of the sector
+            start           first word in the sector
+        """
+        self.disk.checkSector(sector, start, len(words))
+        entry = self._buffer(sector)
+        entry[0][start:start + len(words)] = array(self.disk.WORD_TYPECODE, words)
+        entry[1] = True
+
+    def readSectors(self, sector, count):
+        """
+        Reads count whole sectors starting at sector. Cached sectors come
+        from the cache, runs of uncached ones are read from the disk in one
+        slice each without being cached, so large files don't evict
+        metadata.
+
+        Returns:
+            list            count*sectorSize words
+        """
+        words = []
+        end = sector + count
+        while (sector < end):
+            entry = self.sectors.get(sector)
+            if (entry is not None):
+                self.hits += 1
+                self.sectors.move_to_end(sector)
+                words += entry[0].tolist()
+                sector += 1
+                continue
+            run = sector + 1
+            while (run < end) and (run not in self.sectors):
+                run += 1
+            self.misses += run - sector
+            words += self.disk.readSectors(sector, run - sector)
+            sector = run
+        return words
+
+    def writeSectors(self, sector, words):
+        """
+        Writes words over whole sectors starting at sector, padding the last
+        one with zeros. Cached sectors are updated in the cache, the rest
+        are written straight to the disk.
+        """
+        size = self.sectorSize
+        for offset in range(0, len(words), size):
+            data = list(words[offset:offset + size])
+            data += [0]*(size - len(data))
+            if (sector in self.sectors):
+                self.writeSector(sector, data)
+            else:
+                self.disk.checkSector(sector, 0, size)
+                self.disk.writeSector(sector, data)
+            sector += 1
+
+    def flush(self):
+        """Writes every dirty sector back and flushes the disk."""
+        for sector, entry in self.sectors.items():
+            self._writeBack(sector, entry)
+        self.disk.flush()
+
+    def stats(self):
+        """Returns the cache counters as a dict."""
+        return {"capacity": self.capacity, "cached": len(self.sectors),
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "writebacks": self.writebacks}
@@ -0,0 +1,106 @@
+from collections import deque
+import logging
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+logger = logging.getLogger(__name__)
+
+
+class DiskController:
+    """
+    Asynchronous disk device. A request is queued with the clock it was
+    made at and finishes after the controller has served the requests ahead
+    of it, moved the head to the sector's track and transferred the sector.
+    The sector is copied to or from RAM (DMA) when the request completes,
+    which the OS picks up from poll at its next context switch.
+    """
+
+    def __init__(self, cpu, seekTicks=2, transferTicks=40, sectorsPerTrack=16):
+        """
+        Parameters:
+            cpu             SimulatedCPU whose buffer cache and RAM are used
+            seekTicks       clock ticks to move the head one track
+            transferTicks   clock ticks to transfer one sector
+            sectorsPerTrack sectors on a track
+        """
+        self.cpu = cpu
+        self.cache = cpu.bufferCache
+        self.sectorSize = cpu.sdisk.sectorSize
+        self.seekTicks = seekTicks
+        self.transferTicks = transferTicks
+        self.sectorsPerTrack = sectorsPerTrack
+        self.pending = deque()  # (done clock, pid, op, sector, address) in order
+        self.head = 0  # Track under the head once queued requests finish
+        self.busyUntil = 0  # Clock the last queued request finishes
+        self.requests = 0
+        self.busyTicks = 0  # Ticks spent seeking and transferring
+
+    def submit(self, pid, op, sector, address, clock):
+        """
+        Queues a sector transfer.
+
+        Parameters:
+            pid             process to wake when it completes
+            op              DISK_READ into RAM or DISK_WRITE from RAM
+            sector          sector number
+            address         first RAM word of the sector sized buffer
+            clock           current clock
+
+        Returns:
+            int             clock the transfer completes at
+        """
+        track = sector // self.sectorsPerTrack
+        ticks = self.seekTicks*abs(track - self.head) + self.transferTicks
+        done = max(clock, self.busyUntil) + ticks
+        self.head = track
+        self.busyUntil = done
+        self.requests += 1
+        self.busyTicks += ticks
+        self.pending.append((done, pid, op, sector, address))
+        logger.debug("Disk request pid %d op %d sector %d done at %d",
+                     pid, op, sector, done)
+        return done
+
+    def poll(self, clock):
+        """
+        Completes every transfer due by clock.
+
+        Returns:
+            list            (pid, status) of the completed requests
+        """
+        completed = []
+        while (self.pending) and (self.pending[0][0] <= clock):
+            done, pid, op, sector, address = self.pending.popleft()
+            size = self.sectorSize
+            if (op == CONST.DISK_READ):
+                self.cpu.sram.load(address, self.cache.readSector(sector))
+                self.cpu.invalidateDecodeCache(address, address + size)
+            else:
+                self.cache.writeSector(sector,
+                                       self.cpu.sram.ram[address:address + size])
+            completed.append((pid, CONST.OK))
+        return completed
+
+    def cancel(self, pid):
+        """Drops the transfers of a process that is going away."""
+        if (any(request[1] == pid for request in self.pending)):
+            self.pending = deque(request for request in self.pending
+                                 if request[1] != pid)
+
+    def busy(self):
+        """True while transfers are outstanding."""
+        return bool(self.pending)
+
+    def words(self):
+        """Returns the head, busy clock and queued requests as a flat list of
+        ints for a checkpoint."""
+        words = [self.head, self.busyUntil, len(self.pending)]
+        for request in self.pending:
+            words += request
+        return words
+
+    def restore(self, words):
+        """Replaces the queued requests with those in a list from words."""
+        self.head, self.busyUntil, count = words[:3]
+        self.pending = deque(tuple(words[index:index + 5])
+                             for index in range(3, 3 + 5*count, 5))
@@ -0,0 +1,424 @@
+import logging
+from computersimulator.utils.bitutils import *
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+logger = logging.getLogger(__name__)
+
+# Layout of a decode cache entry used by the dispatch engine
+ENTRY_HANDLER = 0
+ENTRY_IR = 1
+ENTRY_OP1_REG = 2
+ENTRY_OP2_REG = 3
+ENTRY_OP1_WORD = 4
+ENTRY_OP2_WORD = 5
+ENTRY_TARGET = 6
+
+# Modes 6-15 are all invalid and share one handler
+INVALID_MODE = -1
+VALID_MODES = frozenset((CONST.MODE_DIRECT, CONST.MODE_REGISTER,
+                         CONST.MODE_REGDEFERRED, CONST.MODE_AUTOINC,
+                         CONST.MODE_AUTODEC, CONST.MODE_IMMEDIATE))
+# Modes that read an operand without changing a register
+PURE_MODES = frozenset((CONST.MODE_DIRECT, CONST.MODE_REGISTER,
+                        CONST.MODE_REGDEFERRED, CONST.MODE_IMMEDIATE))
+
+
+def wrapSource(expression):
+    """Returns expression wrapped to a signed 64 bit word, inlined wrapWord."""
+    return "((%s) + %d & %d) - %d" % (expression, WORD_BIAS, WORD_MASK, WORD_BIAS)
+
+
+# Result of each ALU opcode in terms of the fetched operands. Operands are
+# always words, so only arithmetic can leave the word range and need wrapping
+ALU_EXPRESSIONS = {
+    CONST.OP_ADD: wrapSource("op1_value + op2_value"),
+    CONST.OP_SUB: wrapSource("op2_value - op1_value"),
+    CONST.OP_MULT: wrapSource("op1_value * op2_value"),
+    CONST.OP_DIV: wrapSource("truncatedDivide(op2_value, op1_value)"),
+    CONST.OP_MOVE: "op1_value",
+}
+# Condition under which each conditional branch is taken
+BRANCH_CONDITIONS = {
+    CONST.OP_BRANCHM: "op1_value < 0",
+    CONST.OP_BRANCHP: "op1_value > 0",
+    CONST.OP_BRANCHZ: "op1_value == 0",
+}
+# Clock ticks taken by each opcode
+OPCODE_CYCLES = {
+    CONST.OP_HALT: 12,
+    CONST.OP_ADD: 3,
+    CONST.OP_SUB: 3,
+    CONST.OP_MULT: 6,
+    CONST.OP_DIV: 6,
+    CONST.OP_MOVE: 2,
+    CONST.OP_BRANCH: 2,
+    CONST.OP_BRANCHM: 4,
+    CONST.OP_SYSTEM: 12,
+    CONST.OP_BRANCHP: 4,
+    CONST.OP_BRANCHZ: 4,
+}
+
+# Values substituted into the generated handler source
+_SOURCE_CONSTANTS = {
+    "OK": CONST.OK,
+    "WAITING": CONST.WAITING,
+    "HALT": CONST.HALT,
+    "ER_INVALIDMODE": CONST.ER_INVALIDMODE,
+    "ER_INVALIDADDR": CONST.ER_INVALIDADDR,
+    "ER_OPNOTIMP": CONST.ER_OPNOTIMP,
+    "ER_INVALIDOP": CONST.ER_INVALIDOP,
+    "ER_DIVBYZ": CONST.ER_DIVBYZ,
+    "truncatedDivide": truncatedDivide,
+}
+
+
+def operandSource(n, mode, consumed, onError, reg=None, word=None, pc="pc"):
+    """
+    Builds the source lines that fetch operand n in the given mode. Mirrors
+    SimulatedCPU._fetchOperand with the mode resolved ahead of time.
+
+    Parameters:
+        n               operand number, 1 or 2
+        mode            addressing mode of the operand
+        consumed        words of the instruction consumed before this operand
+        onError         function taking the words consumed at the point of
+                        failure and returning the lines that report it
+        reg             expression for the operand register, defaults to the
+                        register held in the dispatch entry
+        word            expression for the operand word, or an int when the
+                        word is known at compile time
+        pc              expression for the instruction address, or an int
+
+    Returns:
+        lines           source lines defining op<n>_addr and op<n>_value
+        consumed        words consumed after this operand
+    """
+    if (reg is None):
+        reg = "gpr[entry[%d]]" % (ENTRY_OP1_REG if n == 1 else ENTRY_OP2_REG)
+    if (word is None):
+        word = "entry[%d]" % (ENTRY_OP1_WORD if n == 1 else ENTRY_OP2_WORD)
+    static = isinstance(word, int)
+    addr = "op%d_addr" % n
+    value = "op%d_value" % n
+    rangeCheck = "if (%s < 0) or (%s > 9999):" % (addr, addr)
+    if (mode == CONST.MODE_DIRECT):
+        if (static):
+            if (word < 0) or (word > 9999):
+                return onError(consumed + 1), consumed + 1
+            return ["%s = %d" % (addr, word),
+                    "%s = ram[%d]" % (value, word)], consumed + 1
+        lines = ["%s = %s" % (addr, word),
+                 "if (%s is None):" % addr]
+        lines += indent(onError(consumed))
+        lines += [rangeCheck]
+        lines += indent(onError(consumed + 1))
+        lines += ["%s = ram[%s]" % (value, addr)]
+        return lines, consumed + 1
+    elif (mode == CONST.MODE_REGISTER):
+        return ["%s = %s" % (value, reg)], consumed
+    elif (mode == CONST.MODE_REGDEFERRED):
+        lines = ["%s = %s" % (addr, reg), rangeCheck]
+        lines += indent(onError(consumed))
+        lines += ["%s = ram[%s]" % (value, addr)]
+        return lines, consumed
+    elif (mode == CONST.MODE_AUTOINC):
+        lines = ["%s = %s" % (addr, reg), rangeCheck]
+        lines += indent(onError(consumed))
+        lines += ["%s = ram[%s]" % (value, addr),
+                  "%s += 1" % reg]
+        return lines, consumed
+    elif (mode == CONST.MODE_AUTODEC):
+        lines = ["%s -= 1" % reg,
+                 "%s = %s" % (addr, reg), rangeCheck]
+        lines += indent(onError(consumed))
+        lines += ["%s = ram[%s]" % (value, addr)]
+        return lines, consumed
+    elif (mode == CONST.MODE_IMMEDIATE):
+        lines = ["%s = %s" % (addr, offset(pc, consumed)),
+                 "%s = %s" % (value, word)]
+        if (not static):
+            lines += ["if (%s is None):" % value]
+            lines += indent(onError(consumed + 1))
+        return lines, consumed + 1
+    else:
+        return onError(consumed), consumed
+
+
+def storeSource(mode, result, reg=None):
+    """Builds the source lines that store result into operand 2."""
+    if (mode == CONST.MODE_REGISTER):
+        if (reg is None):
+            reg = "gpr[entry[%d]]" % ENTRY_OP2_REG
+        return ["%s = %s" % (reg, result)]
+    return ["ram[op2_addr] = %s" % result,
+            "if (cpu.codeWords[op2_addr]):",
+            "    cpu.invalidateDecodeCache(op2_addr)"]
+
+
+def offset(pc, words):
+    """Returns the expression for the address words past pc."""
+    if (isinstance(pc, int)):
+        return str(pc + words)
+    return "%s + %d" % (pc, words)
+
+
+def indent(lines, depth=1):
+    return ["    "*depth + line for line in lines]
+
+
+def _fetchError(consumed):
+    return ["cpu.pc = pc + %d" % consumed,
+            "return ER_INVALIDMODE"]
+
+
+def _aluSource(op_code):
+    expression = ALU_EXPRESSIONS[op_code]
+    cycles = OPCODE_CYCLES[op_code]
+
+    def build(op1_mode, op2_mode):
+        lines, consumed = operandSource(1, op1_mode, 1, _fetchError)
+        if (op1_mode == INVALID_MODE):
+            return lines
+        op2, consumed = operandSource(2, op2_mode, consumed, _fetchError)
+        lines += op2
+        if (op2_mode == INVALID_MODE):
+            return lines
+        if (op_code == CONST.OP_DIV):
+            lines += ["if (op1_value == 0):",
+                      "    cpu.pc = pc + %d" % consumed,
+                      "    return ER_DIVBYZ"]
+        lines += storeSource(op2_mode, expression)
+        lines += ["cpu.pc = pc + %d" % consumed,
+                  "cpu.clock += %d" % cycles]
+        return lines
+    return build
+
+
+def _spinSource(cycles):
+    """
+    Builds the lines that take a branch to target. A branch to itself that
+    changes nothing but the clock spins until the timeslice ends, so the
+    clock jumps straight to the value executing it that many times would
+    leave, the first multiple of cycles at or past cpu.timesliceEnd.
+    """
+    return ["cpu.pc = target",
+            "if (target == pc) and (cpu.timesliceEnd is not None):",
+            "    cpu.clock += %d*max(1, (cpu.timesliceEnd - cpu.clock + %d)//%d)"
+            % (cycles, cycles - 1, cycles),
+            "else:",
+            "    cpu.clock += %d" % cycles]
+
+
+def _conditionalBranchSource(op_code):
+    condition = BRANCH_CONDITIONS[op_code]
+    cycles = OPCODE_CYCLES[op_code]
+
+    def build(op1_mode, op2_mode):
+        lines, consumed = operandSource(1, op1_mode, 1, _fetchError)
+        if (op1_mode == INVALID_MODE):
+            return lines
+        if (op1_mode in PURE_MODES):
+            # Taken back to itself, the condition can never change
+            lines += ["if (%s):" % condition,
+                      "    target = entry[%d]" % ENTRY_TARGET]
+            lines += indent(_spinSource(cycles))
+            lines += ["else:",
+                      "    cpu.pc = pc + %d" % (consumed + 1),
+                      "    cpu.clock += %d" % cycles]
+            return lines
+        lines += ["if (%s):" % condition,
+                  "    cpu.pc = entry[%d]" % ENTRY_TARGET,
+                  "else:",
+                  "    cpu.pc = pc + %d" % (consumed + 1),
+                  "cpu.clock += %d" % cycles]
+        return lines
+    return build
+
+
+def _branchSource(op1_mode, op2_mode):
+    return ["target = entry[%d]" % ENTRY_TARGET,
+            "if (target is None):",
+            "    cpu.pc = pc + 1",
+            "    return ER_INVALIDADDR"] + _spinSource(OPCODE_CYCLES[CONST.OP_BRANCH])
+
+
+def _systemSource(op1_mode, op2_mode):
+    lines, consumed = operandSource(1, op1_mode, 1, _fetchError)
+    if (op1_mode == INVALID_MODE):
+        return lines
+    lines += ["cpu.pc = pc + %d" % consumed,
+              "status = systemCallCallback(op1_value)",
+              "cpu.clock += %d" % OPCODE_CYCLES[CONST.OP_SYSTEM],
+              "if (status == WAITING):",
+              "    return WAITING",
+              "if (status == HALT) or (status < 0):",
+              "    return OK"]
+    return lines
+
+
+def _haltSource(op1_mode, op2_mode):
+    return ["cpu.pc = pc + 1",
+            "cpu.clock += %d" % OPCODE_CYCLES[CONST.OP_HALT],
+            "return OK"]
+
+
+def _notImplementedSource(op1_mode, op2_mode):
+    return ["cpu.pc = pc + 1",
+            "return ER_OPNOTIMP"]
+
+
+def _invalidOpSource(op1_mode, op2_mode):
+    return ["cpu.pc = pc + 1",
+            "logger.warning(\"Invalid Op Code\")",
+            "return ER_INVALIDOP"]
+
+
+# Opcode -> builder for the body of its handler
+OPCODE_SOURCES = {
+    CONST.OP_HALT: _haltSource,
+    CONST.OP_ADD: _aluSource(CONST.OP_ADD),
+    CONST.OP_SUB: _aluSource(CONST.OP_SUB),
+    CONST.OP_MULT: _aluSource(CONST.OP_MULT),
+    CONST.OP_DIV: _aluSource(CONST.OP_DIV),
+    CONST.OP_MOVE: _aluSource(CONST.OP_MOVE),
+    CONST.OP_BRANCH: _branchSource,
+    CONST.OP_BRANCHM: _conditionalBranchSource(CONST.OP_BRANCHM),
+    CONST.OP_SYSTEM: _systemSource,
+    CONST.OP_BRANCHP: _conditionalBranchSource(CONST.OP_BRANCHP),
+    CONST.OP_BRANCHZ: _conditionalBranchSource(CONST.OP_BRANCHZ),
+    CONST.OP_PUSH: _notImplementedSource,
+    CONST.OP_POP: _notImplementedSource,
+}
+
+_handlers = {}
+
+
+def handlerFor(op_code, op1_mode, op2_mode):
+    """
+    Returns the handler specialized for an opcode and its operand modes,
+    compiling it the first time the combination is seen.
+
+    Parameters:
+        op_code         decoded opcode
+        op1_mode        decoded mode of operand 1
+        op2_mode        decoded mode of operand 2
+
+    Returns:
+        function        handler(cpu, entry, systemCallCallback) returning
+                        None to keep running or a status to stop with
+    """
+    if (op_code not in OPCODE_SOURCES):
+        op_code = None
+    op1_mode = op1_mode if op1_mode in VALID_MODES else INVALID_MODE
+    op2_mode = op2_mode if op2_mode in VALID_MODES else INVALID_MODE
+    if (op_code not in constants.OPERAND1_OPCODES):
+        op1_mode = None
+    if (op_code not in constants.OPERAND2_OPCODES):
+        op2_mode = None
+    key = (op_code, op1_mode, op2_mode)
+    handler = _handlers.get(key)
+    if (handler is None):
+        handler = _compileHandler(op_code, op1_mode, op2_mode)
+        _handlers[key] = handler
+    return handler
+
+
+def _compileHandler(op_code, op1_mode, op2_mode):
+    build = OPCODE_SOURCES.get(op_code, _invalidOpSource)
+    lines = ["def handler(cpu, entry, systemCallCallback):",
+             "    pc = cpu.pc",
+             "    ram = cpu.sram.ram",
+             "    gpr = cpu.gpr",
+             "    cpu.ir = entry[%d]" % ENTRY_IR]
+    lines += indent(build(op1_mode, op2_mode))
+    namespace = dict(_SOURCE_CONSTANTS, logger=logger)
+    exec("\n".join(lines), namespace)
+    return namespace["handler"]
+
+
+class DispatchEngine:
+    """
+    Executes instructions through a table of handlers specialized for each
+    opcode and pair of operand modes. Produces the same registers, memory,
+    clock and status codes as the legacy loop in SimulatedCPU.
+    """
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+    def decode(self, addr):
+        """
+        Decodes the instruction at addr into a dispatch entry and stores it in
+        the CPU decode cache.
+        """
+        (ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+         op1_word, op2_word, target_word, end) = self.cpu.decodeInstruction(addr)
+        entry = (handlerFor(op_code, op1_mode, op2_mode), ir, op1_reg,
+                 op2_reg, op1_word, op2_word, target_word)
+        self.cpu.decodeCache[addr] = entry
+        self.cpu.markDecoded(addr, end)
+        return entry
+
+    def executeProgram(self, systemCallCallback, timeslice=CONST.DFLT_TIMESLICE):
+        """
+        Runs instructions from the current PC until the program halts, waits,
+        errors or the timeslice expires.
+        """
+        cpu = self.cpu
+        if (cpu.trace is not None):
+            return self._executeTraced(systemCallCallback, timeslice)
+        decodeCache = cpu.decodeCache
+        debug = logger.isEnabledFor(logging.DEBUG)
+        clock_start = cpu.clock
+        # Lets idle loops skip to the end, unless each spin is logged
+        cpu.timesliceEnd = None if debug else clock_start + timeslice
+        while (True):
+            pc = cpu.pc
+            if (pc < 0) or (pc > 9999): # Check to see if PC valid
+                return CONST.ER_PC
+            if (cpu.clock - clock_start >= timeslice):
+                return CONST.TIMESLICE
+            entry = decodeCache.get(pc)
+            if (entry is None):
+                entry = self.decode(pc)
+            if (debug):
+                self._logInstruction(entry[ENTRY_IR])
+            status = entry[ENTRY_HANDLER](cpu, entry, systemCallCallback)
+            if (status is not None):
+                return status
+
+    def _executeTraced(self, systemCallCallback, timeslice):
+        """
+        Same as executeProgram, recording each instruction into cpu.trace.
+        Idle loops aren't skipped so every spin is recorded.
+        """
+        cpu = self.cpu
+        cpu.timesliceEnd = None
+        trace = cpu.trace
+        gpr = cpu.gpr
+        decodeCache = cpu.decodeCache
+        debug = logger.isEnabledFor(logging.DEBUG)
+        clock_start = cpu.clock
+        while (True):
+            pc = cpu.pc
+            if (pc < 0) or (pc > 9999): # Check to see if PC valid
+                return CONST.ER_PC
+            if (cpu.clock - clock_start >= timeslice):
+                return CONST.TIMESLICE
+            entry = decodeCache.get(pc)
+            if (entry is None):
+                entry = self.decode(pc)
+            if (debug):
+                self._logInstruction(entry[ENTRY_IR])
+            before = gpr[:]
+            status = entry[ENTRY_HANDLER](cpu, entry, systemCallCallback)
+            trace.record(cpu.clock, pc, entry[ENTRY_IR], before, gpr)
+            if (status is not None):
+                return status
+
+    def _logInstruction(self, ir):
+        logger.debug("IR:%s op_code:%s op1_mode:%s op1_reg:%s op1_mode:%s op1_reg:%s",
+                     hex(ir), hex(ir >> 16), hex(extractBits(ir, 4, 13)),
+                     hex(extractBits(ir, 4, 9)), hex(extractBits(ir, 4, 5)),
+                     hex(extractBits(ir, 4, 1)))
@@ -0,0 +1,121 @@
+import argparse
+import struct
+from computersimulator.utils.bitutils import *
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+# clock, pc, ir, mask of registers changed by the instruction, GPR0-7 after it
+RECORD = struct.Struct("<qqqq8q")
+# magic, format version, capacity in records, records written
+HEADER = struct.Struct("<4sIQQ")
+MAGIC = b"JCST"
+VERSION = 1
+
+OPCODE_NAMES = {getattr(CONST, name): name[3:]
+                for name in dir(CONST) if name.startswith("OP_")}
+
+
+class InstructionTrace:
+    """
+    Fixed size ring buffer of binary instruction records. Once full the
+    oldest records are overwritten, so a trace of any length run keeps the
+    last capacity instructions.
+    """
+
+    def __init__(self, capacity=65536):
+        if (capacity <= 0):
+            raise ValueError("Trace capacity must be positive")
+        self.capacity = capacity
+        self.buffer = bytearray(capacity*RECORD.size)
+        self.recorded = 0  # Records written since creation
+
+    def record(self, clock, pc, ir, before, after):
+        """
+        Appends one executed instruction.
+
+        Parameters:
+            clock           clock after the instruction
+            pc              address of the instruction
+            ir              instruction word
+            before          GPRs before the instruction
+            after           GPRs after the instruction
+        """
+        mask = 0
+        if (before != after):
+            for reg in range(len(after)):
+                if (before[reg] != after[reg]):
+                    mask |= 1 << reg
+        RECORD.pack_into(self.buffer,
+                         (self.recorded % self.capacity)*RECORD.size,
+                         clock, pc, ir, mask, *after)
+        self.recorded += 1
+
+    def __len__(self):
+        return min(self.recorded, self.capacity)
+
+    def records(self):
+        """Returns the held records, oldest first, as bytes."""
+        if (self.recorded <= self.capacity):
+            return bytes(self.buffer[:self.recorded*RECORD.size])
+        split = (self.recorded % self.capacity)*RECORD.size
+        return bytes(self.buffer[split:] + self.buffer[:split])
+
+    def save(self, path):
+        """Writes the held records to a trace file, oldest first."""
+        with open(path, "wb") as traceFile:
+            traceFile.write(HEADER.pack(MAGIC, VERSION, self.capacity,
+                                        self.recorded))
+            traceFile.write(self.records())
+
+
+def loadTrace(path):
+    """
+    Reads a trace file written by InstructionTrace.save.
+
+    Parameters:
+        path            trace file
+
+    Returns:
+        recorded        instructions recorded in the run
+        records         list of (clock, pc, ir, mask, gprs) oldest first
+    """
+    with open(path, "rb") as traceFile:
+        data = traceFile.read()
+    magic, version, capacity, recorded = HEADER.unpack_from(data)
+    if (magic != MAGIC) or (version != VERSION):
+        raise ValueError("%s is not an instruction trace" % path)
+    records = [(clock, pc, ir, mask, regs)
+               for clock, pc, ir, mask, *regs
+               in RECORD.iter_unpack(memoryview(data)[HEADER.size:])]
+    return recorded, records
+
+
+def formatRecord(record):
+    """Renders one trace record as a line of text."""
+    clock, pc, ir, mask, regs = record
+    op_code = ir >> 16
+    text = "%10d %4d %s %-7s %x %x %x %x" % (
+        clock, pc, format(ir, "#08x"), OPCODE_NAMES.get(op_code, "INVALID"),
+        extractBits(ir, 4, 13), extractBits(ir, 4, 9),
+        extractBits(ir, 4, 5), extractBits(ir, 4, 1))
+    changes = ["GPR%d=%d" % (reg, regs[reg])
+               for reg in range(len(regs)) if mask & (1 << reg)]
+    if (changes):
+        text += "  " + " ".join(changes)
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print a Jatgam Computer Simulator instruction trace")
+    parser.add_argument("tracefile", type=str, help="Trace file written with --trace")
+    args = parser.parse_args(argv)
+    recorded, records = loadTrace(args.tracefile)
+    print("Instructions recorded: {}, shown: {}".format(recorded, len(records)))
+    print("     Clock   PC IR       Op      M1 R1 M2 R2")
+    for record in records:
+        print(formatRecord(record))
+
+
+if __name__ == "__main__":
+    main()
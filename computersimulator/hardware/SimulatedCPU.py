@@ -2,15 +2,30 @@ import logging
 import sys
 from computersimulator.hardware.SimulatedRAM import SimulatedRAM
 from computersimulator.hardware.SimulatedDisk import SimulatedDisk
+from computersimulator.hardware.BufferCache import BufferCache
+from computersimulator.hardware.DiskController import DiskController
+from computersimulator.hardware.DispatchEngine import DispatchEngine
+from computersimulator.hardware.BlockCompiler import BlockCompiler
 from computersimulator.utils.bitutils import *
 import computersimulator.constants as constants
 
 CONST = constants.Constants
 logger = logging.getLogger(__name__)
+
+# Longest instruction is an opcode word plus two operand words (or one operand
+# word and a branch target), a write to X can only change instructions that
+# start at X, X-1 or X-2.
+MAX_INSTRUCTION_WORDS = 3
+# Instruction execution engines selectable at construction
+ENGINES = ("legacy", "dispatch", "block")
+DEFAULT_DISK = "computersimulator/hardware/disks/disk.dsk"
+
 class SimulatedCPU:
 
-    def __init__(self):
+    def __init__(self, engine="dispatch", diskPath=DEFAULT_DISK):
         logger.info("Initializing CPU")
+        if engine not in ENGINES:
+            raise ValueError("Invalid engine. Expected one of: %s" % (ENGINES,))
         ### CPU Hardware Variables ###
         self.gpr = [0]*8  # General Purpose Registers
         self.sp = None  # Stack Pointer
@@ -18,101 +33,156 @@ class SimulatedCPU:
         self.ir = None  # Instruction Register
         self.psr = None  # Processor Status Register
         self.clock = None  # Clock
+        self.trace = None  # InstructionTrace recording executed instructions
+        self.timesliceEnd = None  # Clock an idle loop may skip to, None to run it
+        self.decodeCache = {}  # Address -> decoded instruction
+        self.invalidationHooks = []  # Called when code may have been written
         ### Other Hardware Accessed by CPU ###
         self.sram = SimulatedRAM()
-        self.sdisk = SimulatedDisk("computersimulator/hardware/disks/disk.dsk")
-        if (self.sdisk.disk == -1):
+        # 1 for every word a cached instruction was decoded from
+        self.codeWords = bytearray(self.sram.ramSize)
+        self.sdisk = SimulatedDisk(diskPath)
+        if (not self.sdisk.isOpen()):
             print("Fatal Error! Disk not found!")
             sys.exit()
+        self.bufferCache = BufferCache(self.sdisk)  # Write-back sector cache
+        self.diskController = DiskController(self)  # Asynchronous disk I/O
+        ### Instruction Execution Engine ###
+        self.engine = engine
+        if (engine == "legacy"):
+            self._execute = self._executeLegacy
+        elif (engine == "block"):
+            self._execute = BlockCompiler(self).executeProgram
+        else:
+            self._execute = DispatchEngine(self).executeProgram
 
-    def executeProgram(self, systemCallCallback, timeslice=200):
+    def executeProgram(self, systemCallCallback, timeslice=CONST.DFLT_TIMESLICE):
+        """
+        Runs the current program on the selected engine until it halts,
+        waits, errors or uses up its timeslice.
+
+        Parameters:
+            systemCallCallback  called with the system call ID for SYSTEM
+            timeslice           clock ticks the program may run for
+
+        Returns:
+            status              OK, WAITING, TIMESLICE or an error code
+        """
+        return self._execute(systemCallCallback, timeslice)
+
+    def attachTrace(self, trace):
+        """
+        Records every instruction executed from now on into trace. Pass None
+        to stop tracing. Only the dispatch and block engines can be traced.
+
+        Parameters:
+            trace           InstructionTrace to record into, or None
+        """
+        if (trace is not None) and (self.engine == "legacy"):
+            raise ValueError("The legacy engine can't be traced")
+        self.trace = trace
+
+    def _executeLegacy(self, systemCallCallback, timeslice=CONST.DFLT_TIMESLICE):
         """
         Runs through the ram and grabs the next IR and decodes it. Then
         performs the correct operation.
         """
         status = 0
         clock_start = self.clock
+        decodeCache = self.decodeCache
+        debug = logger.isEnabledFor(logging.DEBUG)
         while (status >= 0):
             if (self.pc < 0) or (self.pc > 9999): # Check to see if PC valid
                 return CONST.ER_PC
             if (self.clock - clock_start >= timeslice):
                 return CONST.TIMESLICE
-            self.ir = self.sram.ram[self.pc]
+            decoded = decodeCache.get(self.pc)
+            if (decoded is None):
+                decoded = self.decodeInstruction(self.pc)
+                decodeCache[self.pc] = decoded
+                self.markDecoded(self.pc, decoded[-1])
+            (self.ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+             op1_word, op2_word, target_word, end) = decoded
             self.pc += 1
-            # Decode IR
-            op_code = self.ir >> 16
-            op1_mode = extractBits(self.ir, 4, 13)
-            op1_reg = extractBits(self.ir, 4, 9)
-            op2_mode = extractBits(self.ir, 4, 5)
-            op2_reg = extractBits(self.ir, 4, 1)
 
-            logger.debug("IR:%s op_code:%s op1_mode:%s op1_reg:%s op1_mode:%s op1_reg:%s",
-                            hex(self.ir), hex(op_code), hex(op1_mode), hex(op1_reg), hex(op2_mode), hex(op2_reg))
+            if (debug):
+                logger.debug("IR:%s op_code:%s op1_mode:%s op1_reg:%s op1_mode:%s op1_reg:%s",
+                                hex(self.ir), hex(op_code), hex(op1_mode), hex(op1_reg), hex(op2_mode), hex(op2_reg))
 
             if (op_code == CONST.OP_HALT):  # Halt Opcode
                 self.clock += 12
                 return CONST.OK
             elif (op_code == CONST.OP_ADD):  # Add Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg)
+                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg, op2_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                result = op1_value + op2_value  # ALU
+                result = wrapWord(op1_value + op2_value)  # ALU
                 if (op2_mode == CONST.MODE_REGISTER):
                     self.gpr[op2_reg] = result
                 else:
                     self.sram.ram[op2_addr] = result
+                    if (self.codeWords[op2_addr]):
+                        self.invalidateDecodeCache(op2_addr)
                 self.clock += 3
                 continue
             elif (op_code == CONST.OP_SUB):  # Subtract Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg)
+                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg, op2_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                result = op2_value - op1_value  # ALU
+                result = wrapWord(op2_value - op1_value)  # ALU
                 if (op2_mode == CONST.MODE_REGISTER):
                     self.gpr[op2_reg] = result
                 else:
                     self.sram.ram[op2_addr] = result
+                    if (self.codeWords[op2_addr]):
+                        self.invalidateDecodeCache(op2_addr)
                 self.clock += 3
                 continue
             elif (op_code == CONST.OP_MULT):  # Multiply Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg)
+                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg, op2_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                result = op1_value * op2_value  # ALU
+                result = wrapWord(op1_value * op2_value)  # ALU
                 if (op2_mode == CONST.MODE_REGISTER):
                     self.gpr[op2_reg] = result
                 else:
                     self.sram.ram[op2_addr] = result
+                    if (self.codeWords[op2_addr]):
+                        self.invalidateDecodeCache(op2_addr)
                 self.clock += 6
                 continue
             elif (op_code == CONST.OP_DIV):  # Divide Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg)
+                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg, op2_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                result = op2_value / op1_value  # ALU
+                if (op1_value == 0):
+                    return CONST.ER_DIVBYZ
+                result = wrapWord(truncatedDivide(op2_value, op1_value))  # ALU
                 if (op2_mode == CONST.MODE_REGISTER):
                     self.gpr[op2_reg] = result
                 else:
                     self.sram.ram[op2_addr] = result
+                    if (self.codeWords[op2_addr]):
+                        self.invalidateDecodeCache(op2_addr)
                 self.clock += 6
                 continue
             elif (op_code == CONST.OP_MOVE):  # Move Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
-                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg)
+                status, op2_addr, op2_value = self._fetchOperand(op2_mode, op2_reg, op2_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
                 result = op1_value
@@ -120,27 +190,29 @@ class SimulatedCPU:
                     self.gpr[op2_reg] = result
                 else:
                     self.sram.ram[op2_addr] = result
+                    if (self.codeWords[op2_addr]):
+                        self.invalidateDecodeCache(op2_addr)
                 self.clock += 2
                 continue
             elif (op_code == CONST.OP_BRANCH):  # Branch Opcode
-                if (self.pc >= 0) and (self.pc <=9999):
-                    self.pc = self.sram.ram[self.pc]
+                if (target_word is not None):
+                    self.pc = target_word
                     self.clock += 2
                 else:
                     return CONST.ER_INVALIDADDR
                 continue
             elif (op_code == CONST.OP_BRANCHM):  # Branch on Minus Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
                 if (op1_value < 0):
-                    self.pc = self.sram.ram[self.pc]
+                    self.pc = target_word
                 else:
                     self.pc += 1
                 self.clock += 4
                 continue
             elif (op_code == CONST.OP_SYSTEM):  # System Call Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
                 status = systemCallCallback(op1_value)
@@ -151,21 +223,21 @@ class SimulatedCPU:
                     return 0
                 continue
             elif (op_code == CONST.OP_BRANCHP):  # Branch on Plus Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
                 if (op1_value > 0):
-                    self.pc = self.sram.ram[self.pc]
+                    self.pc = target_word
                 else:
                     self.pc += 1
                 self.clock += 4
                 continue
             elif (op_code == CONST.OP_BRANCHZ):  # Branch on Zero Opcode
-                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg)
+                status, op1_addr, op1_value = self._fetchOperand(op1_mode, op1_reg, op1_word)
                 if (status != 0):
                     return CONST.ER_INVALIDMODE
                 if (op1_value == 0):
-                    self.pc = self.sram.ram[self.pc]
+                    self.pc = target_word
                 else:
                     self.pc += 1
                 self.clock += 4
@@ -180,16 +252,108 @@ class SimulatedCPU:
         return CONST.OK
 
 
-    def _fetchOperand(self, mode, reg):
+    def decodeInstruction(self, addr):
         """
-        Takes input of a mode and register and returns the values of the
-        operands and a status.
+        Decodes the instruction stored at addr along with the operand words
+        and branch target that follow it. Words that fall outside of RAM are
+        decoded as None so the executing instruction reports the same error it
+        would without a cache.
+
+        Parameters:
+            addr            address of the instruction word
+
+        Returns:
+            tuple           ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+                            op1_word, op2_word, target_word, end
+        """
+        ir = self.sram.ram[addr]
+        op_code = ir >> 16
+        op1_mode = extractBits(ir, 4, 13)
+        op1_reg = extractBits(ir, 4, 9)
+        op2_mode = extractBits(ir, 4, 5)
+        op2_reg = extractBits(ir, 4, 1)
+        op1_word = None
+        op2_word = None
+        target_word = None
+        end = addr + 1
+        if (op_code in constants.OPERAND1_OPCODES):
+            op1_word, end = self._decodeOperandWord(op1_mode, end)
+        if (op_code in constants.OPERAND2_OPCODES):
+            op2_word, end = self._decodeOperandWord(op2_mode, end)
+        if (op_code in constants.BRANCH_OPCODES):
+            if (end >= 0) and (end <= 9999):
+                target_word = self.sram.ram[end]
+            end += 1
+        return (ir, op_code, op1_mode, op1_reg, op2_mode, op2_reg,
+                op1_word, op2_word, target_word, end)
+
+    def _decodeOperandWord(self, mode, addr):
+        """
+        Reads the operand word at addr if the mode takes one.
+
+        Returns: word, next address
+        """
+        if (mode == CONST.MODE_DIRECT) or (mode == CONST.MODE_IMMEDIATE):
+            if (addr >= 0) and (addr <= 9999):
+                return self.sram.ram[addr], addr + 1
+            return None, addr + 1
+        return None, addr
+
+    def markDecoded(self, start, end):
+        """
+        Flags the words in [start, end) as read by a cached instruction so
+        stores to them invalidate the cache.
+        """
+        end = min(end, len(self.codeWords))
+        if (start < end):
+            self.codeWords[start:end] = b"\x01"*(end - start)
+
+    def invalidateDecodeCache(self, start=None, end=None):
+        """
+        Drops decoded instructions that read any word in [start, end). Must be
+        called whenever RAM holding code may have been written, stores from
+        the CPU only need to call it when codeWords is set for the address.
+        With no arguments the whole cache is cleared. Engines keeping their own code
+        caches register a function in invalidationHooks that is called with
+        the same arguments.
+
+        Parameters:
+            start           first address written
+            end             one past the last address written, defaults to
+                            start + 1
+        """
+        for hook in self.invalidationHooks:
+            hook(start, end)
+        if (start is None):
+            self.decodeCache.clear()
+            self.codeWords[:] = bytes(len(self.codeWords))
+            return
+        if (end is None):
+            end = start + 1
+        # Every entry reading these words is dropped below
+        flagStart = max(start, 0)
+        flagEnd = min(end, len(self.codeWords))
+        if (flagStart < flagEnd):
+            self.codeWords[flagStart:flagEnd] = bytes(flagEnd - flagStart)
+        first = start - (MAX_INSTRUCTION_WORDS - 1)
+        if (end - first > len(self.decodeCache)):
+            stale = [addr for addr in self.decodeCache if first <= addr < end]
+            for addr in stale:
+                del self.decodeCache[addr]
+        else:
+            for addr in range(first, end):
+                self.decodeCache.pop(addr, None)
+
+    def _fetchOperand(self, mode, reg, word):
+        """
+        Takes input of a mode, register and the decoded operand word and
+        returns the values of the operands and a status.
 
         Returns: status, opAddr, opValue
         """
         if (mode == CONST.MODE_DIRECT):  # Direct Mode
-            if (self.pc >= 0) and (self.pc <= 9999):
-                opAddr = self.sram.ram[self.pc]  # get opAddr using PC
+            if (word is not None):
+                opAddr = word  # opAddr decoded from word at PC
                 self.pc += 1
                 if (opAddr >= 0) and (opAddr <= 9999):
                     opValue = self.sram.ram[opAddr]  # get opValue
@@ -198,7 +362,6 @@ class SimulatedCPU:
             else:
                 return CONST.ER_INVALIDADDR, None, None
             return CONST.OK, opAddr, opValue
-
         elif (mode == CONST.MODE_REGISTER):  # Register Mode
             opAddr = -1  # Not in Memory
             opValue = self.gpr[reg]
@@ -233,8 +396,8 @@ class SimulatedCPU:
         elif (mode == CONST.MODE_IMMEDIATE):  # Immediate Mode
             opAddr = self.pc
             self.pc += 1
-            if (opAddr >= 0) and (opAddr <= 9999):
-                opValue = self.sram.ram[opAddr]
+            if (word is not None):
+                opValue = word
             else:
                 return CONST.ER_INVALIDADDR, None, None
             return CONST.OK, opAddr, opValue
@@ -1,39 +1,159 @@
+from array import array
+import logging
+import mmap
+import os
 import pickle
 
+logger = logging.getLogger(__name__)
+
 
 class SimulatedDisk:
+    """
+    Sector addressed disk kept in a fixed layout image file: sector N is
+    sectorSize native signed 64 bit words at byte offset
+    N*sectorSize*wordSize. The file is memory mapped, so opening a disk of
+    any size is O(1) and a sector write only touches that sector. Written
+    sectors are synced to the file by flush.
+
+    Images in the old pickled list-of-lists format are converted in place
+    the first time they are opened.
+    """
+
+    WORD_TYPECODE = "q"  # Signed 64 bit words, same as RAM
+    WORD_SIZE = 8
 
     def __init__(self, path, sectorSize=128, numSectors=1000):
         self.sectorSize = sectorSize # in "bytes"
         self.numSectors = numSectors # Size of disk
         self.diskpath = path
-        self.disk = self._loadDisk(path)
-        self.cache = False
+        self.imageSize = numSectors*sectorSize*self.WORD_SIZE
+        self.dirty = set()  # Sectors written since the last flush
+        self.image = None  # mmap of the image file
+        self.words = None  # Whole image as a memoryview of words
+        self._openImage(path)
 
-    def _loadDisk(self, path):
+    def _openImage(self, path):
         try:
             dskfile = open(path, 'r+b')
-        except:
-            return -1
+        except OSError:
+            return
+        with dskfile:
+            size = os.fstat(dskfile.fileno()).st_size
+            if (size == 0):  # New disk, every sector zero
+                dskfile.truncate(self.imageSize)
+            elif (size != self.imageSize):
+                self._migratePickle(dskfile)
+            self.image = mmap.mmap(dskfile.fileno(), self.imageSize)
+        self.words = memoryview(self.image).cast(self.WORD_TYPECODE)
+
+    def _migratePickle(self, dskfile):
+        """Rewrites a pickled disk image in the fixed sector layout."""
+        dskfile.seek(0)
         try:
             disk = pickle.load(dskfile)
-            dskfile.close()
-            return disk
-        except EOFError:
-            disk = self._initializeDisk(dskfile)
-            dskfile.close()
-            return disk
-
-    def _initializeDisk(self, dskfile):
-        #fs = [[0]*self.sectorSize]*self.numSectors
-        fs = []
-        sector = [0]*self.sectorSize
-        for i in range(0, self.numSectors):
-            fs.append(list(sector))
-        pickle.dump(fs, dskfile)
-        return fs
-
-    def writeCache(self):
-        dskfile = open(self.diskpath, 'r+b')
-        dskfile.truncate()
-        pickle.dump(self.disk, dskfile)
+        except (pickle.UnpicklingError, EOFError):
+            raise ValueError("%s is not a disk image of %d sectors"
+                             % (self.diskpath, self.numSectors))
+        if (len(disk) != self.numSectors):
+            raise ValueError("%s has %d sectors, expected %d"
+                             % (self.diskpath, len(disk), self.numSectors))
+        logger.info("Converting pickled disk image %s", self.diskpath)
+        dskfile.truncate(0)
+        dskfile.truncate(self.imageSize)
+        with mmap.mmap(dskfile.fileno(), self.imageSize) as image, \
+                memoryview(image) as view:
+            words = view.cast(self.WORD_TYPECODE)
+            for sector, data in enumerate(disk):
+                # Old images could hold sectors of the wrong length
+                data = array(self.WORD_TYPECODE, data[:self.sectorSize])
+                start = sector*self.sectorSize
+                words[start:start + len(data)] = data
+            words.release()
+            image.flush()
+
+    def isOpen(self):
+        """True if the image file was found and mapped."""
+        return self.image is not None
+
+    def checkSector(self, sector, start, count):
+        """Raises ValueError unless count words from start fit in sector."""
+        if (sector < 0) or (sector >= self.numSectors):
+            raise ValueError("Invalid sector: %d" % sector)
+        if (start < 0) or (start + count > self.sectorSize):
+            raise ValueError("Invalid range in sector %d: %d-%d"
+                             % (sector, start, start + count))
+
+    def readSector(self, sector, start=0, end=None):
+        """
+        Reads words from one sector.
+
+        Parameters:
+            sector          sector number
+            start           first word in the sector
+            end             word after the last, defaults to the sector end
+
+        Returns:
+            list            the words
+        """
+        if (end is None):
+            end = self.sectorSize
+        self.checkSector(sector, start, end - start)
+        base = sector*self.sectorSize
+        return self.words[base + start:base + end].tolist()
+
+    def writeSector(self, sector, words, start=0):
+        """
+        Writes words into one sector starting at word start.
+
+        Parameters:
+            sector          sector number
+            words           sequence of ints, at most the rest of the sector
+            start           first word in the sector
+        """
+        self.checkSector(sector, start, len(words))
+        base = sector*self.sectorSize + start
+        self.words[base:base + len(words)] = array(self.WORD_TYPECODE, words)
+        self.dirty.add(sector)
+
+    def readSectors(self, sector, count):
+        """
+        Reads count whole sectors starting at sector in one slice.
+
+        Returns:
+            list            count*sectorSize words
+        """
+        self.checkSector(sector, 0, 0)
+        self.checkSector(sector + count - 1, 0, 0)
+        base = sector*self.sectorSize
+        return self.words[base:base + count*self.sectorSize].tolist()
+
+    def flush(self):
+        """Syncs the pages holding written sectors to the image file."""
+        if (not self.dirty):
+            return
+        sectorBytes = self.sectorSize*self.WORD_SIZE
+        pages = set()
+        for sector in self.dirty:
+            first = sector*sectorBytes // mmap.PAGESIZE
+            last = ((sector + 1)*sectorBytes - 1) // mmap.PAGESIZE
+            pages.update(range(first, last + 1))
+        pages = sorted(pages)
+        runStart = previous = pages[0]
+        for page in pages[1:] + [None]:
+            if (page != previous + 1):
+                offset = runStart*mmap.PAGESIZE
+                self.image.flush(offset, min((previous + 1)*mmap.PAGESIZE,
+                                             self.imageSize) - offset)
+                runStart = page
+            previous = page
+        self.dirty.clear()
+
+    def close(self):
+        """Flushes and unmaps the image."""
+        if (self.image is None):
+            return
+        self.flush()
+        self.words.release()
+        self.image.close()
+        self.words = None
+        self.image = None
@@ -1,6 +1,52 @@
+from array import array
+
+
 class SimulatedRAM:
+    """
+    Word addressed memory backed by a typed array of signed 64 bit integers.
+    Storing a value that isn't an int, or doesn't fit in a word, raises.
+    """
+
+    WORD_TYPECODE = "q"  # Signed 64 bit words
 
     def __init__(self, ramSize=10000):
         self.ramSize = ramSize
         ### Hardware Variables ###
-        self.ram = [0]*self.ramSize  # Machine Memory
+        self.ram = array(self.WORD_TYPECODE, [0])*self.ramSize  # Machine Memory
+        self.wordSize = self.ram.itemsize  # Bytes per word
+
+    def view(self, start=0, end=None):
+        """
+        Returns a memoryview of the words in [start, end) without copying.
+        Writes through the view change RAM.
+        """
+        if (end is None):
+            end = self.ramSize
+        return memoryview(self.ram)[start:end]
+
+    def clear(self):
+        """Sets every word to zero in one buffer operation."""
+        memoryview(self.ram).cast("B")[:] = bytes(self.ramSize*self.wordSize)
+
+    def load(self, start, words):
+        """
+        Copies a sequence of words into RAM starting at start.
+
+        Parameters:
+            start           address of the first word
+            words           array of words, or any iterable of ints
+        """
+        if (not isinstance(words, array)) or \
+                (words.typecode != self.WORD_TYPECODE):
+            words = array(self.WORD_TYPECODE, words)
+        self.ram[start:start + len(words)] = words
+
+    def snapshot(self):
+        """Returns a copy of all of RAM as bytes."""
+        return self.ram.tobytes()
+
+    def restore(self, data):
+        """
+        Overwrites all of RAM from a snapshot or any buffer of the same size.
+        """
+        memoryview(self.ram).cast("B")[:] = memoryview(data).cast("B")
@@ -0,0 +1,150 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from ComputerSimulator import ComputerSimulator
+from computersimulator.hardware.SimulatedCPU import DEFAULT_DISK
+from computersimulator.system.InterruptScript import InterruptScript, STATUS_NAMES
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+
+def loadManifest(path):
+    """
+    Reads a JSON job manifest. It is either a list of jobs or an object with
+    a "jobs" list. Each job is an object with:
+        name        label for the results, defaults to its index
+        script      schedule file for InterruptScript, or instead
+        programs    list of program paths or {"path", "priority", "clock"}
+        input       characters for any process waiting in io_getc, or an
+                    object of PID -> characters
+        shutdown    ["switch"|"clock", N] to stop runaway jobs
+        engine      CPU engine, defaults to dispatch
+        msgqDepth   message queue size of each process, at least 1, defaults
+                    to 10
+        scheduler   scheduling policy, defaults to priority
+    """
+    with open(path) as manifestFile:
+        manifest = json.load(manifestFile)
+    if (isinstance(manifest, dict)):
+        manifest = manifest["jobs"]
+    jobs = []
+    for index, job in enumerate(manifest):
+        job = dict(job)
+        job.setdefault("name", str(index))
+        jobs.append(job)
+    return jobs
+
+
+def jobScript(job):
+    """Builds the InterruptScript that drives a job."""
+    if ("script" in job):
+        return InterruptScript.load(job["script"])
+    runs = []
+    for program in job.get("programs", ()):
+        if (isinstance(program, str)):
+            program = {"path": program}
+        trigger = ("clock", program["clock"]) if "clock" in program else ("switch", 0)
+        runs.append(trigger + (program["path"],
+                               program.get("priority", CONST.DFLT_USR_PRTY)))
+    inputs = job.get("input")
+    if (isinstance(inputs, str)):
+        inputs = {"*": inputs}
+    elif (inputs is not None):
+        inputs = {pid if pid == "*" else int(pid): chars
+                  for pid, chars in inputs.items()}
+    shutdown = job.get("shutdown")
+    if (shutdown is not None):
+        shutdown = (shutdown[0], int(shutdown[1]))
+    return InterruptScript(runs, inputs, shutdown)
+
+
+def runJob(job, diskPath=DEFAULT_DISK):
+    """
+    Runs one job on a fresh ComputerSimulator with its own copy of the disk
+    image. OS output is discarded.
+
+    Returns:
+        dict        name, status, clock, memoryDigest, memoryStats,
+                    schedulerStats and per process pid, program, status and
+                    output. error holds the exception if the job failed
+    """
+    result = {"name": job["name"]}
+    try:
+        script = jobScript(job)
+        with tempfile.TemporaryDirectory() as workDir:
+            disk = os.path.join(workDir, os.path.basename(diskPath))
+            shutil.copyfile(diskPath, disk)
+            comp = ComputerSimulator(job.get("engine", "dispatch"), script,
+                                     False, disk,
+                                     job.get("msgqDepth", CONST.MSG_QUEUE_DEPTH),
+                                     job.get("scheduler", "priority"))
+            with open(os.devnull, "w") as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                comp.initializeSystem()
+                status = comp.OSLoop()
+    except (Exception, SystemExit) as error:
+        result["error"] = "%s: %s" % (error.__class__.__name__, error)
+        return result
+    result["status"] = STATUS_NAMES.get(status, status)
+    result["clock"] = comp.scpu.clock
+    result["memoryDigest"] = hashlib.sha256(comp.scpu.sram.snapshot()).hexdigest()
+    result["memoryStats"] = comp.memoryStats()
+    result["schedulerStats"] = comp.schedulerStats()
+    result["processes"] = [
+        {"pid": pid, "program": program,
+         "status": STATUS_NAMES.get(status, status), "output": output}
+        for pid, program, status, output in script.report(comp)]
+    result["loadErrors"] = [
+        {"program": program, "status": STATUS_NAMES.get(status, status)}
+        for program, status in script.loadErrors]
+    return result
+
+
+def runBatch(jobs, workers=None, diskPath=DEFAULT_DISK):
+    """
+    Runs jobs across a process pool, one simulator per job.
+
+    Parameters:
+        jobs            job dicts as returned by loadManifest
+        workers         pool size, defaults to the number of CPUs
+        diskPath        disk image every job starts from
+
+    Returns:
+        list            runJob results in manifest order
+    """
+    if (workers == 1):
+        return [runJob(job, diskPath) for job in jobs]
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(runJob, jobs, [diskPath]*len(jobs)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a manifest of Jatgam Computer Simulator jobs")
+    parser.add_argument("manifest", type=str, help="JSON job manifest")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes, defaults to the number of CPUs")
+    parser.add_argument("--disk", type=str, default=DEFAULT_DISK,
+                        help="Disk image copied for every job")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+    results = runBatch(loadManifest(args.manifest), args.workers, args.disk)
+    if (args.output):
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
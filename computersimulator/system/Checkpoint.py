@@ -0,0 +1,89 @@
+import mmap
+import struct
+
+# magic, format version, words of RAM, bytes per word
+HEADER = struct.Struct("<4sIII")
+MAGIC = b"JCSK"
+VERSION = 3  # 2 added the shared memory holders after RAM, 3 the disk queue
+CPU_REGISTERS = ("sp", "pc", "ir", "psr", "clock")
+OS_GLOBALS = ("osFreeList", "userFreeList", "pid", "RQptr", "WQptr",
+              "RunningPCBptr", "nullPid")
+# GPR0-7, CPU_REGISTERS, OS_GLOBALS
+STATE = struct.Struct("<8q%dq%dq" % (len(CPU_REGISTERS), len(OS_GLOBALS)))
+# Stands in for registers that are still None before initializeSystem
+UNSET = -(1 << 63)
+# RAM is stored raw after the header and state, word aligned
+RAM_OFFSET = HEADER.size + STATE.size
+WORD = struct.Struct("<q")
+
+
+def saveCheckpoint(comp, path):
+    """
+    Writes the CPU registers, all of RAM and the OS globals of a
+    ComputerSimulator to a binary checkpoint file, followed by the holders of
+    shared memory blocks as SharedMemory.words and the queued disk transfers
+    as DiskController.words. Take checkpoints between context switches, the
+    decode caches and disk are not saved.
+
+    Parameters:
+        comp            ComputerSimulator to save
+        path            checkpoint file
+    """
+    cpu = comp.scpu
+    registers = [getattr(cpu, name) for name in CPU_REGISTERS]
+    registers = [UNSET if value is None else value for value in registers]
+    osGlobals = [getattr(comp, name) for name in OS_GLOBALS]
+    with open(path, "wb") as checkpointFile:
+        checkpointFile.write(HEADER.pack(MAGIC, VERSION, cpu.sram.ramSize,
+                                         cpu.sram.wordSize))
+        checkpointFile.write(STATE.pack(*cpu.gpr, *registers, *osGlobals))
+        checkpointFile.write(cpu.sram.view())
+        tail = comp.sharedMemory.words() + cpu.diskController.words()
+        checkpointFile.write(struct.pack("<%dq" % len(tail), *tail))
+
+
+def loadCheckpoint(comp, path):
+    """
+    Restores a checkpoint written by saveCheckpoint. The file is memory
+    mapped and RAM is copied out of the mapping in one operation. Version 1
+    checkpoints have no shared memory holders, so every block is treated as
+    held only by the process that frees it, and versions 1 and 2 have no
+    disk queue, so they must have been taken with the disk idle.
+
+    Parameters:
+        comp            ComputerSimulator to restore into
+        path            checkpoint file
+
+    Raises:
+        ValueError      the file isn't a checkpoint for this RAM size
+    """
+    cpu = comp.scpu
+    with open(path, "rb") as checkpointFile, \
+            mmap.mmap(checkpointFile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        magic, version, ramSize, wordSize = HEADER.unpack_from(data)
+        if (magic != MAGIC) or (version not in (1, 2, VERSION)):
+            raise ValueError("%s is not a checkpoint" % path)
+        ramEnd = RAM_OFFSET + ramSize*wordSize
+        if (ramSize != cpu.sram.ramSize) or (wordSize != cpu.sram.wordSize) or \
+                (len(data) < ramEnd) or ((version == 1) and (len(data) != ramEnd)):
+            raise ValueError("%s does not match this machine's RAM" % path)
+        state = STATE.unpack_from(data, HEADER.size)
+        tail = [0]
+        if (version > 1):
+            if (len(data) == ramEnd) or ((len(data) - ramEnd) % WORD.size != 0):
+                raise ValueError("%s is truncated" % path)
+            tail = [word for word, in WORD.iter_unpack(data[ramEnd:])]
+        with memoryview(data) as view:
+            cpu.sram.restore(view[RAM_OFFSET:ramEnd])
+    gprs = len(cpu.gpr)
+    cpu.gpr[:] = state[:gprs]
+    for name, value in zip(CPU_REGISTERS, state[gprs:]):
+        setattr(cpu, name, None if value == UNSET else value)
+    for name, value in zip(OS_GLOBALS, state[gprs + len(CPU_REGISTERS):]):
+        setattr(comp, name, value)
+    comp.rebuildPCBIndex()
+    used = comp.sharedMemory.restore(tail)
+    cpu.diskController.restore(tail[used:] if version > 2 else [0, 0, 0])
+    for allocator in comp.memoryAllocators.values():
+        allocator.resync()
+    cpu.invalidateDecodeCache()
@@ -0,0 +1,230 @@
+from collections import deque
+from computersimulator.system.Checkpoint import saveCheckpoint
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+# Exit status -> name used in reports
+STATUS_NAMES = {getattr(CONST, name): name for name in dir(CONST)
+                if name.startswith("ER_") or name in ("OK", "HALT")}
+# Wait reason -> name used in reports
+WAIT_NAMES = {CONST.WAITINGMSG: "waiting for message",
+              CONST.WAITINGGET: "waiting for input",
+              CONST.WAITINGPUT: "waiting for output",
+              CONST.WAITINGDISK: "waiting for disk",
+              CONST.WAITINGMSGS: "waiting for message"}
+TRIGGERS = ("switch", "clock")
+ANY_PID = "*"
+
+
+class InterruptScript:
+    """
+    Replaces the interactive interrupt prompt with a schedule read from a
+    file so the OS runs without an operator. At every context switch it
+    runs the programs that are due, gives queued characters to processes
+    waiting in io_getc and completes every io_putc. Once no user process
+    can run, no disk transfer is outstanding and no program is left to
+    start it asks the OS to shut down.
+
+    Schedule files have one directive per line, # starts a comment:
+        run switch|clock N program [priority]
+        input pid|* characters
+        shutdown switch|clock N
+        checkpoint switch|clock N file
+
+    run loads program once N context switches have happened or the clock
+    reached N. input queues characters for one PID, or for any process
+    with *. Characters run to the end of the line and spaces are kept.
+    shutdown stops the machine at that point even if work is left.
+    checkpoint saves the machine to file once the programs due at the same
+    point are loaded, ready to resume with --restore.
+    """
+
+    def __init__(self, runs=(), inputs=None, shutdown=None, checkpoints=()):
+        self.runs = sorted(runs, key=lambda run: (run[0] == "clock", run[1]))
+        self.inputs = {pid: deque(chars) for pid, chars in (inputs or {}).items()}
+        self.shutdown = shutdown  # (trigger, N) or None
+        self.checkpoints = sorted(checkpoints,
+                                  key=lambda point: (point[0] == "clock", point[1]))
+        self.switches = 0  # Context switches seen
+        self.programs = {}  # PID -> program the script loaded
+        self.loadErrors = []  # (program, status) of runs that failed
+        self.output = {}  # PID -> characters written
+        self.unfinished = {}  # PID -> wait reason, 0 if ready, at shutdown
+
+    @classmethod
+    def load(cls, path):
+        """Reads a schedule file."""
+        with open(path) as scriptFile:
+            return cls.parse(scriptFile)
+
+    @classmethod
+    def parse(cls, lines):
+        """
+        Builds a script from schedule lines.
+
+        Raises:
+            ValueError      a line isn't a valid directive
+        """
+        runs = []
+        inputs = {}
+        shutdown = None
+        checkpoints = []
+        for number, line in enumerate(lines, 1):
+            line = line.rstrip("\n")
+            if (line.lstrip().startswith("#")) or (not line.strip()):
+                continue
+            words = line.split()
+            directive = words[0].lower()
+            try:
+                if (directive == "run") and (len(words) in (4, 5)):
+                    priority = int(words[4]) if len(words) == 5 else CONST.DFLT_USR_PRTY
+                    if (priority < 0) or (priority >= CONST.PRIORITY_LEVELS):
+                        raise ValueError(priority)
+                    runs.append((cls._trigger(words[1]), int(words[2]),
+                                 words[3], priority))
+                elif (directive == "input") and (len(words) >= 3):
+                    pid = words[1] if words[1] == ANY_PID else int(words[1])
+                    chars = line.split(None, 2)[2]
+                    inputs[pid] = inputs.get(pid, "") + chars
+                elif (directive == "shutdown") and (len(words) == 3):
+                    shutdown = (cls._trigger(words[1]), int(words[2]))
+                elif (directive == "checkpoint") and (len(words) == 4):
+                    checkpoints.append((cls._trigger(words[1]), int(words[2]),
+                                        words[3]))
+                else:
+                    raise ValueError(directive)
+            except ValueError:
+                raise ValueError("Invalid script line %d: %s" % (number, line))
+        return cls(runs, inputs, shutdown, checkpoints)
+
+    @staticmethod
+    def _trigger(word):
+        word = word.lower()
+        if (word not in TRIGGERS):
+            raise ValueError(word)
+        return word
+
+    def _due(self, trigger, n, comp):
+        if (trigger == "switch"):
+            return self.switches >= n
+        return comp.scpu.clock >= n
+
+    def _popDue(self, pending, comp):
+        """
+        Removes every entry of pending whose trigger is due, whatever the
+        entries ahead of it, and returns them in order.
+        """
+        due = []
+        waiting = []
+        for entry in pending:
+            (due if self._due(entry[0], entry[1], comp) else waiting).append(entry)
+        pending[:] = waiting
+        return due
+
+    def processInterrupts(self, comp):
+        """
+        Handles the interrupts due at this context switch.
+
+        Parameters:
+            comp        ComputerSimulator being driven
+
+        Returns:
+            OK              keep running
+            SHUTDOWN_INT    the OS should shut down
+        """
+        for trigger, n, program, priority in self._popDue(self.runs, comp):
+            pid = comp.pid
+            status = comp.createProcess(program, priority)
+            if (status < 0):
+                self.loadErrors.append((program, status))
+            else:
+                self.programs[pid] = program
+        for trigger, n, path in self._popDue(self.checkpoints, comp):
+            saveCheckpoint(comp, path)
+        self.completeIO(comp)
+        self.switches += 1
+        if ((self.shutdown is not None) and (self._due(*self.shutdown, comp))) or \
+                ((not self.runs) and (not self._userReady(comp)) and
+                 (not comp.scpu.diskController.busy())):
+            self._recordUnfinished(comp)
+            return CONST.SHUTDOWN_INT
+        return CONST.OK
+
+    def completeIO(self, comp):
+        """
+        Completes io_putc for every waiting process and io_getc for those
+        that have input queued.
+        """
+        ram = comp.scpu.sram.ram
+        waitQueue = comp.waitQueue
+        pcbptr = waitQueue.nextWaiter(CONST.WAITINGPUT)
+        while (pcbptr != CONST.EOL):
+            waitQueue.remove(pcbptr)
+            self.output.setdefault(ram[pcbptr+3], []).append(comp.completeOutput(pcbptr))
+            pcbptr = waitQueue.nextWaiter(CONST.WAITINGPUT)
+        for pcbptr in waitQueue.waiters(CONST.WAITINGGET):
+            chars = self.inputs.get(ram[pcbptr+3])
+            if (not chars):
+                chars = self.inputs.get(ANY_PID)
+            if (chars):
+                waitQueue.remove(pcbptr)
+                comp.completeInput(pcbptr, chars.popleft())
+
+    def _pids(self, comp, ptr):
+        ram = comp.scpu.sram.ram
+        while (ptr != CONST.EOL):
+            yield ram[ptr+3]
+            ptr = ram[ptr]
+
+    def _userReady(self, comp):
+        for pid in self._pids(comp, comp.RQptr):
+            if (pid != comp.nullPid):
+                return True
+        return False
+
+    def _recordUnfinished(self, comp):
+        ram = comp.scpu.sram.ram
+        for queue in (comp.RQptr, comp.WQptr):
+            ptr = queue
+            while (ptr != CONST.EOL):
+                if (ram[ptr+3] != comp.nullPid):
+                    self.unfinished[ram[ptr+3]] = ram[ptr+4]
+                ptr = ram[ptr]
+
+    def report(self, comp):
+        """
+        Summarizes every user process after the run.
+
+        Returns:
+            list        (pid, program, status, output) per process. status
+                        is the exit status, or for processes the shutdown
+                        stopped what they waited for ("ready" if nothing)
+        """
+        pids = (set(self.programs) | set(self.output) | set(comp.exitStatuses)) \
+            - {comp.nullPid}
+        lines = []
+        for pid in sorted(pids):
+            if (pid in self.unfinished):
+                status = WAIT_NAMES.get(self.unfinished[pid], "ready")
+            else:
+                status = comp.exitStatuses.get(pid)
+            lines.append((pid, self.programs.get(pid), status,
+                          "".join(self.output.get(pid, []))))
+        return lines
+
+
+def formatReport(report, loadErrors=()):
+    """Renders InterruptScript.report as lines of text."""
+    lines = []
+    for pid, program, status, output in report:
+        if (isinstance(status, str)):
+            state = "stopped " + status
+        else:
+            state = STATUS_NAMES.get(status, status)
+        lines.append("PID {} {}: {} output {!r}".format(
+            pid, program or "(not loaded by script)", state, output))
+    for program, status in loadErrors:
+        lines.append("{}: not loaded, {}".format(
+            program, STATUS_NAMES.get(status, status)))
+    return lines
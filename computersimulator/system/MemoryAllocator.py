@@ -0,0 +1,250 @@
+from collections import Counter
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+MIN_BLOCK = 4  # Header, next, previous, footer
+TAGS = 2  # Header and footer words of an allocated block
+
+
+def sizeClass(blockSize):
+    """Bin of a block: blocks of 2**k to 2**(k+1)-1 words share bin k."""
+    return blockSize.bit_length() - 1
+
+
+class MemoryAllocator:
+    """
+    Segregated fit allocator for one memory list, kept entirely in simulated
+    RAM so checkpoints and memory dumps see all of it.
+
+    The region starts with a table: a bitmap of the bins that hold a free
+    block, then the head of each bin. The rest of the region is tiled by
+    blocks with a boundary tag at both ends, the block size for a free block
+    and minus the block size for an allocated one. A free block also holds
+    the next and previous free block of its bin after its header, so
+    unlinking it is O(1), and the tags of the blocks on either side say
+    whether they are free, so freeing coalesces in O(1). Every decision
+    depends only on RAM, so runs and restored checkpoints are reproducible.
+    """
+
+    def __init__(self, sram, start, size):
+        """
+        Parameters:
+            sram            SimulatedRAM holding the region
+            start           first address of the region
+            size            words in the region
+        """
+        self.sram = sram
+        self.start = start
+        self.end = start + size
+        self.bins = sizeClass(size) + 1
+        self.firstBlock = start + 1 + self.bins
+        if (self.end - self.firstBlock < MIN_BLOCK):
+            raise ValueError("Memory list of %d words is too small" % size)
+        self.resetStats()
+
+    def resetStats(self):
+        """Clears the counters kept since the region was formatted."""
+        self.allocations = 0
+        self.frees = 0
+        self.failures = 0  # Allocations that returned ER_MEM
+        self.badFrees = 0  # Frees that returned ER_NMB
+        self.usedWords = 0  # Words in allocated blocks, tags included
+        self.highWater = 0  # Most usedWords reached
+        self.walks = Counter()  # Free blocks examined per allocation -> calls
+
+    def resync(self):
+        """
+        Resets the counters after RAM was replaced, as by a checkpoint
+        restore, counting the words already allocated as the high water mark.
+        """
+        self.resetStats()
+        self.usedWords = self.end - self.firstBlock - self.stats()["freeWords"]
+        self.highWater = self.usedWords
+
+    def format(self):
+        """Makes the whole region one free block."""
+        ram = self.sram.ram
+        self.resetStats()
+        ram[self.start] = 0
+        for index in range(self.bins):
+            ram[self.start + 1 + index] = CONST.EOL
+        self._setTags(self.firstBlock, self.end - self.firstBlock)
+        self._link(self.firstBlock)
+
+    def _setTags(self, block, blockSize):
+        """Tags a block, free for a positive size, allocated for negative."""
+        self.sram.ram[block] = blockSize
+        self.sram.ram[block + abs(blockSize) - 1] = blockSize
+
+    def _link(self, block):
+        """Pushes a tagged free block on its bin."""
+        ram = self.sram.ram
+        index = sizeClass(ram[block])
+        head = self.start + 1 + index
+        ram[block + 1] = ram[head]
+        ram[block + 2] = CONST.EOL
+        if (ram[head] != CONST.EOL):
+            ram[ram[head] + 2] = block
+        ram[head] = block
+        ram[self.start] |= 1 << index
+
+    def _unlink(self, block):
+        ram = self.sram.ram
+        index = sizeClass(ram[block])
+        following, previous = ram[block + 1], ram[block + 2]
+        if (previous == CONST.EOL):
+            ram[self.start + 1 + index] = following
+            if (following == CONST.EOL):
+                ram[self.start] &= ~(1 << index)
+        else:
+            ram[previous + 1] = following
+        if (following != CONST.EOL):
+            ram[following + 2] = previous
+
+    def _find(self, blockSize):
+        """
+        Returns (block, walk): a free block of at least blockSize words or
+        EOL, and the number of free blocks examined.
+        """
+        ram = self.sram.ram
+        index = sizeClass(blockSize)
+        if (index >= self.bins):
+            return CONST.EOL, 0
+        # First fit in the bin of the request, sizes there may be smaller
+        walk = 0
+        block = ram[self.start + 1 + index]
+        while (block != CONST.EOL):
+            walk += 1
+            if (ram[block] >= blockSize):
+                return block, walk
+            block = ram[block + 1]
+        # Any block of a larger bin fits, take the smallest bin's head
+        larger = ram[self.start] >> (index + 1) << (index + 1)
+        if (larger == 0):
+            return CONST.EOL, walk
+        return ram[self.start + 1 + sizeClass(larger & -larger)], walk + 1
+
+    def allocate(self, size):
+        """
+        Allocates size words.
+
+        Parameters:
+            size            words needed
+
+        Returns:
+            ptr             address of the first usable word
+            ER_MEM          no free block is large enough
+        """
+        if (size <= 0):
+            self.failures += 1
+            return CONST.ER_MEM
+        blockSize = max(size + TAGS, MIN_BLOCK)
+        block, walk = self._find(blockSize)
+        self.walks[walk] += 1
+        if (block == CONST.EOL):
+            self.failures += 1
+            return CONST.ER_MEM
+        self._unlink(block)
+        remainder = self.sram.ram[block] - blockSize
+        if (remainder >= MIN_BLOCK):
+            self._setTags(block + blockSize, remainder)
+            self._link(block + blockSize)
+        else:
+            blockSize += remainder
+        self._setTags(block, -blockSize)
+        self.allocations += 1
+        self.usedWords += blockSize
+        self.highWater = max(self.highWater, self.usedWords)
+        return block + 1
+
+    def free(self, ptr, size):
+        """
+        Frees a block returned by allocate and merges it with free blocks
+        next to it.
+
+        Parameters:
+            ptr             address allocate returned
+            size            size that was allocated
+
+        Returns:
+            OK              freed
+            ER_NMB          ptr and size are not an allocated block
+        """
+        ram = self.sram.ram
+        block = ptr - 1
+        if (size <= 0) or (block < self.firstBlock) or (block >= self.end):
+            self.badFrees += 1
+            return CONST.ER_NMB
+        blockSize = -ram[block]
+        minimum = max(size + TAGS, MIN_BLOCK)
+        if (blockSize < minimum) or (blockSize - minimum >= MIN_BLOCK) or \
+                (block + blockSize > self.end) or \
+                (ram[block + blockSize - 1] != -blockSize):
+            self.badFrees += 1
+            return CONST.ER_NMB
+        self.frees += 1
+        self.usedWords -= blockSize
+        # Tags left inside a merged block are cleared so they can't pass
+        # for an allocated block later
+        if (block > self.firstBlock) and (ram[block - 1] > 0):
+            previous = block - ram[block - 1]
+            self._unlink(previous)
+            blockSize += ram[previous]
+            ram[block - 1] = ram[block] = 0
+            block = previous
+        following = block + blockSize
+        if (following < self.end) and (ram[following] > 0):
+            self._unlink(following)
+            blockSize += ram[following]
+            ram[following - 1] = ram[following] = 0
+        self._setTags(block, blockSize)
+        self._link(block)
+        return CONST.OK
+
+    def extent(self, ptr):
+        """
+        Returns (first, end), the words [first, end) of the allocated block
+        that free(ptr, size) would release, or None if the word before ptr
+        isn't an allocated block's tag.
+        """
+        block = ptr - 1
+        if (block < self.firstBlock) or (block >= self.end) or \
+                (self.sram.ram[block] >= 0):
+            return None
+        return block, block - self.sram.ram[block]
+
+    def blocks(self):
+        """Returns (address, size, free) for every block in address order."""
+        ram = self.sram.ram
+        result = []
+        block = self.firstBlock
+        while (block < self.end):
+            blockSize = abs(ram[block])
+            result.append((block, blockSize, ram[block] > 0))
+            block += blockSize
+        return result
+
+    def stats(self):
+        """
+        Returns the state of the region and the counters as a dict. Sizes are
+        in words; largestFree is the largest size allocate can satisfy and
+        fragmentation is 1 - largest free block / free words.
+        """
+        ram = self.sram.ram
+        freeWords = freeBlocks = largest = 0
+        for index in range(self.bins):
+            block = ram[self.start + 1 + index]
+            while (block != CONST.EOL):
+                freeWords += ram[block]
+                freeBlocks += 1
+                largest = max(largest, ram[block])
+                block = ram[block + 1]
+        return {"size": self.end - self.start, "freeWords": freeWords,
+                "freeBlocks": freeBlocks,
+                "largestFree": max(largest - TAGS, 0),
+                "fragmentation": 1 - largest/freeWords if freeWords else 0.0,
+                "usedWords": self.usedWords, "highWater": self.highWater,
+                "allocations": self.allocations, "frees": self.frees,
+                "failures": self.failures, "badFrees": self.badFrees,
+                "walks": dict(sorted(self.walks.items()))}
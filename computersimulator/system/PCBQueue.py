@@ -0,0 +1,191 @@
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+
+def lowestLevel(levels):
+    """Returns the lowest level set in a non-empty level bitmap."""
+    return (levels & -levels).bit_length() - 1
+
+
+class PCBQueue:
+    """
+    Priority round robin queue of PCBs with one FIFO bucket per priority
+    level, used for the RQ and the WQ.
+
+    The PCBs stay linked through their next pointer (+0 by default) in one
+    list from the highest priority to the lowest, so the queue can still be
+    walked from head, and through their previous pointer (+20) so any PCB
+    unlinks in O(1). Each level keeps the first and last PCB of its run of that
+    list, and a bitmap of the levels holding a PCB finds the run to insert
+    after, so insert, pop and remove are O(1).
+    """
+
+    def __init__(self, sram, nextWord=0, previousWord=20):
+        """
+        Parameters:
+            sram            SimulatedRAM holding the PCBs
+            nextWord        PCB word linking to the next PCB
+            previousWord    PCB word linking to the previous PCB
+        """
+        self.sram = sram
+        self.nextWord = nextWord
+        self.previousWord = previousWord
+        self.head = CONST.EOL  # First PCB, the next one to run
+        self.firsts = [CONST.EOL]*CONST.PRIORITY_LEVELS
+        self.lasts = [CONST.EOL]*CONST.PRIORITY_LEVELS
+        self.levels = 0  # Bit n set when level n holds a PCB
+        self.members = set()  # Queued PCBs
+
+    def __contains__(self, pcbptr):
+        return pcbptr in self.members
+
+    def __len__(self):
+        return len(self.members)
+
+    def insert(self, pcbptr):
+        """
+        Puts a PCB after every queued PCB of the same or higher priority.
+
+        Raises:
+            ValueError      the PCB's priority is not a valid level
+        """
+        ram = self.sram.ram
+        priority = ram[pcbptr+2]
+        if (priority < 0) or (priority >= CONST.PRIORITY_LEVELS):
+            raise ValueError("Invalid priority %d" % priority)
+        after = self.lasts[priority]
+        if (after == CONST.EOL):
+            self.firsts[priority] = pcbptr
+            higher = self.levels >> (priority + 1)
+            if (higher):
+                after = self.lasts[priority + 1 + lowestLevel(higher)]
+            self.levels |= 1 << priority
+        nextWord, previousWord = self.nextWord, self.previousWord
+        following = self.head if after == CONST.EOL else ram[after+nextWord]
+        ram[pcbptr+nextWord] = following
+        ram[pcbptr+previousWord] = after
+        if (after == CONST.EOL):
+            self.head = pcbptr
+        else:
+            ram[after+nextWord] = pcbptr
+        if (following != CONST.EOL):
+            ram[following+previousWord] = pcbptr
+        self.lasts[priority] = pcbptr
+        self.members.add(pcbptr)
+
+    def pop(self):
+        """
+        Removes the first PCB of the highest priority level.
+
+        Returns:
+            pcbptr          the PCB
+            EOL             the queue is empty
+        """
+        pcbptr = self.head
+        if (pcbptr != CONST.EOL):
+            self.remove(pcbptr)
+        return pcbptr
+
+    def remove(self, pcbptr):
+        """Unlinks a queued PCB."""
+        ram = self.sram.ram
+        priority = ram[pcbptr+2]
+        nextWord, previousWord = self.nextWord, self.previousWord
+        following, previous = ram[pcbptr+nextWord], ram[pcbptr+previousWord]
+        if (previous == CONST.EOL):
+            self.head = following
+        else:
+            ram[previous+nextWord] = following
+        if (following != CONST.EOL):
+            ram[following+previousWord] = previous
+        first = self.firsts[priority] == pcbptr
+        last = self.lasts[priority] == pcbptr
+        if (first) and (last):
+            self.firsts[priority] = self.lasts[priority] = CONST.EOL
+            self.levels &= ~(1 << priority)
+        elif (first):
+            self.firsts[priority] = following
+        elif (last):
+            self.lasts[priority] = previous
+        ram[pcbptr+nextWord] = ram[pcbptr+previousWord] = CONST.EOL
+        self.members.discard(pcbptr)
+
+    def rebuild(self, head):
+        """
+        Rebuilds the levels and previous pointers from a list already linked
+        in priority order, as after a checkpoint restore.
+        """
+        ram = self.sram.ram
+        self.head = head
+        self.firsts = [CONST.EOL]*CONST.PRIORITY_LEVELS
+        self.lasts = [CONST.EOL]*CONST.PRIORITY_LEVELS
+        self.levels = 0
+        self.members = set()
+        previous = CONST.EOL
+        ptr = head
+        while (ptr != CONST.EOL):
+            priority = ram[ptr+2]
+            if (self.firsts[priority] == CONST.EOL):
+                self.firsts[priority] = ptr
+                self.levels |= 1 << priority
+            self.lasts[priority] = ptr
+            ram[ptr+self.previousWord] = previous
+            self.members.add(ptr)
+            previous = ptr
+            ptr = ram[ptr+self.nextWord]
+
+
+class WaitQueue(PCBQueue):
+    """
+    The WQ, also split by wait reason. Besides the WQ list, each PCB is
+    linked into the queue of the reason it waits for through words +21 and
+    +22, in the same priority round robin order, so the next process
+    waiting for a device is found in O(1) whatever else is waiting. The
+    reason (+4) must not change while a PCB is queued.
+    """
+
+    REASONS = (CONST.WAITINGMSG, CONST.WAITINGGET, CONST.WAITINGPUT,
+               CONST.WAITINGDISK, CONST.WAITINGMSGS)
+
+    def __init__(self, sram):
+        super().__init__(sram)
+        self.reasons = {reason: PCBQueue(sram, 21, 22) for reason in self.REASONS}
+
+    def insert(self, pcbptr):
+        """
+        Raises:
+            ValueError      invalid priority or wait reason
+        """
+        reason = self.reasons.get(self.sram.ram[pcbptr+4])
+        if (reason is None):
+            raise ValueError("Invalid wait reason %d" % self.sram.ram[pcbptr+4])
+        super().insert(pcbptr)
+        reason.insert(pcbptr)
+
+    def remove(self, pcbptr):
+        super().remove(pcbptr)
+        self.reasons[self.sram.ram[pcbptr+4]].remove(pcbptr)
+
+    def rebuild(self, head):
+        super().rebuild(head)
+        for reason in self.reasons.values():
+            reason.rebuild(CONST.EOL)
+        ptr = head
+        while (ptr != CONST.EOL):
+            self.reasons[self.sram.ram[ptr+4]].insert(ptr)
+            ptr = self.sram.ram[ptr]
+
+    def nextWaiter(self, reason):
+        """Returns the first PCB waiting for reason, EOL if there is none."""
+        return self.reasons[reason].head
+
+    def waiters(self, reason):
+        """Returns the PCBs waiting for reason, in WQ order."""
+        ram = self.sram.ram
+        pcbs = []
+        ptr = self.reasons[reason].head
+        while (ptr != CONST.EOL):
+            pcbs.append(ptr)
+            ptr = ram[ptr+21]
+        return pcbs
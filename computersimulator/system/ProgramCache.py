@@ -0,0 +1,109 @@
+from array import array
+from collections import OrderedDict
+import os
+from computersimulator.hardware.SimulatedRAM import SimulatedRAM
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+
+def parseProgram(path):
+    """
+    Parses a programs/machinecode text file: "address hexvalue" lines ended
+    by "-1 entryPC".
+
+    Parameters:
+        path            text program
+
+    Returns:
+        tuple           (entry PC, runs) where runs is a list of (address,
+                        array of words) for each run of consecutive
+                        addresses, in address order
+
+    Raises:
+        ValueError      bad line, invalid address or no end of program line
+    """
+    words = {}
+    with open(path, "r") as programFile:
+        for number, programLine in enumerate(programFile, 1):
+            temp = programLine.split(" ")
+            try:
+                addr = int(temp[0])
+                content = int(temp[1], 16)
+            except (ValueError, IndexError):
+                raise ValueError("%s line %d: invalid line" % (path, number))
+            if (addr == CONST.ENDPROG):
+                return content, _runs(words)
+            if (addr < 0) or (addr > 9999):
+                raise ValueError("%s line %d: invalid address %d" % (path, number, addr))
+            words[addr] = content
+    raise ValueError("%s has no end of program line" % path)
+
+
+def _runs(words):
+    runs = []
+    start = previous = None
+    for addr in sorted(words):
+        if (previous is None) or (addr != previous + 1):
+            start = addr
+            runs.append((start, array(SimulatedRAM.WORD_TYPECODE)))
+        runs[-1][1].append(words[addr])
+        previous = addr
+    return runs
+
+
+class ProgramCache:
+    """
+    LRU cache of parsed text programs keyed by path, modification time and
+    size, so loading a program again costs a stat instead of a parse. Bounded
+    by the number of programs and by the words they hold.
+    """
+
+    def __init__(self, maxPrograms=64, maxWords=1 << 20):
+        self.maxPrograms = maxPrograms
+        self.maxWords = maxWords
+        self.programs = OrderedDict()  # (path, mtime, size) -> (entry PC, runs, words)
+        self.words = 0  # Words held by all cached programs
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """
+        Returns the parsed program at path.
+
+        Returns:
+            tuple           (entry PC, runs) as from parseProgram
+            None            the file can't be read or parsed, the caller
+                            should load it the slow way to report why
+        """
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError, ValueError):
+            return None
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        program = self.programs.get(key)
+        if (program is not None):
+            self.hits += 1
+            self.programs.move_to_end(key)
+            return program[0], program[1]
+        self.misses += 1
+        try:
+            entry, runs = parseProgram(path)
+        except (OSError, UnicodeDecodeError, ValueError):
+            return None
+        size = sum(len(words) for start, words in runs)
+        if (size > self.maxWords):
+            return entry, runs
+        self.programs[key] = (entry, runs, size)
+        self.words += size
+        while (len(self.programs) > self.maxPrograms) or (self.words > self.maxWords):
+            self.words -= self.programs.popitem(last=False)[1][2]
+            self.evictions += 1
+        return entry, runs
+
+    def stats(self):
+        """Returns the cache counters as a dict."""
+        return {"programs": len(self.programs), "words": self.words,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
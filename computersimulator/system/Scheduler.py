@@ -0,0 +1,311 @@
+import heapq
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+STRIDE1 = 1 << 20  # Pass a one ticket process advances by per timeslice
+
+
+class PriorityScheduler:
+    """
+    Strict priority round robin, the original scheduler: the RQ is run in
+    order, highest priority first, and every process gets the same
+    timeslice.
+
+    The OS loop calls enqueue, pickNext and timeslice to schedule, and
+    dispatched, ran and exited to keep the metrics. Every ready process
+    stays in the RQ whatever the policy, so the RQ dumps, PID lookups and
+    checkpoints see it; policies keep their own order on the side and
+    rebuild it from the RQ after a restore. Priority 0 is the idle class of
+    the null process, which only runs when nothing else is ready under any
+    policy and is left out of the averages.
+    """
+
+    name = "priority"
+
+    def __init__(self, readyQueue, cpu, quantum=CONST.DFLT_TIMESLICE):
+        """
+        Parameters:
+            readyQueue      PCBQueue holding the ready PCBs
+            cpu             SimulatedCPU whose clock the metrics use
+            quantum         timeslice in clock ticks
+        """
+        self.readyQueue = readyQueue
+        self.sram = readyQueue.sram
+        self.cpu = cpu
+        self.quantum = quantum
+        self.resetStats()
+
+    def resetStats(self):
+        """Clears the metrics, as on boot."""
+        self.processes = {}  # PID -> metrics of the process
+        self.dispatches = 0
+        self.contextSwitches = 0  # Dispatches of a different process
+        self.lastPid = CONST.EOL
+        self.dispatchClock = 0
+
+    def enqueue(self, pcbptr):
+        """Adds a ready PCB."""
+        self._process(pcbptr)
+        self.readyQueue.insert(pcbptr)
+
+    def pickNext(self):
+        """
+        Removes the process to run next from the RQ.
+
+        Returns:
+            pcbptr          the PCB
+            EOL             the RQ is empty
+        """
+        return self.readyQueue.pop()
+
+    def remove(self, pcbptr):
+        """Takes a PCB out of the RQ without running it."""
+        self.readyQueue.remove(pcbptr)
+
+    def rebuild(self):
+        """Resyncs the policy with the RQ after it was replaced."""
+
+    def timeslice(self, pcbptr):
+        """Returns the clock ticks pcbptr may run for once dispatched."""
+        return self.quantum
+
+    def dispatched(self, pcbptr):
+        """Records that pcbptr was given the CPU."""
+        process = self._process(pcbptr)
+        pid = self.sram.ram[pcbptr+3]
+        if (process["firstRun"] is None):
+            process["firstRun"] = self.cpu.clock
+        process["dispatches"] += 1
+        self.dispatches += 1
+        if (pid != self.lastPid):
+            self.contextSwitches += 1
+        self.lastPid = pid
+        self.dispatchClock = self.cpu.clock
+
+    def ran(self, pcbptr, status):
+        """
+        Records the CPU time pcbptr used since it was dispatched.
+
+        Parameters:
+            status          executeProgram's status for the run
+        """
+        self._process(pcbptr)["cpuCycles"] += self.cpu.clock - self.dispatchClock
+
+    def exited(self, pcbptr):
+        """Records that pcbptr terminated."""
+        self._process(pcbptr)["finish"] = self.cpu.clock
+
+    def _process(self, pcbptr):
+        """Returns the metrics of pcbptr's process, adding it if new."""
+        pid = self.sram.ram[pcbptr+3]
+        process = self.processes.get(pid)
+        if (process is None):
+            process = {"priority": self.sram.ram[pcbptr+2],
+                       "arrival": self.cpu.clock, "firstRun": None,
+                       "finish": None, "cpuCycles": 0, "dispatches": 0}
+            self.processes[pid] = process
+        return process
+
+    def metrics(self):
+        """
+        Returns the policy's metrics as a dict. Per process, response is the
+        clock ticks from arrival to first run, turnaround from arrival to
+        termination and cpuShare its part of all the CPU time used. The
+        means and throughput, processes finished per 1000 ticks, leave out
+        the idle class.
+        """
+        total = sum(process["cpuCycles"] for process in self.processes.values())
+        processes = {}
+        responses = []
+        turnarounds = []
+        for pid, process in sorted(self.processes.items()):
+            response = turnaround = None
+            if (process["firstRun"] is not None):
+                response = process["firstRun"] - process["arrival"]
+            if (process["finish"] is not None):
+                turnaround = process["finish"] - process["arrival"]
+            processes[pid] = {"priority": process["priority"],
+                              "arrival": process["arrival"],
+                              "response": response, "turnaround": turnaround,
+                              "cpuCycles": process["cpuCycles"],
+                              "cpuShare": process["cpuCycles"]/total if total else 0.0,
+                              "dispatches": process["dispatches"]}
+            if (process["priority"] > 0):
+                if (response is not None):
+                    responses.append(response)
+                if (turnaround is not None):
+                    turnarounds.append(turnaround)
+        clock = self.cpu.clock or 0
+        return {"policy": self.name, "dispatches": self.dispatches,
+                "contextSwitches": self.contextSwitches,
+                "completed": len(turnarounds),
+                "meanTurnaround": sum(turnarounds)/len(turnarounds) if turnarounds else None,
+                "meanResponse": sum(responses)/len(responses) if responses else None,
+                "throughput": 1000*len(turnarounds)/clock if clock > 0 else 0.0,
+                "processes": processes}
+
+
+class MLFQScheduler(PriorityScheduler):
+    """
+    Multi-level feedback queue. Processes start on the top level and drop a
+    level each time they use up their timeslice, which doubles per level, so
+    processes that block for I/O or messages keep short slices and run
+    first while CPU bound ones run longer between context switches. Every
+    boost clock ticks all processes go back to the top level so none
+    starve. Static priorities only separate the idle class.
+    """
+
+    name = "mlfq"
+
+    def __init__(self, readyQueue, cpu, quantum=CONST.DFLT_TIMESLICE, levels=3,
+                 boost=None):
+        """
+        Parameters:
+            levels          number of levels, the timeslice of level n is
+                            quantum*2**n
+            boost           clock ticks between boosts, defaults to 50
+                            timeslices
+        """
+        if (levels < 1):
+            raise ValueError("MLFQ needs at least one level")
+        self.levelCount = levels
+        self.boost = 50*quantum if boost is None else boost
+        self.levels = {}  # PID -> level
+        self.queues = [{} for _ in range(levels)]  # Ready PCBs of each level, in order
+        self.lastBoost = 0
+        super().__init__(readyQueue, cpu, quantum)
+
+    def _level(self, pcbptr):
+        return self.levels.setdefault(self.sram.ram[pcbptr+3], 0)
+
+    def enqueue(self, pcbptr):
+        super().enqueue(pcbptr)
+        if (self.sram.ram[pcbptr+2] > 0):
+            self.queues[self._level(pcbptr)][pcbptr] = None
+
+    def pickNext(self):
+        if (self.cpu.clock - self.lastBoost >= self.boost):
+            self._boost()
+        for queue in self.queues:
+            if (queue):
+                pcbptr = next(iter(queue))
+                del queue[pcbptr]
+                self.readyQueue.remove(pcbptr)
+                return pcbptr
+        return self.readyQueue.pop()  # Only the idle class is ready
+
+    def _boost(self):
+        self.lastBoost = self.cpu.clock
+        for pid in self.levels:
+            self.levels[pid] = 0
+        top = self.queues[0]
+        for queue in self.queues[1:]:
+            top.update(queue)
+            queue.clear()
+
+    def remove(self, pcbptr):
+        super().remove(pcbptr)
+        for queue in self.queues:
+            queue.pop(pcbptr, None)
+
+    def rebuild(self):
+        self.queues = [{} for _ in range(self.levelCount)]
+        ptr = self.readyQueue.head
+        while (ptr != CONST.EOL):
+            if (self.sram.ram[ptr+2] > 0):
+                self.queues[self._level(ptr)][ptr] = None
+            ptr = self.sram.ram[ptr]
+
+    def timeslice(self, pcbptr):
+        if (self.sram.ram[pcbptr+2] == 0):
+            return self.quantum
+        return self.quantum << self._level(pcbptr)
+
+    def ran(self, pcbptr, status):
+        super().ran(pcbptr, status)
+        if (status == CONST.TIMESLICE) and (self.sram.ram[pcbptr+2] > 0):
+            pid = self.sram.ram[pcbptr+3]
+            self.levels[pid] = min(self._level(pcbptr) + 1, self.levelCount - 1)
+
+    def exited(self, pcbptr):
+        super().exited(pcbptr)
+        self.levels.pop(self.sram.ram[pcbptr+3], None)
+        for queue in self.queues:
+            queue.pop(pcbptr, None)
+
+
+class StrideScheduler(PriorityScheduler):
+    """
+    Stride scheduling, a deterministic form of lottery scheduling. A process
+    holds as many tickets as its priority and runs when its pass is the
+    lowest; its pass then advances by STRIDE1/tickets per timeslice of CPU
+    it used, so over time each process gets CPU in proportion to its
+    priority instead of the highest priority taking all of it. A process
+    that becomes ready again starts no lower than the pass of the last
+    process picked, so sleeping doesn't bank CPU time.
+    """
+
+    name = "stride"
+
+    def __init__(self, readyQueue, cpu, quantum=CONST.DFLT_TIMESLICE):
+        self.passes = {}  # PID -> pass
+        self.heap = []  # (pass, order, pcbptr), stale entries are skipped
+        self.entries = {}  # Ready PCB -> order of its live heap entry
+        self.order = 0
+        self.virtualTime = 0  # Pass of the last process picked
+        super().__init__(readyQueue, cpu, quantum)
+
+    def _push(self, pcbptr):
+        pid = self.sram.ram[pcbptr+3]
+        passValue = max(self.passes.get(pid, 0), self.virtualTime)
+        self.passes[pid] = passValue
+        self.order += 1
+        self.entries[pcbptr] = self.order
+        heapq.heappush(self.heap, (passValue, self.order, pcbptr))
+
+    def enqueue(self, pcbptr):
+        super().enqueue(pcbptr)
+        if (self.sram.ram[pcbptr+2] > 0):
+            self._push(pcbptr)
+
+    def pickNext(self):
+        while (self.heap):
+            passValue, order, pcbptr = heapq.heappop(self.heap)
+            if (self.entries.get(pcbptr) == order):
+                del self.entries[pcbptr]
+                self.virtualTime = passValue
+                self.readyQueue.remove(pcbptr)
+                return pcbptr
+        return self.readyQueue.pop()  # Only the idle class is ready
+
+    def remove(self, pcbptr):
+        super().remove(pcbptr)
+        self.entries.pop(pcbptr, None)
+
+    def rebuild(self):
+        self.heap = []
+        self.entries = {}
+        ptr = self.readyQueue.head
+        while (ptr != CONST.EOL):
+            if (self.sram.ram[ptr+2] > 0):
+                self._push(ptr)
+            ptr = self.sram.ram[ptr]
+
+    def ran(self, pcbptr, status):
+        super().ran(pcbptr, status)
+        tickets = self.sram.ram[pcbptr+2]
+        if (tickets > 0):
+            pid = self.sram.ram[pcbptr+3]
+            used = max(self.cpu.clock - self.dispatchClock, 1)
+            self.passes[pid] = self.passes.get(pid, self.virtualTime) + \
+                STRIDE1//tickets*used//self.quantum
+
+    def exited(self, pcbptr):
+        super().exited(pcbptr)
+        self.passes.pop(self.sram.ram[pcbptr+3], None)
+        self.entries.pop(pcbptr, None)
+
+
+SCHEDULERS = {scheduler.name: scheduler
+              for scheduler in (PriorityScheduler, MLFQScheduler, StrideScheduler)}
@@ -0,0 +1,144 @@
+from bisect import bisect_right, insort
+import computersimulator.constants as constants
+
+CONST = constants.Constants
+
+
+class SharedMemory:
+    """
+    Tracks which processes hold each block allocated with mem_alloc, so a
+    block can be shared or handed to another process without copying it.
+    A block is only returned to the user free list when its last holder
+    frees it or terminates, and no free may release part of it.
+    """
+
+    def __init__(self, allocator):
+        """
+        Parameters:
+            allocator       MemoryAllocator of the user free list
+        """
+        self.allocator = allocator
+        self.regions = {}  # start -> [size, set of holder PIDs]
+        self.holds = {}  # PID -> set of region starts it holds
+        self.starts = []  # Region starts, sorted
+
+    def register(self, start, size, pid):
+        """Records a block just allocated by pid."""
+        self.regions[start] = [size, {pid}]
+        self.holds.setdefault(pid, set()).add(start)
+        insort(self.starts, start)
+
+    def holders(self, start):
+        """Returns the set of PIDs holding the region at start."""
+        region = self.regions.get(start)
+        return set() if region is None else set(region[1])
+
+    def share(self, start, fromPid, toPid, transfer=False):
+        """
+        Gives toPid a hold on a region fromPid holds.
+
+        Parameters:
+            transfer        fromPid gives up its hold
+
+        Returns:
+            OK              shared
+            ER_NMB          fromPid doesn't hold a region at start
+        """
+        region = self.regions.get(start)
+        if (region is None) or (fromPid not in region[1]):
+            return CONST.ER_NMB
+        region[1].add(toPid)
+        self.holds.setdefault(toPid, set()).add(start)
+        if (transfer) and (fromPid != toPid):
+            self._drop(start, fromPid)
+        return CONST.OK
+
+    def release(self, start, size, pid):
+        """
+        Drops pid's hold on a region.
+
+        Returns:
+            OK              the region should be freed now, or start isn't
+                            a region and is freed as usual
+            ER_NMB          start and size aren't a region pid holds, or
+                            the block they'd free overlaps a region
+            None            other processes still hold the region
+        """
+        region = self.regions.get(start)
+        if (region is None):
+            return CONST.ER_NMB if self._overlaps(start) else CONST.OK
+        if (region[0] != size) or (pid not in region[1]):
+            return CONST.ER_NMB
+        self._drop(start, pid)
+        return CONST.OK if start not in self.regions else None
+
+    def releaseAll(self, pid):
+        """
+        Drops every hold of a terminating process.
+
+        Returns:
+            list            (start, size) of the regions to free now
+        """
+        released = []
+        for start in sorted(self.holds.get(pid, ())):
+            size = self.regions[start][0]
+            self._drop(start, pid)
+            if (start not in self.regions):
+                released.append((start, size))
+        return released
+
+    def _overlaps(self, ptr):
+        """True if the block freeing ptr would release overlaps a region."""
+        extent = self.allocator.extent(ptr)
+        if (extent is None):
+            return False  # The allocator rejects it
+        first, end = extent
+        # Regions are disjoint, only the last one starting before end can
+        # reach past first
+        index = bisect_right(self.starts, end) - 1
+        if (index < 0):
+            return False
+        regionExtent = self.allocator.extent(self.starts[index])
+        return (regionExtent is not None) and (regionExtent[1] > first) and \
+            (regionExtent[0] < end)
+
+    def _drop(self, start, pid):
+        region = self.regions[start]
+        region[1].discard(pid)
+        holds = self.holds.get(pid)
+        if (holds is not None):
+            holds.discard(start)
+            if (not holds):
+                del self.holds[pid]
+        if (not region[1]):
+            del self.regions[start]
+            del self.starts[bisect_right(self.starts, start) - 1]
+
+    def words(self):
+        """Returns the regions as a flat list of ints for a checkpoint."""
+        words = [len(self.regions)]
+        for start in sorted(self.regions):
+            size, holders = self.regions[start]
+            words += [start, size, len(holders)] + sorted(holders)
+        return words
+
+    def restore(self, words):
+        """
+        Replaces the regions with those at the start of a list from words.
+
+        Returns:
+            int             number of words used
+        """
+        self.regions = {}
+        self.holds = {}
+        index = 1
+        self.starts = []
+        for _ in range(words[0]):
+            start, size, count = words[index:index + 3]
+            holders = words[index + 3:index + 3 + count]
+            index += 3 + count
+            self.regions[start] = [size, set(holders)]
+            insort(self.starts, start)
+            for pid in holders:
+                self.holds.setdefault(pid, set()).add(start)
+        return index
@@ -0,0 +1,478 @@
+import argparse
+import re
+import sys
+import computersimulator.constants as constants
+from computersimulator.hardware.DispatchEngine import OPCODE_CYCLES
+
+CONST = constants.Constants
+
+# Mnemonic -> opcode, case insensitive
+MNEMONICS = {
+    "halt": CONST.OP_HALT, "add": CONST.OP_ADD, "sub": CONST.OP_SUB,
+    "subtract": CONST.OP_SUB, "mult": CONST.OP_MULT,
+    "multiply": CONST.OP_MULT, "div": CONST.OP_DIV, "divide": CONST.OP_DIV,
+    "move": CONST.OP_MOVE, "branch": CONST.OP_BRANCH,
+    "branchonminus": CONST.OP_BRANCHM, "branchminus": CONST.OP_BRANCHM,
+    "systemcall": CONST.OP_SYSTEM, "branchonplus": CONST.OP_BRANCHP,
+    "branchplus": CONST.OP_BRANCHP, "branchonzero": CONST.OP_BRANCHZ,
+    "branchzero": CONST.OP_BRANCHZ,
+}
+DIRECTIVES = ("origin", "long", "end", "function")
+MNEMONIC_NAMES = {CONST.OP_HALT: "halt", CONST.OP_ADD: "add",
+                  CONST.OP_SUB: "sub", CONST.OP_MULT: "mult",
+                  CONST.OP_DIV: "div", CONST.OP_MOVE: "move",
+                  CONST.OP_BRANCH: "branch", CONST.OP_BRANCHM: "BranchOnMinus",
+                  CONST.OP_SYSTEM: "systemcall", CONST.OP_BRANCHP: "BranchOnPlus",
+                  CONST.OP_BRANCHZ: "BranchOnZero"}
+# Modes whose operand word follows the instruction
+WORD_MODES = (CONST.MODE_DIRECT, CONST.MODE_IMMEDIATE)
+# Modes that change a register when read
+SIDE_EFFECT_MODES = (CONST.MODE_AUTOINC, CONST.MODE_AUTODEC)
+
+REGISTER_PATTERNS = (
+    (re.compile(r"^GPR([0-7])$", re.I), CONST.MODE_REGISTER),
+    (re.compile(r"^\(GPR([0-7])\)$", re.I), CONST.MODE_REGDEFERRED),
+    (re.compile(r"^GPR([0-7])\+\+$", re.I), CONST.MODE_AUTOINC),
+    (re.compile(r"^--GPR([0-7])$", re.I), CONST.MODE_AUTODEC),
+)
+NUMBER = re.compile(r"^-?(0x[0-9a-f]+|[0-9]+)$", re.I)
+SYMBOL = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class AssemblerError(ValueError):
+    """A listing line that can't be assembled."""
+
+    def __init__(self, line, message):
+        super().__init__("line %d: %s" % (line, message))
+        self.line = line
+
+
+class Operand:
+    """
+    One instruction operand. value is the operand word for direct and
+    immediate modes, an int or a symbol resolved when words are emitted.
+    """
+
+    def __init__(self, mode, reg=0, value=None):
+        self.mode = mode
+        self.reg = reg
+        self.value = value
+
+    def sameAs(self, other):
+        return (self.mode, self.reg, self.value) == \
+            (other.mode, other.reg, other.value)
+
+    def pure(self):
+        """True if reading the operand changes nothing."""
+        return self.mode not in SIDE_EFFECT_MODES
+
+    def deferredThrough(self, other):
+        """True if the operand is read through the register other names."""
+        return (self.mode == CONST.MODE_REGDEFERRED) and \
+            (other.mode == CONST.MODE_REGISTER) and (self.reg == other.reg)
+
+    def __str__(self):
+        if (self.mode == CONST.MODE_REGISTER):
+            return "GPR%d" % self.reg
+        if (self.mode == CONST.MODE_REGDEFERRED):
+            return "(GPR%d)" % self.reg
+        if (self.mode == CONST.MODE_AUTOINC):
+            return "GPR%d++" % self.reg
+        if (self.mode == CONST.MODE_AUTODEC):
+            return "--GPR%d" % self.reg
+        if (self.mode == CONST.MODE_IMMEDIATE) and (isinstance(self.value, str)):
+            return "#" + self.value
+        return str(self.value)
+
+
+class Statement:
+    """An instruction or long from the listing."""
+
+    def __init__(self, line, labels, op_code=None, op1=None, op2=None,
+                 target=None, data=None):
+        self.line = line  # Listing line number
+        self.labels = labels
+        self.op_code = op_code  # None for long
+        self.op1 = op1
+        self.op2 = op2
+        self.target = target  # Branch target, int or symbol
+        self.data = data  # Value of a long
+
+    def words(self):
+        """Number of words the statement assembles to."""
+        if (self.op_code is None):
+            return 1
+        count = 1
+        for operand in (self.op1, self.op2):
+            if (operand is not None) and (operand.mode in WORD_MODES):
+                count += 1
+        return count + (self.target is not None)
+
+    def cycles(self):
+        return 0 if self.op_code is None else OPCODE_CYCLES[self.op_code]
+
+    def __str__(self):
+        if (self.op_code is None):
+            return "long %s" % self.data
+        operands = [str(operand) for operand in (self.op1, self.op2)
+                    if operand is not None]
+        if (self.target is not None):
+            operands.append(str(self.target))
+        return ("%s %s" % (MNEMONIC_NAMES[self.op_code], ",".join(operands))).strip()
+
+
+class Program:
+    """An assembled listing: statements from origin on and the entry."""
+
+    def __init__(self, origin, statements, entry):
+        self.origin = origin
+        self.statements = statements
+        self.entry = entry  # Symbol or address execution begins at
+
+
+def parseValue(text, line):
+    """Parses a number, 'c' character constant or symbol."""
+    if (NUMBER.match(text)):
+        return int(text, 0) if "x" in text.lower() else int(text)
+    if (len(text) == 3) and (text[0] == text[2] == "'"):
+        return ord(text[1])
+    if (SYMBOL.match(text)):
+        return text
+    raise AssemblerError(line, "invalid value %s" % text)
+
+
+def parseOperand(text, line, destination=False):
+    """
+    Parses an operand: GPRn, (GPRn), GPRn++, --GPRn, a number or 'c'
+    (immediate), #symbol (immediate address of symbol) or symbol (direct).
+    """
+    for pattern, mode in REGISTER_PATTERNS:
+        match = pattern.match(text)
+        if (match):
+            return Operand(mode, int(match.group(1)))
+    if (text.startswith("#")):
+        operand = Operand(CONST.MODE_IMMEDIATE, 0, parseValue(text[1:], line))
+    else:
+        value = parseValue(text, line)
+        mode = CONST.MODE_DIRECT if isinstance(value, str) else CONST.MODE_IMMEDIATE
+        operand = Operand(mode, 0, value)
+    if (destination) and (operand.mode == CONST.MODE_IMMEDIATE):
+        raise AssemblerError(line, "immediate operand %s can't be written" % text)
+    return operand
+
+
+def parseListing(lines):
+    """
+    Parses an assembly listing in the programs/assembly format: optional
+    label in the first column, mnemonic, operands separated by commas, then
+    a free text description. Lines starting with // and the column header
+    are skipped.
+
+    Returns:
+        Program
+
+    Raises:
+        AssemblerError  invalid line
+    """
+    origin = None
+    statements = []
+    labels = []
+    entry = None
+    for number, text in enumerate(lines, 1):
+        stripped = text.strip()
+        if (not stripped) or (stripped.startswith("//")) or \
+                (stripped.startswith("Label")) or (set(stripped) <= set("- ")):
+            continue
+        fields = text.split()
+        label = None
+        if (not text[0].isspace()):
+            label = fields.pop(0)
+        if (not fields):
+            raise AssemblerError(number, "missing mnemonic")
+        mnemonic = fields.pop(0).lower()
+        operandText = ""
+        if (fields) and (mnemonic not in ("halt", "function")):
+            operandText = fields.pop(0)
+        while (operandText.endswith(",")) and (fields):
+            operandText += fields.pop(0)
+        if (mnemonic == "function"):
+            continue
+        if (label is not None):
+            labels.append(label)
+        if (mnemonic == "origin"):
+            if (statements) or (origin is not None):
+                raise AssemblerError(number, "origin must come first")
+            origin = parseValue(operandText, number)
+            if (not isinstance(origin, int)):
+                raise AssemblerError(number, "origin must be a number")
+            continue
+        if (mnemonic == "end"):
+            entry = parseValue(operandText, number)
+            break
+        if (mnemonic == "long"):
+            statements.append(Statement(number, labels, data=parseValue(operandText, number)))
+            labels = []
+            continue
+        if (mnemonic not in MNEMONICS):
+            raise AssemblerError(number, "unknown mnemonic %s" % mnemonic)
+        op_code = MNEMONICS[mnemonic]
+        operands = [part for part in operandText.split(",") if part] if operandText else []
+        statement = Statement(number, labels, op_code)
+        labels = []
+        if (op_code == CONST.OP_HALT):
+            expected = 0
+        elif (op_code == CONST.OP_BRANCH):
+            expected = 1
+            if (operands):
+                statement.target = parseValue(operands[0], number)
+        elif (op_code == CONST.OP_SYSTEM):
+            expected = 1
+            if (operands):
+                statement.op1 = Operand(CONST.MODE_IMMEDIATE, 0,
+                                        parseValue(operands[0], number))
+        elif (op_code in constants.BRANCH_OPCODES):
+            expected = 2
+            if (len(operands) == 2):
+                statement.op1 = parseOperand(operands[0], number)
+                statement.target = parseValue(operands[1], number)
+        else:
+            expected = 2
+            if (len(operands) == 2):
+                statement.op1 = parseOperand(operands[0], number)
+                statement.op2 = parseOperand(operands[1], number, True)
+        if (len(operands) != expected):
+            raise AssemblerError(number, "%s takes %d operands" % (mnemonic, expected))
+        statements.append(statement)
+    if (entry is None):
+        raise AssemblerError(number, "missing end")
+    if (labels):
+        raise AssemblerError(number, "label after the last statement")
+    return Program(origin or 0, statements, entry)
+
+
+class Optimization:
+    """One peephole rewrite, for the savings report."""
+
+    def __init__(self, line, before, after, cycles):
+        self.line = line
+        self.before = before
+        self.after = after  # None if the statement was removed
+        self.cycles = cycles  # Saved each time the statement executes
+
+    def __str__(self):
+        return "line %d: %s -> %s (saves %d cycles per execution)" % (
+            self.line, self.before, self.after or "removed", self.cycles)
+
+
+def _isNoOp(statement):
+    """True if executing the statement only costs cycles."""
+    op_code, op1, op2 = statement.op_code, statement.op1, statement.op2
+    if (op_code == CONST.OP_MOVE):
+        return op1.sameAs(op2) and op1.pure() and op1.mode != CONST.MODE_IMMEDIATE
+    if (op_code in (CONST.OP_ADD, CONST.OP_SUB)):
+        return op1.mode == CONST.MODE_IMMEDIATE and op1.value == 0 and op2.pure()
+    if (op_code in (CONST.OP_MULT, CONST.OP_DIV)):
+        return op1.mode == CONST.MODE_IMMEDIATE and op1.value == 1 and op2.pure()
+    return False
+
+
+def optimize(program):
+    """
+    Peephole optimizes a program in place. Under the cycle model every
+    opcode costs the same whatever its operand modes, so cycles are saved
+    by removing instructions or replacing them with cheaper opcodes:
+        move X,X, add/sub 0,X and mult/div 1,X are removed
+        move A,B then move B,A drops the second move
+        mult 2,X becomes add X,X and mult 0,X becomes move 0,X
+        branches to the next instruction are removed
+        branches to an unconditional branch go to its target instead
+    Removed statements hand their labels to the next statement.
+
+    Returns:
+        list            Optimization per rewrite
+    """
+    report = []
+    threaded = {}  # Statement -> its jump threading Optimization
+    changed = True
+    while (changed):
+        changed = False
+        statements = program.statements
+        index = 0
+        while (index < len(statements)):
+            statement = statements[index]
+            if (statement.op_code is None):
+                index += 1
+                continue
+            following = statements[index + 1] if index + 1 < len(statements) else None
+            before = str(statement)
+            remove = False
+            if (_isNoOp(statement)):
+                remove = True
+            elif (statement.op_code == CONST.OP_MOVE) and (following is not None) and \
+                    (following.op_code == CONST.OP_MOVE) and (not following.labels) and \
+                    (statement.op1.pure()) and (statement.op2.pure()) and \
+                    (statement.op1.mode != CONST.MODE_IMMEDIATE) and \
+                    (not statement.op1.deferredThrough(statement.op2)) and \
+                    (not statement.op2.deferredThrough(statement.op1)) and \
+                    (following.op1.sameAs(statement.op2)) and \
+                    (following.op2.sameAs(statement.op1)):
+                # Second move copies back what the first just copied, unless
+                # the first changed the register the other is read through
+                report.append(Optimization(following.line, str(following), None,
+                                           following.cycles()))
+                del statements[index + 1]
+                changed = True
+                continue
+            elif (statement.op_code == CONST.OP_MULT) and \
+                    (statement.op1.mode == CONST.MODE_IMMEDIATE) and \
+                    (statement.op2.pure()):
+                if (statement.op1.value == 2):
+                    statement.op_code = CONST.OP_ADD
+                    statement.op1 = Operand(statement.op2.mode, statement.op2.reg,
+                                            statement.op2.value)
+                elif (statement.op1.value == 0):
+                    statement.op_code = CONST.OP_MOVE
+            elif (statement.op_code in constants.BRANCH_OPCODES) and \
+                    (statement.target is not None):
+                target = _threadBranch(program, statement.target)
+                if (target != statement.target):
+                    statement.target = target
+                    threaded[statement] = Optimization(statement.line, before,
+                                                       str(statement),
+                                                       OPCODE_CYCLES[CONST.OP_BRANCH])
+                    report.append(threaded[statement])
+                    changed = True
+                if (following is not None) and (statement.target in following.labels) and \
+                        ((statement.op1 is None) or (statement.op1.pure())):
+                    remove = True
+            if (remove) and (following is None) and (statement.labels):
+                # Its labels have nowhere to go, so it stays
+                remove = False
+            if (remove):
+                if (statement in threaded):
+                    # Report the branch once, as removed
+                    optimization = threaded.pop(statement)
+                    report.remove(optimization)
+                    before = optimization.before
+                report.append(Optimization(statement.line, before, None,
+                                           statement.cycles()))
+                if (following is not None):
+                    following.labels = statement.labels + following.labels
+                del statements[index]
+                changed = True
+                continue
+            if (str(statement) != before) and (statement.op_code in
+                                               (CONST.OP_ADD, CONST.OP_MOVE)):
+                report.append(Optimization(statement.line, before, str(statement),
+                                           OPCODE_CYCLES[CONST.OP_MULT]
+                                           - statement.cycles()))
+                changed = True
+            index += 1
+    return report
+
+
+def _threadBranch(program, target):
+    """Follows a chain of unconditional branches from target."""
+    seen = set()
+    while (isinstance(target, str)) and (target not in seen):
+        seen.add(target)
+        for statement in program.statements:
+            if (target in statement.labels):
+                if (statement.op_code == CONST.OP_BRANCH) and \
+                        (statement.target != target):
+                    target = statement.target
+                    break
+                return target
+        else:
+            return target
+    return target
+
+
+def assemble(program):
+    """
+    Lays the program out from its origin and encodes it.
+
+    Returns:
+        tuple           (entry PC, list of (address, word), symbol table)
+
+    Raises:
+        AssemblerError  undefined or duplicate symbol, or out of memory
+    """
+    symbols = {}
+    address = program.origin
+    for statement in program.statements:
+        for label in statement.labels:
+            if (label in symbols):
+                raise AssemblerError(statement.line, "duplicate label %s" % label)
+            symbols[label] = address
+        address += statement.words()
+    if (address > 10000):
+        raise AssemblerError(program.statements[-1].line, "program doesn't fit in memory")
+
+    def resolve(value, line):
+        if (isinstance(value, str)):
+            if (value not in symbols):
+                raise AssemblerError(line, "undefined symbol %s" % value)
+            return symbols[value]
+        return value
+
+    words = []
+    address = program.origin
+    for statement in program.statements:
+        if (statement.op_code is None):
+            encoded = [resolve(statement.data, statement.line)]
+        else:
+            op1 = statement.op1 or Operand(0)
+            op2 = statement.op2 or Operand(0)
+            encoded = [(statement.op_code << 16) | (op1.mode << 12) |
+                       (op1.reg << 8) | (op2.mode << 4) | op2.reg]
+            for operand in (statement.op1, statement.op2):
+                if (operand is not None) and (operand.mode in WORD_MODES):
+                    encoded.append(resolve(operand.value, statement.line))
+            if (statement.target is not None):
+                encoded.append(resolve(statement.target, statement.line))
+        for word in encoded:
+            words.append((address, word))
+            address += 1
+    last = program.statements[-1].line if program.statements else 0
+    return resolve(program.entry, last), words, symbols
+
+
+def formatMachineCode(entry, words):
+    """Returns the program in the absoluteLoader text format."""
+    lines = ["%d %s" % (address, hex(word)) for address, word in words]
+    lines.append("%d %s" % (CONST.ENDPROG, hex(entry)))
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Assemble a programs/assembly listing into loader format")
+    parser.add_argument("listing", type=str, help="Assembly listing")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Machine code file, defaults to stdout")
+    parser.add_argument("--no-optimize", action="store_true",
+                        help="Skip the peephole optimizations")
+    args = parser.parse_args(argv)
+    try:
+        with open(args.listing) as listingFile:
+            program = parseListing(listingFile)
+        report = [] if args.no_optimize else optimize(program)
+        entry, words, symbols = assemble(program)
+    except AssemblerError as error:
+        print("{}: {}".format(args.listing, error), file=sys.stderr)
+        return 1
+    code = formatMachineCode(entry, words)
+    if (args.output):
+        with open(args.output, "w") as outputFile:
+            outputFile.write(code)
+    else:
+        sys.stdout.write(code)
+    for optimization in report:
+        print(optimization, file=sys.stderr)
+    print("{} words, estimated savings {} cycles per pass over the rewritten code".format(
+        len(words), sum(optimization.cycles for optimization in report)), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,7 @@
+WORD_BIAS = 1 << 63  # Offset of the most negative signed 64 bit word
+WORD_MASK = (1 << 64) - 1
+
+
 def extractBits(number, numBits, position):
     """
     Extract bits from a large number and return the number.
@@ -11,3 +15,34 @@ def extractBits(number, numBits, position):
         int             the int of the extracted bits
     """
     return ( (1 << numBits) - 1 & (number >> (position-1)) )
+
+
+def truncatedDivide(dividend, divisor):
+    """
+    Integer division rounding toward zero, the way a fixed width CPU divides.
+
+    Parameters:
+        dividend        the number to divide
+        divisor         the number to divide by, must not be zero
+
+    Returns:
+        int             the quotient with any remainder dropped
+    """
+    quotient = abs(dividend) // abs(divisor)
+    if ((dividend < 0) != (divisor < 0)):
+        return -quotient
+    return quotient
+
+
+def wrapWord(number):
+    """
+    Wraps an int to a signed 64 bit word, the way a fixed width ALU
+    overflows.
+
+    Parameters:
+        number          the number to wrap
+
+    Returns:
+        int             number modulo 2**64, from -2**63 to 2**63-1
+    """
+    return ((number + WORD_BIAS) & WORD_MASK) - WORD_BIAS
@@ -0,0 +1,43 @@
+import unittest
+
+from computersimulator.hardware.SimulatedCPU import SimulatedCPU, ENGINES
+from computersimulator.utils.bitutils import wrapWord
+
+
+def run(engine, words):
+    """Runs words loaded at address 0 and returns the resulting state."""
+    cpu = SimulatedCPU(engine)
+    cpu.sram.load(0, words)
+    cpu.pc = 0
+    cpu.clock = 0
+    status = cpu.executeProgram(lambda sysCallID: 0)
+    return status, cpu.clock, cpu.pc, list(cpu.gpr), cpu.sram.ram[100]
+
+
+class OverflowTest(unittest.TestCase):
+    """ALU results wrap to signed 64 bit words on every engine."""
+
+    PROGRAMS = {
+        # move 2**40,GPR1; mult GPR1,GPR1; move GPR1,100; halt
+        "mult": [0x55011, 2**40, 0x31111, 0x51100, 100, 0],
+        # move 2**63-1,GPR1; add 1,GPR1; move GPR1,100; halt
+        "add": [0x55011, 2**63 - 1, 0x15011, 1, 0x51100, 100, 0],
+        # move -2**63,GPR1; sub 1,GPR1; move GPR1,100; halt
+        "sub": [0x55011, -2**63, 0x25011, 1, 0x51100, 100, 0],
+        # move -2**63,GPR1; div -1,GPR1; move GPR1,100; halt
+        "div": [0x55011, -2**63, 0x45011, -1, 0x51100, 100, 0],
+    }
+    EXPECTED = {"mult": wrapWord(2**80), "add": -2**63, "sub": 2**63 - 1,
+                "div": -2**63}
+
+    def test_engines_agree(self):
+        for name, words in self.PROGRAMS.items():
+            results = {engine: run(engine, words) for engine in ENGINES}
+            with self.subTest(program=name):
+                self.assertEqual(results["legacy"][4], self.EXPECTED[name])
+                for engine in ENGINES:
+                    self.assertEqual(results[engine], results["legacy"])
+
+
+if __name__ == "__main__":
+    unittest.main()